@@ -6,6 +6,10 @@ from datetime import datetime, timedelta
 import pandas as pd
 import json
 import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from thor_common import HTTP_CACHE, PROXY_HEALTH, RATE_REGISTRY, RETRY_POLICY, SESSION_POOL, PageAccumulator, ProxyHealth, RetryPolicy, SourceKeyPlan, SessionPool, TokenBucket, commit_seen, iter_pipeline, listing_versions, pause, request_error_name, task_blocked, task_errors, task_event
 
 pd.set_option('display.max_columns', None)
 pd.set_option('display.max_rows', None)
@@ -97,9 +101,9 @@ def check_blocked(session, timeout=5):
 # ### Autotrader Searching Functions
 
 # %%
-def GetSearchListings(session, search_terms, timeout=(5, 5), sleep_time=5, max_pages=1):
+def IterSearchListings(session, search_terms, timeout=(5, 5), sleep_time=5, max_pages=1, rate_limiter=None, retry_policy=None):
     """
-    Fetches search listings from AutoTrader based on specified search criteria.
+    Fetches search listings from AutoTrader page by page, yielding each page as soon as it arrives.
 
     Parameters:
     - session: A requests.Session object for making HTTP requests.
@@ -113,13 +117,16 @@ def GetSearchListings(session, search_terms, timeout=(5, 5), sleep_time=5, max_p
     - timeout: A tuple specifying the connect and read timeout durations in seconds (default is (5, 5)).
     - sleep_time: Time to wait between requests in seconds (default is 5).
     - max_pages: Maximum number of pages to fetch (default is 1).
+    - rate_limiter: Optional thor_common.AdaptiveRate (or TokenBucket) that paces the pages instead of sleep_time.
+    - retry_policy: thor_common.RetryPolicy for a failed page (default is RETRY_POLICY).
 
-    Returns:
-    - A tuple containing:
-        - search_results: A DataFrame with the search results.
-        - errors: A list of errors encountered during the search.
+    Yields:
+    - A tuple for every page containing:
+        - page_results: A DataFrame with the results of the page, including the thor_* fields.
+        - errors: A list of errors encountered on the page. When a page still fails after its retries, page_results
+          is empty and the search skips to the next page. It stops if the first page fails or the session is blocked.
     """
-    print("Function: GetSearchListings")
+    print("Function: IterSearchListings")
 
 
     url = "https://www.autotrader.com/rest/lsc/listing"
@@ -143,6 +150,51 @@ def GetSearchListings(session, search_terms, timeout=(5, 5), sleep_time=5, max_p
         "credentials": "include"
     }
 
+    retry_policy = retry_policy or RETRY_POLICY
+
+    def fetch_page(params, page_num):
+        cache_key = HTTP_CACHE.key(url, params)
+        try:
+            # Perform the GET request, conditional on the validators of the last identical search
+            response = session.get(url, params=params, headers={**headers, **HTTP_CACHE.validators(cache_key)}, cookies=None, timeout=timeout)
+            response.raise_for_status()  # Raises an HTTPError for bad responses
+            print(f'Successful response for page {page_num}')
+        except requests.Timeout:
+            error_info = {
+                "ErrorName": "Timeout",
+                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                "ErrorDescription": f'Timeout error on page {page_num}'
+            }
+            print(error_info["ErrorDescription"])
+            return None, [error_info]
+        except requests.RequestException as e:
+            error_info = {
+                "ErrorName": request_error_name(e),
+                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                "ErrorDescription": f'Error on page {page_num}: {e}'
+            }
+            print(error_info["ErrorDescription"])
+            return None, [error_info]
+
+        try:
+            not_modified = HTTP_CACHE.not_modified(cache_key, response)
+            json_data = HTTP_CACHE.get(cache_key) if not_modified else response.json()
+            json_items = json_data['listings']
+            results_count = json_data['totalResultCount']
+            if not_modified:
+                print(f'Page {page_num} not modified')
+            else:
+                HTTP_CACHE.store(cache_key, response, json_data)
+        except (json.JSONDecodeError, KeyError) as e:
+            error_info = {
+                "ErrorName": "JSONDecodeError" if isinstance(e, json.JSONDecodeError) else "KeyError",
+                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                "ErrorDescription": f'Error parsing response JSON on page {page_num}: {e}'
+            }
+            print(error_info["ErrorDescription"])
+            return None, [error_info]
+        return (json_items, results_count), []
+
     num_records = 100
     first_record = 0
     page_num = 1
@@ -150,8 +202,6 @@ def GetSearchListings(session, search_terms, timeout=(5, 5), sleep_time=5, max_p
     results_returned = 0
     total_returned = 0
     results_count = 1000
-    search_results = pd.DataFrame()
-    errors = []
     while total_returned < results_count and page_num <= max_pages:
 
         search_keys = {
@@ -213,91 +263,111 @@ def GetSearchListings(session, search_terms, timeout=(5, 5), sleep_time=5, max_p
         #     "numRecords": num_records
         # }
         
-        try:
-            # Perform the GET request
-            response = session.get(url, params=params, headers=headers, cookies=None, timeout=timeout)
-            response.raise_for_status()  # Raises an HTTPError for bad responses
-            print(f'Successful response for page {page_num}')
-        except requests.Timeout:
-            error_info = {
-                "ErrorName": "Timeout",
-                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "ErrorDescription": f'Timeout error on page {page_num}'
-            }
-            print(error_info["ErrorDescription"])
-            errors.append(error_info)
-            break  # Exit loop on timeout
-        except requests.RequestException as e:
-            error_info = {
-                "ErrorName": "RequestException",
-                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "ErrorDescription": f'Error on page {page_num}: {e}'
-            }
-            print(error_info["ErrorDescription"])
-            errors.append(error_info)
-            break  # Exit loop on request exception
-
-        try:
-            json_data = response.json()
-            json_items = json_data['listings']
+        page, errors = retry_policy.call(fetch_page, params, page_num)
+        if errors:
+            yield pd.DataFrame(), errors
+            if page_num == 1 or RetryPolicy.fatal(errors):
+                break  # Nothing to page through without the first page, and no point going on when blocked
+            # Skip the failed page and keep going with the next one
+            results_returned = num_records
+        else:
+            json_items, results_count = page
             results_returned = len(json_items)
             total_returned += results_returned
-            results_count = json_data['totalResultCount']
             print(f'Page {page_num} Returned: {results_returned} Total: {total_returned} results so far out of {results_count} total.')
-        except (json.JSONDecodeError, KeyError) as e:
-            error_info = {
-                "ErrorName": "JSONDecodeError" if isinstance(e, json.JSONDecodeError) else "KeyError",
-                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "ErrorDescription": f'Error parsing response JSON on page {page_num}: {e}'
-            }
-            print(error_info["ErrorDescription"])
-            errors.append(error_info)
-            break  # Exit loop on JSON error
 
-        if not results_returned:
-            print('No results returned')
-            break # Exit loop on no results
-        elif total_returned < results_count:
+            if not results_returned:
+                print('No results returned')
+                break # Exit loop on no results
+
+            page_results = pd.json_normalize(json_items)
+            if 'id' in page_results.columns:
+                search_url = ""#search_terms['Search Url'] #'"' + '", "'.join(body['options']['body']) + '"'
+                page_results['thor_timestamp'] = int(time.time())
+                page_results['thor_website'] = "autotrader.com"
+                page_results['thor_search_url'] = search_url
+                page_results['thor_full_listing_url'] = 'https://www.autotrader.com/cars-for-sale/vehicle/' + page_results['id'].astype(str)
+                page_results['thor_listing_url'] = 'https://www.autotrader.com/cars-for-sale/vehicle/' + page_results['id'].astype(str)
+
+            yield page_results, []
+
+        if total_returned < results_count:
             page_num += 1
             first_record += results_returned
             params['newSearch'] = False
             params['firstRecord'] = first_record
-            time.sleep(sleep_time) # Sleep only if there are more results
+            if page_num <= max_pages:
+                pause(sleep_time, rate_limiter) # Sleep only if there are more pages to fetch
+
+
+def GetSearchListings(session, search_terms, timeout=(5, 5), sleep_time=5, max_pages=1, pages=None, rate_limiter=None):
+    """
+    Fetches search listings from AutoTrader based on specified search criteria.
+
+    Collects every page from IterSearchListings into a single DataFrame.
+
+    Parameters:
+    - session: A requests.Session object for making HTTP requests.
+    - search_terms: A dictionary containing search parameters (see IterSearchListings).
+    - timeout: A tuple specifying the connect and read timeout durations in seconds (default is (5, 5)).
+    - sleep_time: Time to wait between requests in seconds (default is 5).
+    - max_pages: Maximum number of pages to fetch (default is 1).
+    - pages: An already started IterSearchListings iterator to collect instead of starting a new search
+             (e.g. after first_page_blocked read its first page).
+    - rate_limiter: Optional thor_common.AdaptiveRate (or TokenBucket) that paces the pages instead of sleep_time.
+
+    Returns:
+    - A tuple containing:
+        - search_results: A DataFrame with the search results.
+        - errors: A list of errors encountered during the search.
+    """
+    print("Function: GetSearchListings")
+
 
-        search_results = pd.concat([search_results, pd.json_normalize(json_items)])
+    if pages is None:
+        pages = IterSearchListings(session, search_terms, timeout=timeout, sleep_time=sleep_time, max_pages=max_pages, rate_limiter=rate_limiter)
 
-        print(search_results.shape)
-        if not search_results.empty and 'id' in search_results.columns:
-            search_results.reset_index(drop=True, inplace=True)
-            search_results = search_results.drop_duplicates(subset='id')
-            print(search_results.shape)
+    results = PageAccumulator(key='id')
+    errors = []
+    for page_results, page_errors in pages:
+        results.add(page_results)
+        errors.extend(page_errors)
 
-            search_url = ""#search_terms['Search Url'] #'"' + '", "'.join(body['options']['body']) + '"'
-            search_results['thor_timestamp'] = int(time.time())
-            search_results['thor_website'] = "autotrader.com"
-            search_results['thor_search_url'] = search_url
-            search_results['thor_full_listing_url'] = 'https://www.autotrader.com/cars-for-sale/vehicle/' + search_results['id'].astype(str)
-            search_results['thor_listing_url'] = 'https://www.autotrader.com/cars-for-sale/vehicle/' + search_results['id'].astype(str)
+    search_results = results.to_frame()
+    print(search_results.shape)
 
     return search_results, errors
 
 
-def GetListingDetails(session, listing_ids, timeout=(5, 5), sleep_time=5):
+def build_listing_details(json_items):
     """
-    Fetches detailed information for specific listings from AutoTrader based on listing IDs.
+    Builds the listing details DataFrame from the 'listings' items of a detail response, including the thor_* fields.
+    """
+    listing_details = pd.DataFrame()
+    if json_items:
+        listing_details = pd.json_normalize(json_items)
+        listing_details['thor_timestamp'] = int(time.time())
+        listing_details['thor_website'] = "autotrader.com"
+    return listing_details
+
+
+def GetListingDetail(session, id, timeout=(5, 5), detail_cache=None, version=None):
+    """
+    Fetches detailed information for a single listing from AutoTrader.
 
     Parameters:
     - session: A requests.Session object for making HTTP requests.
-    - listing_ids: A list of listing IDs for which details are to be fetched.
+    - id: The listing ID for which details are to be fetched.
     - timeout: A tuple specifying the connect and read timeout durations in seconds (default is (5, 5)).
-    - sleep_time: Time to wait between requests in seconds (default is 5).
+    - detail_cache: Optional thor_common.DetailCache the successful response is stored in.
+    - version: The version the response is stored under in detail_cache (the lastModified of the listing).
 
     Returns:
     - A tuple containing:
-        - listing_details: A DataFrame with detailed information of the listings.
-        - errors: A list of errors encountered during the process.
+        - listing_details: A DataFrame with the details of the listing, including the thor_* fields (empty on error).
+        - errors: A list of errors encountered for the listing.
     """
-    print('Function: GetListingDetails')
+    print('Function: GetListingDetail')
 
 
     params = {}
@@ -317,141 +387,262 @@ def GetListingDetails(session, listing_ids, timeout=(5, 5), sleep_time=5):
         "tracestate": "1190893@nr=0-1-1543670-910308770-8adbdabe1f07ee34----1719681573104"
     }
 
-    errors = []
-    listing_details = pd.DataFrame()
-    json_items = []
+    url = f"https://www.autotrader.com/rest/lsc/listing/id/{id}"
+    try:
+        response = session.get(url, params=params, headers=headers, cookies=None, timeout=timeout)
+        response.raise_for_status()  # Raises an HTTPError for bad responses
+        print(f'Successful response for listing {id}')
+    except requests.Timeout:
+        error_info = {
+            "ErrorName": "Timeout",
+            "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "ErrorDescription": f'Timeout error on listing {id}'
+        }
+        print(error_info["ErrorDescription"])
+        return pd.DataFrame(), [error_info]
+    except requests.RequestException as e:
+        error_info = {
+            "ErrorName": request_error_name(e),
+            "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "ErrorDescription": f'Error on listing {id}: {e}'
+        }
+        print(error_info["ErrorDescription"])
+        return pd.DataFrame(), [error_info]
+
+    try:
+        json_data = response.json()
+        json_items = json_data['listings']
+        results_returned = len(json_items)
+        # results_count = json_data['totalResultCount']
+        print(f'Returned: {results_returned} for listing {id}.')
+    except (json.JSONDecodeError, KeyError) as e:
+        error_info = {
+            "ErrorName": "JSONDecodeError" if isinstance(e, json.JSONDecodeError) else "KeyError",
+            "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "ErrorDescription": f'Error parsing response JSON: {e}'
+        }
+        print(error_info["ErrorDescription"])
+        return pd.DataFrame(), [error_info]
+
+    if detail_cache is not None and results_returned:
+        detail_cache.put("autotrader.com", id, json_items, version)
+
+    return build_listing_details(json_items), []
+
+
+def split_cached_details(listing_ids, detail_cache, versions):
+    """
+    Splits listing_ids into the listings already in detail_cache and the ids that still have to be fetched.
+
+    Returns:
+    - A tuple containing:
+        - cached: A list of (listing_id, listing_details) for the cache hits.
+        - listing_ids: The ids to fetch, in their original order.
+    """
+    if detail_cache is None:
+        return [], listing_ids
+    hits, listing_ids = detail_cache.split("autotrader.com", listing_ids, versions)
+    print(f'Detail cache hits: {len(hits)}, to fetch: {len(listing_ids)}')
+    return [(id, build_listing_details(json_items)) for id, json_items in hits.items()], listing_ids
+
+
+def IterListingDetails(session, listing_ids, timeout=(5, 5), sleep_time=5, detail_cache=None, versions=None, rate_limiter=None, retry_policy=None):
+    """
+    Fetches detailed information for specific listings from AutoTrader, yielding each listing as soon as it arrives.
+
+    Parameters:
+    - session: A requests.Session object for making HTTP requests.
+    - listing_ids: A list of listing IDs for which details are to be fetched.
+    - timeout: A tuple specifying the connect and read timeout durations in seconds (default is (5, 5)).
+    - sleep_time: Time to wait between requests in seconds (default is 5).
+    - detail_cache: Optional thor_common.DetailCache. Cached listings are yielded first without a request,
+                    and fetched listings are stored in it.
+    - versions: Optional {listing_id: lastModified} used to skip stale cache entries.
+    - rate_limiter: Optional thor_common.AdaptiveRate (or TokenBucket) that paces the requests instead of sleep_time.
+    - retry_policy: thor_common.RetryPolicy for a failed listing (default is RETRY_POLICY).
+
+    Yields:
+    - A tuple for every listing id containing:
+        - listing_id: The listing id that was requested.
+        - listing_details: A DataFrame with the details of the listing, including the thor_* fields.
+        - errors: A list of errors encountered for the listing. When a listing still fails after its retries, listing_details
+          is empty and the next ids are still fetched, unless the session is blocked.
+    """
+    print('Function: IterListingDetails')
+
+
+    versions = versions or {}
+    cached, listing_ids = split_cached_details(listing_ids, detail_cache, versions)
+    for id, listing_details in cached:
+        yield id, listing_details, []
 
+    retry_policy = retry_policy or RETRY_POLICY
     for index, id in enumerate(listing_ids):
-        url = f"https://www.autotrader.com/rest/lsc/listing/id/{id}"
-        try:
-            response = session.get(url, params=params, headers=headers, cookies=None, timeout=timeout)
-            response.raise_for_status()  # Raises an HTTPError for bad responses
-            print(f'Successful response for page')
-        except requests.Timeout:
-            error_info = {
-                "ErrorName": "Timeout",
-                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "ErrorDescription": f'Timeout error on page'
-            }
-            print(error_info["ErrorDescription"])
-            errors.append(error_info)
-            return listing_details, errors
-        except requests.RequestException as e:
-            error_info = {
-                "ErrorName": "RequestException",
-                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "ErrorDescription": f'Error on page: {e}'
-            }
-            print(error_info["ErrorDescription"])
-            errors.append(error_info)
-            return listing_details, errors
+        listing_details, errors = retry_policy.call(GetListingDetail, session, id, timeout=timeout, detail_cache=detail_cache, version=versions.get(id))
+        yield id, listing_details, errors
+        if RetryPolicy.fatal(errors):
+            return
 
-        try:
-            json_data = response.json()
-            json_items = json_data['listings']
-            results_returned = len(json_items)
-            # results_count = json_data['totalResultCount']
-            print(f'Returned: {results_returned} out of {len(listing_ids)} total.')
-        except (json.JSONDecodeError, KeyError) as e:
-            error_info = {
-                "ErrorName": "JSONDecodeError" if isinstance(e, json.JSONDecodeError) else "KeyError",
-                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "ErrorDescription": f'Error parsing response JSON: {e}'
-            }
-            print(error_info["ErrorDescription"])
-            errors.append(error_info)
-            return listing_details, errors
-
-        if results_returned:
-            listing_details = pd.concat([listing_details, pd.json_normalize(json_items)])
-            listing_details.reset_index(drop=True, inplace=True)
-            listing_details = listing_details.drop_duplicates(subset='id')
-            print(listing_details.shape)
-            
-            print('Adding standard fields to the DataFrame.')
-            listing_details['thor_timestamp'] = int(time.time())
-            listing_details['thor_website'] = "autotrader.com"
-            
-        
         if not index == len(listing_ids) - 1:
-            time.sleep(sleep_time)
- 
-    return listing_details, errors
+            pause(sleep_time, rate_limiter)
 
-# %% [markdown]
-# ## Standard Formatting
 
-# %%
+def IterListingDetailsConcurrent(session, listing_ids, timeout=(5, 5), sleep_time=5, max_workers=5, rate_limiter=None, detail_cache=None, versions=None, retry_policy=None):
+    """
+    Fetches detailed information for specific listings from AutoTrader with a bounded thread pool.
+
+    Up to max_workers requests are in flight at once. Every request first takes a token from rate_limiter,
+    which replaces the fixed sleep between requests, so the average request rate stays capped no matter
+    how many workers are used.
+
+    Parameters:
+    - session: A requests.Session object for making HTTP requests.
+    - listing_ids: A list of listing IDs for which details are to be fetched.
+    - timeout: A tuple specifying the connect and read timeout durations in seconds (default is (5, 5)).
+    - sleep_time: Average time between requests in seconds, used to build the default rate_limiter (default is 5).
+    - max_workers: Maximum number of requests in flight at once (default is 5).
+    - rate_limiter: A thor_common.TokenBucket shared by the requests. Defaults to one request every sleep_time
+                    seconds with bursts of up to max_workers requests.
+    - detail_cache: Optional thor_common.DetailCache. Cached listings are yielded first without a request,
+                    and fetched listings are stored in it.
+    - versions: Optional {listing_id: lastModified} used to skip stale cache entries.
+    - retry_policy: thor_common.RetryPolicy for a failed listing (default is RETRY_POLICY). Every retry takes a new token.
+
+    Yields:
+    - A tuple for every listing id containing (cached listings first, then the fetched ones in the order of listing_ids):
+        - listing_id: The listing id that was requested.
+        - listing_details: A DataFrame with the details of the listing, including the thor_* fields.
+        - errors: A list of errors encountered for the listing. A failed listing does not stop the others, unless
+          the session is blocked: the listings not requested yet are then cancelled and the iteration stops.
+    """
+    print('Function: IterListingDetailsConcurrent')
+
+
+    if rate_limiter is None:
+        rate_limiter = TokenBucket(rate=1 / sleep_time, capacity=max_workers)
 
+    versions = versions or {}
+    cached, listing_ids = split_cached_details(listing_ids, detail_cache, versions)
+    for id, listing_details in cached:
+        yield id, listing_details, []
 
-def FormatAggregator(ids, results, details, custom, source_key):
+    retry_policy = retry_policy or RETRY_POLICY
+    blocked = threading.Event()
+
+    def fetch(id):
+        rate_limiter.acquire()
+        if blocked.is_set():
+            return None, None
+        listing_details, errors = GetListingDetail(session, id, timeout=timeout, detail_cache=detail_cache, version=versions.get(id))
+        if RetryPolicy.fatal(errors):
+            blocked.set()
+        return listing_details, errors
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(retry_policy.call, fetch, id) for id in listing_ids]
+        try:
+            for id, future in zip(listing_ids, futures):
+                listing_details, errors = future.result()
+                if errors is None:
+                    #Skipped after another worker was blocked
+                    continue
+                yield id, listing_details, errors
+                if RetryPolicy.fatal(errors):
+                    return
+        finally:
+            # Stop queued requests if the consumer stops early
+            for future in futures:
+                future.cancel()
+
+
+def GetListingDetails(session, listing_ids, timeout=(5, 5), sleep_time=5, max_workers=None, rate_limiter=None, detail_cache=None, versions=None, retry_policy=None):
     """
-    Aggregates and formats data from multiple DataFrames based on provided IDs and source key mapping.
+    Fetches detailed information for specific listings from AutoTrader based on listing IDs.
+
+    Collects every listing from IterListingDetails (or IterListingDetailsConcurrent when max_workers is set)
+    into a single DataFrame.
 
     Parameters:
-    ids (list): List of IDs to iterate over and extract data for.
-    results (pd.DataFrame): DataFrame containing results data (not directly used in the function but assumed to be part of locals()).
-    details (pd.DataFrame): DataFrame containing details data (not directly used in the function but assumed to be part of locals()).
-    custom (pd.DataFrame): Default DataFrame to use if no specific DataFrame is mentioned in source_key.
-    source_key (dict): Dictionary mapping target DataFrame columns to source DataFrame columns. The key is the target column name, and the value is a dictionary with the source DataFrame name as key and source column name as value. If value is an empty dictionary, the target column will be filled with None.
+    - session: A requests.Session object for making HTTP requests.
+    - listing_ids: A list of listing IDs for which details are to be fetched.
+    - timeout: A tuple specifying the connect and read timeout durations in seconds (default is (5, 5)).
+    - sleep_time: Time to wait between requests in seconds (default is 5).
+    - max_workers: If set, fetch with a thread pool of this size (default is None, one request at a time).
+    - rate_limiter: Optional thor_common.TokenBucket or AdaptiveRate that paces the requests.
+    - detail_cache: Optional thor_common.DetailCache consulted before the network.
+    - versions: Optional {listing_id: lastModified} used to skip stale cache entries.
+    - retry_policy: thor_common.RetryPolicy for a failed listing (default is RETRY_POLICY).
 
     Returns:
-    pd.DataFrame: A DataFrame with the aggregated and formatted data.
-    
-    Example:
-    source_key = {
-        'column1': {'results': 'source_column1'},
-        'column2': {'details': 'source_column2'},
-        'column3': {},  # This will be filled with None
-        'column4': 'custom',  # This will default to the custom DataFrame
-    }
-
-    Notes:
-    - The function assumes that the DataFrames (results, details) are present in the local scope.
-    - If a source column specified in source_key is not present in the corresponding DataFrame, the resulting column will be filled with None.
-    - The function concatenates the formatted data into a single DataFrame.
+    - A tuple containing:
+        - listing_details: A DataFrame with the details of every listing that was fetched, even if others failed.
+        - errors: A list of errors encountered during the process, one record per failed listing.
     """
-    print('Function: FormatAggregator')
+    print('Function: GetListingDetails')
 
 
-    # Create an empty DataFrame with columns from the keys of source_key
-    formatted_df = pd.DataFrame(columns=source_key.keys())
-    formatted_data = []
-    
-    # Iterate over each id
-    for id_ in ids:
-        row = {}
-        # Iterate over each key in source_key
-        for key, value in source_key.items():
-            if not value:  # If value is an empty dictionary
-                row[key] = value
-                continue
-            
-            if isinstance(value, dict):
-                # Extract the DataFrame and column name
-                df_name, column_name = list(value.items())[0]
-                df = locals().get(df_name)  # Get the DataFrame by its name
-                
-                if df is None or column_name not in df.columns:
-                    row[key] = None
-                else:
-                    # Extract the value from the DataFrame using the id
-                    match = df.loc[df['id'] == id_, column_name]
-                    row[key] = match.values[0] if not match.empty else None
-            else:
-                if key == 'id': # If id, use the current id
-                    row[key] = id_
-                else:
-                    # If the value is not a dictionary, use the provided value directly
-                    row[key] = value
-        
-        # Append the row to the formatted DataFrame
-        formatted_data.append(row)
-    
-    formatted_df = pd.concat([formatted_df, pd.DataFrame(formatted_data)])
-    
-    return formatted_df
+    details = PageAccumulator(key='id')
+    errors = []
+    if max_workers:
+        listing_iter = IterListingDetailsConcurrent(session, listing_ids, timeout=timeout, sleep_time=sleep_time, max_workers=max_workers, rate_limiter=rate_limiter, detail_cache=detail_cache, versions=versions, retry_policy=retry_policy)
+    else:
+        listing_iter = IterListingDetails(session, listing_ids, timeout=timeout, sleep_time=sleep_time, detail_cache=detail_cache, versions=versions, rate_limiter=rate_limiter, retry_policy=retry_policy)
 
+    for id, id_details, id_errors in listing_iter:
+        details.add(id_details)
+        errors.extend(id_errors)
+
+    listing_details = details.to_frame()
+    print(listing_details.shape)
+
+    return listing_details, errors
+
+# %% [markdown]
+# ## Standard Formatting
+
+# %%
+
+
+# Mapping of the standard Listings columns to their source data, compiled once when the script is imported.
+# {'context': ...} entries are filled per call from the current task and user.
+LISTING_SOURCE_KEY = {
+    'title': {'results': 'title'},
+    'id': 'id',
+    'link': {'results': 'thor_listing_url'},
+    'creation_time': {'custom': 'creation_time'},
+    'vehicle_condition': {'results': 'listingType'},
+    'vehicle_color': {'results': 'color.exteriorColorSimple'},
+    'fuel_type': {'results': 'fuelType.name'},
+    'paid_off': {'results': 'financingTypePSX'},
+    'make': {'results': 'makeCode'},
+    'model': {'results': 'modelCode'},
+    'year': {'results': 'year'},
+    'number_owners': '',
+    'seller_type': {'results': 'owner.privateSeller'},
+    'vehicle_trim': {'results': 'trim.name'},
+    'vin': {'results': 'vin'},
+    'listing_photos': {'custom': 'images'},
+    'seller_name': {'results': 'owner.name'},
+    'location': {'custom': 'location'},
+    'location_city': {'results': 'owner.location.address.city'},
+    'location_state': {'results': 'owner.location.address.state'},
+    'location_country': '',
+    'description': {'details': 'fullDescription'},
+    'price': {'results': 'pricingDetail.salePrice'},
+    'strikethrough_price': '',
+    'odometer_unit': {'results': 'mileage.label'},
+    'odometer_value': {'results': 'mileage.value'},
+    'thor_timestamp': {'results': 'thor_timestamp'},
+    'thor_website': "autotrader.com",
+    'thor_mmr': False,
+    'thor_task': {'context': 'thor_task'},
+    'thor_user': {'context': 'thor_user'},
+    'Task': {'context': 'Task'},
+    'Host': {'context': 'Host'},
+    'Account': {'context': 'Account'}
+}
+
+LISTING_PLAN = SourceKeyPlan(LISTING_SOURCE_KEY)
 
 
 def Format_Output(current_task, current_user, search_results, listing_details, ids):
@@ -474,52 +665,14 @@ def Format_Output(current_task, current_user, search_results, listing_details, i
         - user_telemetry (DataFrame): DataFrame containing user telemetry information.
 
     Notes:
-    - The function uses a source key dictionary to map specific fields to their corresponding sources (custom, results, or details).
+    - LISTING_SOURCE_KEY maps specific fields to their corresponding sources (custom, results, details, or the per-call context).
     - It ensures required columns are present in the listing details before processing.
     - Custom data is created by extracting and transforming specific fields such as images, title, and location.
-    - The final Listings DataFrame is generated using the FormatAggregator function.
+    - The final Listings DataFrame is generated by executing LISTING_PLAN, the compiled LISTING_SOURCE_KEY.
     - Task telemetry and user telemetry data are also created and returned as part of the output.
     """
     print('Function: Format_Output')
 
-    
-    source_key = {
-        'title': {'results': 'title'},
-        'id': 'id',
-        'link': {'results': 'thor_listing_url'},
-        'creation_time': {'custom': 'creation_time'},
-        'vehicle_condition': {'results': 'listingType'},
-        'vehicle_color': {'results': 'color.exteriorColorSimple'},
-        'fuel_type': {'results': 'fuelType.name'},
-        'paid_off': {'results': 'financingTypePSX'},
-        'make': {'results': 'makeCode'},
-        'model': {'results': 'modelCode'},
-        'year': {'results': 'year'},
-        'number_owners': '',
-        'seller_type': {'results': 'owner.privateSeller'},
-        'vehicle_trim': {'results': 'trim.name'},
-        'vin': {'results': 'vin'},
-        'listing_photos': {'custom': 'images'},
-        'seller_name': {'results': 'owner.name'},
-        'location': {'custom': 'location'},
-        'location_city': {'results': 'owner.location.address.city'},
-        'location_state': {'results': 'owner.location.address.state'},
-        'location_country': '',
-        'description': {'details': 'fullDescription'},
-        'price': {'results': 'pricingDetail.salePrice'},
-        'strikethrough_price': '',
-        'odometer_unit': {'results': 'mileage.label'},
-        'odometer_value': {'results': 'mileage.value'},
-        'thor_timestamp': {'results': 'thor_timestamp'},
-        'thor_website': "autotrader.com",
-        'thor_mmr': False,
-        'thor_task': f"{current_task}",
-        'thor_user': f"{current_user}",
-        'Task': current_task['TaskName'],
-        'Host': current_task["Host"],
-        'Account': current_user["AccountInfo"]["AccountID"]
-    }
-
 
     results_required_columns = ['id', 'owner.location.address.city', 'owner.location.address.state', 'pricingHistory']
     if all(col in search_results.columns for col in results_required_columns):
@@ -557,7 +710,19 @@ def Format_Output(current_task, current_user, search_results, listing_details, i
     else:
         custom_data = pd.DataFrame(columns=details_required_columns)
 
-    Listings = FormatAggregator(ids, search_results, listing_details, custom_data, source_key)
+    context = {
+        'thor_task': f"{current_task}",
+        'thor_user': f"{current_user}",
+        'Task': current_task['TaskName'],
+        'Host': current_task["Host"],
+        'Account': current_user["AccountInfo"]["AccountID"]
+    }
+    sources = {
+        'results': search_results,
+        'details': listing_details,
+        'custom': custom_data
+    }
+    Listings = LISTING_PLAN.execute(ids, sources, context)
 
     # Create task_telemetry/Will Be phased out
     task_telemetry = Listings
@@ -577,7 +742,65 @@ def Format_Output(current_task, current_user, search_results, listing_details, i
 # ## Run Task
 
 # %%
-def Task_Run(driver, current_profile, current_task, current_user, results_check_callback, user_timer):
+def build_session(current_user):
+    """
+    Builds a new requests session with the default headers and the user's proxy, if one is set.
+
+    Args:
+        current_user (dict): Information about the current user including proxy details.
+
+    Returns:
+        requests.Session: The session.
+    """
+    # Create a session object
+    session = requests.Session()
+    session.headers.update({
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"
+    })
+
+    if current_user['ProxyInfo']['ProxyIp'] != '':
+        proxy = {
+            'http': current_user['ProxyInfo']['ProxyIp'] + ':' + current_user['ProxyInfo']['ProxyPort'],
+            'https':current_user['ProxyInfo']['ProxyIp'] + ':' + current_user['ProxyInfo']['ProxyPort']
+        }
+
+        # Configure the session to use the proxy
+        session.proxies.update(proxy)
+
+    return session
+
+
+def create_session(current_user):
+    """
+    Borrows the requests session for a task from thor_common.SESSION_POOL, keyed by website, proxy and account,
+    so its cookies and open connections are reused across Task_Run calls. The session is built with
+    build_session the first time.
+
+    The proxy is checked through thor_common.PROXY_HEALTH, which caches healthy verdicts for its ttl.
+
+    Args:
+        current_user (dict): Information about the current user including proxy details.
+
+    Returns:
+        tuple: A tuple containing the session (requests.Session) and a boolean indicating if the proxy
+               is working (always True when no proxy is configured).
+    """
+    print('Function: create_session')
+
+
+    session = SESSION_POOL.borrow(SessionPool.key("autotrader.com", current_user), lambda: build_session(current_user))
+
+    if current_user['ProxyInfo']['ProxyIp'] != '':
+        # The icanhazip round trip only runs when the cached verdict has expired or a request failed
+        proxy_set = PROXY_HEALTH.verify(ProxyHealth.key(current_user), ProxyHealth.checker(check_proxy, session.proxies, current_user['ProxyInfo']['ProxyIp']))
+        print('Proxy Set: ', proxy_set)
+    else:
+        proxy_set = True
+
+    return session, proxy_set
+
+
+def Task_Run(driver, current_profile, current_task, current_user, results_check_callback, user_timer, stream=False, detail_workers=None, pipeline=False, detail_cache=None, block_probe=True, adaptive_rate=False):
     """
     Executes a task using the given parameters and handles session management, proxy settings, 
     and result processing.
@@ -587,8 +810,22 @@ def Task_Run(driver, current_profile, current_task, current_user, results_check_
         current_profile (dict): The current profile details.
         current_task (dict): The current task details including search terms.
         current_user (dict): Information about the current user including proxy details.
-        results_check_callback (function): Callback function to check and compare results.
+        results_check_callback (function): Callback function to check and compare results. A thor_common.SeenIndex
+            can be passed as a built-in, persistent callback.
         user_timer (object): Timer object to track user account activity.
+        stream (bool, optional): If True, yield the events of `Task_Run_Stream` instead of a single final tuple.
+        detail_workers (int, optional): Number of listing detail requests in flight at once, paced by a shared
+            token bucket, e.g. 5. None (default) fetches one listing at a time with a fixed sleep.
+        pipeline (bool, optional): If True, run `Task_Run_Pipeline`, which overlaps the search, compare and
+            detail stages and yields the same tuple.
+        detail_cache (DetailCache, optional): A thor_common.DetailCache shared across tasks. Listings already in
+            the cache are not requested again (default is None, always fetch).
+        block_probe (bool, optional): If True (default), run the standalone `check_blocked` probe before
+            searching. If False, the block check is derived from the first search page and the probe only
+            runs when that page fails in an ambiguous way (timeout or connection error), saving one request.
+        adaptive_rate (bool, optional): If True, pace every request with the thor_common.AdaptiveRate of the
+            website and proxy from RATE_REGISTRY instead of the fixed sleeps. The learned interval is saved
+            between runs and reported as 'RequestInterval' in user_telemetry.
 
     Yields:
         tuple: A tuple containing the following elements:
@@ -614,43 +851,30 @@ def Task_Run(driver, current_profile, current_task, current_user, results_check_
     print('Main Funtion: Task_Run')
 
 
+    if stream:
+        yield from Task_Run_Stream(driver, current_profile, current_task, current_user, results_check_callback, user_timer, detail_workers=detail_workers, detail_cache=detail_cache, block_probe=block_probe, adaptive_rate=adaptive_rate)
+        return
+    if pipeline:
+        yield from Task_Run_Pipeline(driver, current_profile, current_task, current_user, results_check_callback, user_timer, detail_workers=detail_workers, detail_cache=detail_cache, block_probe=block_probe, adaptive_rate=adaptive_rate)
+        return
+
     #How to track how long the user account has been active
     user_status = user_timer.status()
     
-    # Create a session object
-    session = requests.Session()
-    session.headers.update({
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"
-    })
-
-    if current_user['ProxyInfo']['ProxyIp'] != '':
-        proxy = {
-            'http': current_user['ProxyInfo']['ProxyIp'] + ':' + current_user['ProxyInfo']['ProxyPort'],
-            'https':current_user['ProxyInfo']['ProxyIp'] + ':' + current_user['ProxyInfo']['ProxyPort']
-        }
-
-        # Configure the session to use the proxy
-        session.proxies.update(proxy)
-        proxy_set = check_proxy(session, current_user['ProxyInfo']['ProxyIp']) 
-        
-        print('Proxy Set: ', proxy_set)
-    else:
-        proxy_set = True
+    session, proxy_set = create_session(current_user)
+    rate_control = RATE_REGISTRY.attach("autotrader.com", current_user, session, interval=2) if adaptive_rate else None
 
 
     #Check if Blocked
-    is_blocked, blocked_errors = check_blocked(session)
-    print(f"is blocked: {is_blocked}")
-    if is_blocked or proxy_set == False:
-        errors = {"Disable": True, "error_data": [blocked_errors]}   
-        print(errors)
-
+    search_pages = IterSearchListings(session, current_task['SearchTerms'], sleep_time=3, max_pages=3, rate_limiter=rate_control)
+    errors, search_pages = task_blocked(session, current_user, proxy_set, search_pages, lambda: check_blocked(session), block_probe)
+    if errors:
         final_results, final_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user, pd.DataFrame(), pd.DataFrame(), [])
         yield final_results, final_details, Listings, task_telemetry, user_telemetry, errors
         return
 
 
-    search_results, errors = GetSearchListings(session, current_task['SearchTerms'], sleep_time=3, max_pages=3)
+    search_results, errors = GetSearchListings(session, current_task['SearchTerms'], sleep_time=3, max_pages=3, pages=search_pages)
     print(errors)
 
     # Check For New Listings
@@ -667,12 +891,16 @@ def Task_Run(driver, current_profile, current_task, current_user, results_check_
 
     #Get listing Details
     if len(new_results) > 0:
-        listing_details, errors = GetListingDetails(session, new_ids, sleep_time=2)
+        versions = listing_versions(search_results, 'lastModified')
+        listing_details, detail_errors = GetListingDetails(session, new_ids, sleep_time=2, max_workers=detail_workers, rate_limiter=rate_control, detail_cache=detail_cache, versions=versions)
+        errors.extend(detail_errors)
     else:
         listing_details = pd.DataFrame()
         
     #Format standard Output
     search_results, listing_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user,  search_results, listing_details, new_ids)
+    commit_seen(results_check_callback, 'autotrader.com', new_ids)
+    RATE_REGISTRY.report(rate_control, user_telemetry)
 
     print(f"{len(search_results)} search_results")
     print(f"{len(listing_details)} listing_details")
@@ -680,10 +908,203 @@ def Task_Run(driver, current_profile, current_task, current_user, results_check_
     print(f"{len(task_telemetry)} task_telemetry")
     print(f"{len(user_telemetry)} user_telemetry")
     print(f"{errors} errors")
-    errors = {}
+    errors = task_errors(session, current_user, errors)
     
     yield search_results, listing_details, Listings, task_telemetry, user_telemetry, errors
 
+
+def Task_Run_Pipeline(driver, current_profile, current_task, current_user, results_check_callback, user_timer, detail_workers=5, detail_cache=None, block_probe=True, adaptive_rate=False):
+    """
+    Pipelined version of Task_Run. Each search page is compared with `results_check_callback` as soon as it
+    arrives and its new listings are queued for their detail requests while later pages are still downloading,
+    so the task takes about as long as the slower of the search and the details instead of both added together.
+
+    Args:
+        Same as Task_Run.
+
+    Yields:
+        tuple: The same tuple as Task_Run.
+    """
+    print('Main Funtion: Task_Run_Pipeline')
+
+
+    #How to track how long the user account has been active
+    user_status = user_timer.status()
+
+    session, proxy_set = create_session(current_user)
+    rate_control = RATE_REGISTRY.attach("autotrader.com", current_user, session, interval=2) if adaptive_rate else None
+
+    #Check if Blocked
+    search_pages = IterSearchListings(session, current_task['SearchTerms'], sleep_time=3, max_pages=3, rate_limiter=rate_control)
+    errors, search_pages = task_blocked(session, current_user, proxy_set, search_pages, lambda: check_blocked(session), block_probe)
+    if errors:
+        final_results, final_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user, pd.DataFrame(), pd.DataFrame(), [])
+        yield final_results, final_details, Listings, task_telemetry, user_telemetry, errors
+        return
+
+    compare_columns = {
+        'id': 'id',
+    }
+    seen_ids = set()
+    versions = {}
+
+    def compare_page(page_results):
+        if page_results.empty:
+            return []
+        versions.update(listing_versions(page_results, 'lastModified') or {})
+        new_results = results_check_callback(page_results, 'autotrader.com', compare_columns)
+        print(f"****************COMPARE PAGE****************** {len(page_results)} Results {len(new_results)} New")
+
+        #ensure no blanks or ids already queued from an earlier page
+        page_new_ids = []
+        for id in new_results['id'].to_list():
+            if id and id not in seen_ids:
+                seen_ids.add(id)
+                page_new_ids.append(id)
+        return page_new_ids
+
+    rate_limiter = rate_control or TokenBucket(rate=1 / 2, capacity=detail_workers or 1)
+
+    blocked = threading.Event()
+
+    def fetch_detail(id):
+        rate_limiter.acquire()
+        if blocked.is_set():
+            return None, None
+        listing_details, errors = GetListingDetail(session, id, detail_cache=detail_cache, version=versions.get(id))
+        if RetryPolicy.fatal(errors):
+            blocked.set()
+        return listing_details, errors
+
+    def fetch_details(id):
+        if detail_cache is not None:
+            cached = detail_cache.get_many("autotrader.com", [id], versions)
+            if id in cached:
+                return build_listing_details(cached[id]), []
+        return RETRY_POLICY.call(fetch_detail, id)
+
+    pages = PageAccumulator(key='id')
+    details = PageAccumulator(key='id')
+    errors = []
+    new_ids = []
+    for stage, *data in iter_pipeline(search_pages, compare_page, fetch_details, max_workers=detail_workers or 1, stop=blocked):
+        if stage == 'page':
+            page_results, page_errors, page_new_ids = data
+            pages.add(page_results)
+            errors.extend(page_errors)
+            new_ids.extend(page_new_ids)
+        else:
+            id, (id_details, id_errors) = data
+            if id_errors is None:
+                #Skipped after the session was blocked
+                continue
+            details.add(id_details)
+            errors.extend(id_errors)
+
+    search_results = pages.to_frame()
+    listing_details = details.to_frame()
+
+    #Format standard Output
+    search_results, listing_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user,  search_results, listing_details, new_ids)
+    commit_seen(results_check_callback, 'autotrader.com', new_ids)
+    RATE_REGISTRY.report(rate_control, user_telemetry)
+
+    print(f"{len(search_results)} search_results")
+    print(f"{len(listing_details)} listing_details")
+    print(f"{len(Listings)} Listings")
+    print(f"{errors} errors")
+    errors = task_errors(session, current_user, errors)
+
+    yield search_results, listing_details, Listings, task_telemetry, user_telemetry, errors
+
+
+def Task_Run_Stream(driver, current_profile, current_task, current_user, results_check_callback, user_timer, detail_workers=5, detail_cache=None, block_probe=True, adaptive_rate=False):
+    """
+    Streaming version of Task_Run. Yields events as each search page and each listing detail arrives,
+    so downstream consumers can start DB writes and alerting before the whole task has finished.
+
+    Args:
+        Same as Task_Run.
+
+    Yields:
+        dict: An event dictionary (see thor_common.task_event) with one of the following 'Event' values:
+            - 'progress': 'Stage' ('search', 'compare' or 'details') with the counts and errors for that step.
+            - 'search_results': 'search_results' (DataFrame) once every search page has been collected.
+            - 'listings': A formatted increment with 'listing_details', 'Listings' and 'task_telemetry'
+              for the listings whose details just arrived.
+            - 'complete': The final 'errors' dictionary in the same shape Task_Run yields, 'user_telemetry'
+              and 'error_data', the list of every error encountered during the task.
+    """
+    print('Main Funtion: Task_Run_Stream')
+
+
+    #How to track how long the user account has been active
+    user_status = user_timer.status()
+
+    session, proxy_set = create_session(current_user)
+    rate_control = RATE_REGISTRY.attach("autotrader.com", current_user, session, interval=2) if adaptive_rate else None
+
+    #Check if Blocked
+    search_pages = IterSearchListings(session, current_task['SearchTerms'], sleep_time=3, max_pages=3, rate_limiter=rate_control)
+    errors, search_pages = task_blocked(session, current_user, proxy_set, search_pages, lambda: check_blocked(session), block_probe)
+    if errors:
+        final_results, final_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user, pd.DataFrame(), pd.DataFrame(), [])
+        yield task_event('complete', errors=errors, user_telemetry=user_telemetry, error_data=errors['error_data'])
+        return
+
+    error_data = []
+
+    pages = PageAccumulator(key='id')
+    for page_num, (page_results, page_errors) in enumerate(search_pages, start=1):
+        pages.add(page_results)
+        error_data.extend(page_errors)
+        yield task_event('progress', Stage='search', Page=page_num, Results=len(page_results), Errors=page_errors)
+
+    search_results = pages.to_frame()
+    yield task_event('search_results', search_results=search_results)
+
+    # Check For New Listings
+    print(f"****************COMPARE DB****************** {len(search_results)} Results")
+    compare_columns = {
+        'id': 'id',
+    }
+    new_results = results_check_callback(search_results, 'autotrader.com', compare_columns)
+    print(f"****************COMPARE DB Complete****************** {len(new_results)} New")
+
+    #get list of new IDs and ensure no blanks or duplicates
+    new_ids = new_results['id'].to_list()
+    new_ids = [*{item for item in new_ids if item}]
+    yield task_event('progress', Stage='compare', Results=len(search_results), New=len(new_ids))
+
+    #Get listing Details and format each listing as soon as it arrives
+    formatted_ids = set()
+    versions = listing_versions(search_results, 'lastModified')
+    if detail_workers:
+        listing_iter = IterListingDetailsConcurrent(session, new_ids, sleep_time=2, max_workers=detail_workers, rate_limiter=rate_control, detail_cache=detail_cache, versions=versions)
+    else:
+        listing_iter = IterListingDetails(session, new_ids, sleep_time=2, detail_cache=detail_cache, versions=versions, rate_limiter=rate_control)
+
+    for index, (id, id_details, id_errors) in enumerate(listing_iter, start=1):
+        error_data.extend(id_errors)
+        yield task_event('progress', Stage='details', Fetched=index, Total=len(new_ids), Errors=id_errors)
+
+        _, listing_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user, search_results, id_details, [id])
+        commit_seen(results_check_callback, 'autotrader.com', [id])
+        formatted_ids.add(id)
+        yield task_event('listings', listing_details=listing_details, Listings=Listings, task_telemetry=task_telemetry)
+
+    # Listings whose details were never fetched are still reported, without details, like Task_Run does
+    remaining_ids = [id for id in new_ids if id not in formatted_ids]
+    if remaining_ids:
+        _, listing_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user, search_results, pd.DataFrame(), remaining_ids)
+        commit_seen(results_check_callback, 'autotrader.com', remaining_ids)
+        yield task_event('listings', listing_details=listing_details, Listings=Listings, task_telemetry=task_telemetry)
+
+    _, _, _, _, user_telemetry = Format_Output(current_task, current_user, pd.DataFrame(), pd.DataFrame(), [])
+    RATE_REGISTRY.report(rate_control, user_telemetry)
+    print(f"{error_data} errors")
+    yield task_event('complete', errors=task_errors(session, current_user, error_data), user_telemetry=user_telemetry, error_data=error_data)
+
 # %% [markdown]
 # ## Testing
 
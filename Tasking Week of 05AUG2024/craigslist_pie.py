@@ -10,6 +10,12 @@ import pandas as pd
 import json
 import requests
 import uuid
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from thor_common import HTTP_CACHE, PROXY_HEALTH, RATE_REGISTRY, RETRY_POLICY, SESSION_POOL, PageAccumulator, ProxyHealth, RetryPolicy, SourceKeyPlan, HostPacer, SessionPool, TokenBucket, commit_seen, iter_pipeline, listing_versions, pause, request_error_name, task_blocked, task_errors, task_event
 
 # import import_ipynb
 # import thor_filters
@@ -79,7 +85,6 @@ def check_blocked(session, timeout=5):
         "Cookie": "cl_b=4|5411c775aa66ff242fc29367d82280f3412d3b62|17197899267o-9M; cl_tocmode=",
         "DNT": "1",
         "Host": "sapi.craigslist.org",
-        "If-Modified-Since": "Tue, 02 Jul 2024 14:59:49 GMT",
         "Origin": "https://wichita.craigslist.org",
         "Referer": "https://wichita.craigslist.org/",
         "Sec-Fetch-Dest": "empty",
@@ -141,127 +146,165 @@ def remove_duplicates(dict_list, key='id'):
     return unique_dicts
 
 
-def DecodeCraigslistData(json_data):
-    maxPostedDate = json_data['data']['decode']['maxPostedDate']
-    minDate = json_data['data']['decode']['minDate']
-    minPostedDate = json_data['data']['decode']['minPostedDate']
-    minPostingId = json_data['data']['decode']['minPostingId']
-    locationDescriptions = json_data['data']['decode']['locationDescriptions']
-    locations = json_data['data']['decode']['locations']
-    areas = json_data['data']['areas']
-    categories = {
-        '145': "cto",
-        '146': "ctd"
-    }
-    category_descriptions = {
-        '145': "cars & trucks - by owner",
-        '146': "cars & trucks - by dealer"
-    }
-    items = json_data['data']['items']
-
+# Craigslist category id -> (category code, category description), keyed by the int id of the search items
+CRAIGSLIST_CATEGORIES = {
+    145: ("cto", "cars & trucks - by owner"),
+    146: ("ctd", "cars & trucks - by dealer")
+}
 
-    decoded_items = []
-    for item in items:
-        
-        #Get the Posting ID
-        PostingId = item[0] + minPostingId
+# Columns produced by DecodeCraigslistColumns, in the order of the decoded records
+CRAIGSLIST_COLUMNS = [
+    'id', 'PostingId', 'Title', 'PostingName', 'PostedDate', 'AreaName', 'SubAreaName', 'locationDescription',
+    'LocationLat', 'LocationLong', 'CategoryId', 'CategoryCode', 'CategoryDescription', 'Miles', 'Price',
+    'PriceFormatted', 'Images', 'Link'
+]
 
-        #get posted date
-        PostedDate_from_min = item[1] + minPostedDate
 
-        #decode location string
-        location_string = item[4]
-        location_id_string, location_lat, location_long = location_string.split('~')
+def decode_location_table(json_data):
+    """
+    Resolve every entry of a search response's location table once.
 
-        #parse and lookup location
-        location = locations[int(location_id_string.split(":")[0])]
+    Args:
+        json_data (dict): The /postings/search/full response.
 
-        #lookup Area name
+    Returns:
+        list: For every location index, a tuple of (area name, sub area name, link prefix). The link prefix is
+              'https://<host>.craigslist.org/[<sub area>/]', or None if the location has no host.
+    """
+    areas = json_data['data']['areas']
+    location_table = []
+    for location in json_data['data']['decode']['locations']:
         area_name = areas[str(location[0])]['name']
+        if len(location) == 3:
+            location_table.append((area_name, location[2], 'https://' + location[1] + '.craigslist.org/' + location[2] + '/'))
+        elif len(location) == 2:
+            location_table.append((area_name, None, 'https://' + location[1] + '.craigslist.org/'))
+        else:
+            location_table.append((area_name, None, None))
+    return location_table
 
-        #lookup location description
-        location_description = locationDescriptions[int(location_id_string.split(":")[1])]
 
-        #get catagory code
-        catagory_code = item[2]
+def DecodeCraigslistColumns(json_data, keep=None):
+    """
+    Decodes the items of a Craigslist search response into columns.
 
-        #get price
-        price_int = item[3]
+    The area and location tables of the response are resolved once, the optional item fields are
+    dispatched by their tag code (4 images, 6 url name, 9 miles, 10 formatted price), and the link
+    prefix is cached per location and category.
 
-        #get optional data
-        listing_url_part = ''
-        listing_miles = None
-        listing_price = None
-        listing_images = []
-        for item_list in item:
-            if isinstance(item_list, list) and len(item_list) > 0 and item_list[0] == 6:
-                listing_url_part = item_list[1]
+    Args:
+        json_data (dict): The /postings/search/full response.
+        keep (set, optional): Only decode the items whose PostingId is in this set.
 
-            if isinstance(item_list, list) and len(item_list) > 0 and item_list[0] == 10:
-                listing_price = item_list[1]
+    Returns:
+        dict: {column name: list of values} for every column in CRAIGSLIST_COLUMNS.
+    """
+    decode = json_data['data']['decode']
+    minPostedDate = decode['minPostedDate']
+    minPostingId = decode['minPostingId']
+    locationDescriptions = decode['locationDescriptions']
+    location_table = decode_location_table(json_data)
+    link_prefixes = {}
+
+    columns = {column: [] for column in CRAIGSLIST_COLUMNS}
+    (ids, posting_ids, titles, posting_names, posted_dates, area_names, sub_area_names, location_descriptions,
+     lats, longs, category_ids, category_codes, category_descriptions, miles, prices, formatted_prices,
+     images, links) = columns.values()
+
+    for item in json_data['data']['items']:
+        PostingId = item[0] + minPostingId
+        if keep is not None and PostingId not in keep:
+            continue
 
-            if isinstance(item_list, list) and len(item_list) > 0 and item_list[0] == 4:
-                listing_images = item_list[1:]
-                listing_images = ['https://images.craigslist.org/' + item.split(":", 1)[1] + '_1200x900.jpg' for item in listing_images]
+        location_id_string, location_lat, location_long = item[4].split('~')
+        location_index, description_index = location_id_string.split(':', 1)
+        location_index = int(location_index)
+        area_name, location_sub_area, link_prefix = location_table[location_index]
+        catagory_code = item[2]
+        catagory_name, catagory_description = CRAIGSLIST_CATEGORIES[catagory_code]
 
-            if isinstance(item_list, list) and len(item_list) > 0 and item_list[0] == 9:
-                listing_miles = item_list[1]
-                
+        #optional data, the last field of each tag wins
+        tagged = {}
+        for element in item[5:]:
+            if element.__class__ is list and element:
+                tagged[element[0]] = element
+        listing_url_part = tagged[6][1] if 6 in tagged else ''
+        image_parts = tagged[4][1:] if 4 in tagged else []
 
-        #Get title
-        if isinstance(item[-1], str):
-            listing_title = item[-1]
+        #Build Link
+        if link_prefix is None:
+            listing_link = ''
         else:
-            listing_title = ''
+            category_prefix = link_prefixes.get((location_index, catagory_code))
+            if category_prefix is None:
+                category_prefix = link_prefixes[(location_index, catagory_code)] = link_prefix + catagory_name + '/d/'
+            listing_link = f"{category_prefix}{listing_url_part}/{PostingId}.html"
+
+        ids.append(PostingId)
+        posting_ids.append(PostingId)
+        titles.append(item[-1] if isinstance(item[-1], str) else '')
+        posting_names.append(listing_url_part)
+        posted_dates.append(item[1] + minPostedDate)
+        area_names.append(area_name)
+        sub_area_names.append(location_sub_area)
+        location_descriptions.append(locationDescriptions[int(description_index)])
+        lats.append(location_lat)
+        longs.append(location_long)
+        category_ids.append(catagory_code)
+        category_codes.append(catagory_name)
+        category_descriptions.append(catagory_description)
+        miles.append(tagged[9][1] if 9 in tagged else None)
+        prices.append(item[3])
+        formatted_prices.append(tagged[10][1] if 10 in tagged else None)
+        images.append(['https://images.craigslist.org/' + image.split(":", 1)[1] + '_1200x900.jpg' for image in image_parts])
+        links.append(listing_link)
+
+    return columns
+
+
+def DecodeCraigslistFrame(json_data, keep=None):
+    """
+    Decodes the items of a Craigslist search response into a DataFrame, built straight from the decoded columns.
 
-        #Build Link
-        if len(location) == 3:
-            # get location sub area
-            location_sub_area = location[2]
+    The columns keep the object dtype so the values stay exactly as decoded (None stays None) until
+    build_search_results infers the final dtypes.
 
-            listing_link = 'https://' + location[1] + '.craigslist.org/'  + location_sub_area + '/' + categories[str(catagory_code)] + '/d/' + listing_url_part + '/' + str(PostingId) + '.html'
-        elif len(location) == 2:
-            location_sub_area = None
-            listing_link = 'https://' + location[1] + '.craigslist.org/' + categories[str(catagory_code)] + '/d/' + listing_url_part + '/' + str(PostingId) + '.html'
-        else:
-            listing_link = ''
+    Args:
+        json_data (dict): The /postings/search/full response.
+        keep (set, optional): Only decode the items whose PostingId is in this set.
 
-        #Add data to dataframe
-        decoded_data = {
-            'id': PostingId,
-            'PostingId': PostingId,
-            'Title': listing_title,
-            'PostingName': listing_url_part,
-            'PostedDate': PostedDate_from_min,
-            'AreaName':area_name,
-            'SubAreaName': location_sub_area,           
-            'locationDescription' :location_description,
-            'LocationLat': location_lat,
-            'LocationLong': location_long,
-            'CategoryId': catagory_code,
-            'CategoryCode': categories[str(catagory_code)],
-            'CategoryDescription': category_descriptions[str(catagory_code)],
-            'Miles': listing_miles,
-            'Price': price_int,
-            'PriceFormatted': listing_price,
-            'Images': listing_images,
-            'Link': listing_link
-        }
+    Returns:
+        pd.DataFrame: One row per item with the CRAIGSLIST_COLUMNS columns.
+    """
+    return pd.DataFrame(DecodeCraigslistColumns(json_data, keep=keep), columns=CRAIGSLIST_COLUMNS, dtype=object)
 
-        decoded_items.append(decoded_data)
-    return decoded_items
 
 
+# Postal codes searched when a task does not set 'Postal Codes' in its SearchTerms.
+# Each code is searched with search_distance 1000, so a few codes cover the country.
+SEARCH_POSTAL_CODES = [
+    '67207',
+    '20009',
+    '93728'
+]
 
-def GetSearchListings(session, search_terms, timeout=(5, 5), sleep_time=3, max_pages=10):
-    print('Function: GetSearchListings')
-    errors = []
 
-    search_postal_codes = [
-        '67207',
-        '20009',
-        '93728'
-    ]
+def GetSearchRegion(session, search_terms, postal_code, timeout=(5, 5), decode=True):
+    """
+    Fetches and decodes the Craigslist search results around one postal code.
+
+    Args:
+        session (requests.Session): The session object to use for the request.
+        search_terms (dict): Dictionary containing the 'Search Text' to query.
+        postal_code (str): The postal code the search is centered on.
+        timeout (tuple): Timeout settings for the HTTP request (connect timeout, read timeout).
+        decode (bool): If False, return the raw response JSON instead of the decoded listings, so the
+                       caller can decode only the listings it needs (see GetNewSearchListings).
+
+    Returns:
+        tuple: The decoded listings (DataFrame, an empty list on error) or the response JSON, and a list of errors.
+    """
+    print('Function: GetSearchRegion')
 
     url = "https://sapi.craigslist.org/web/v8/postings/search/full"
     headers = {
@@ -280,247 +323,590 @@ def GetSearchListings(session, search_terms, timeout=(5, 5), sleep_time=3, max_p
         "referer": "https://wichita.craigslist.org/"
     }
 
-    search_results_json = []
-    page_num = 1 
-    for postal_code in search_postal_codes:
-
-        params = {
-            "batch": "99-0-360-1-0",
-            "bundleDuplicates": "1",
-            "cc": "US",
-            "lang": "en",
-            "postal": postal_code,
-            "query": search_terms['Search Text'],
-            "searchPath": "cta",
-            "search_distance": "1000",
-            "sort": "date"
+    params = {
+        "batch": "99-0-360-1-0",
+        "bundleDuplicates": "1",
+        "cc": "US",
+        "lang": "en",
+        "postal": postal_code,
+        "query": search_terms['Search Text'],
+        "searchPath": "cta",
+        "search_distance": "1000",
+        "sort": "date"
+    }
+
+    cache_key = HTTP_CACHE.key(url, params, decode)
+    try:
+        # Conditional on the validators of the last identical search
+        response = session.get(url, headers={**headers, **HTTP_CACHE.validators(cache_key)}, params=params, timeout=timeout)
+        response.raise_for_status()  # Raises an HTTPError for bad responses
+        print(f'Successful response for postal code {postal_code}')
+    except requests.Timeout:
+        error_info = {
+            "ErrorName": "Timeout",
+            "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "ErrorDescription": f'Timeout error on postal code {postal_code}'
         }
+        print(error_info["ErrorDescription"])
+        return [], [error_info]
+    except requests.RequestException as e:
+        error_info = {
+            "ErrorName": request_error_name(e),
+            "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "ErrorDescription": f'Error on postal code {postal_code}: {e}'
+        }
+        print(error_info["ErrorDescription"])
+        return [], [error_info]
 
-        try:
-            response = session.get(url, headers=headers, params=params, timeout=timeout)
-            response.raise_for_status()  # Raises an HTTPError for bad responses
-            print(f'Successful response for page {page_num}')
-        except requests.Timeout:
-            error_info = {
-                "ErrorName": "Timeout",
-                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "ErrorDescription": f'Timeout error on page {page_num}'
-            }
-            print(error_info["ErrorDescription"])
-            errors.append(error_info)
-            break  # Exit loop on timeout
-        except requests.RequestException as e:
-            error_info = {
-                "ErrorName": "RequestException",
-                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "ErrorDescription": f'Error on page {page_num}: {e}'
-            }
-            print(error_info["ErrorDescription"])
-            errors.append(error_info)
-            break  # Exit loop on request exception
+    if HTTP_CACHE.not_modified(cache_key, response):
+        print(f'Postal code {postal_code} not modified, reusing the last decoded response')
+        results_data = HTTP_CACHE.get(cache_key)
+        # Decoded listings get thor_* columns added downstream, so hand out copies
+        return (results_data.copy() if decode else results_data), []
 
-        try:
-            json_data = response.json()
-            results_data = DecodeCraigslistData(json_data)
-            print(f'Page Returned Data: {len(results_data)}')
-        except (json.JSONDecodeError, KeyError) as e:
-            error_info = {
-                "ErrorName": "JSONDecodeError" if isinstance(e, json.JSONDecodeError) else "KeyError",
-                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "ErrorDescription": f'Error parsing response JSON on page {page_num}: {e}'
-            }
-            print(error_info["ErrorDescription"])
-            errors.append(error_info)
-            break  # Exit loop on JSON error
+    try:
+        json_data = response.json()
+        if decode:
+            results_data = DecodeCraigslistFrame(json_data)
+        else:
+            results_data = json_data
+        print(f"Postal code {postal_code} Returned Data: {len(json_data['data']['items'])}")
+    except (json.JSONDecodeError, KeyError) as e:
+        error_info = {
+            "ErrorName": "JSONDecodeError" if isinstance(e, json.JSONDecodeError) else "KeyError",
+            "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "ErrorDescription": f'Error parsing response JSON on postal code {postal_code}: {e}'
+        }
+        print(error_info["ErrorDescription"])
+        return [], [error_info]
 
-        #append list together
-        search_results_json = [*search_results_json, *results_data]
+    HTTP_CACHE.store(cache_key, response, results_data.copy() if decode else results_data)
 
-        if not len(results_data):
-            print('No results returned')
-            break # Exit loop on no results
-        elif page_num < len(search_postal_codes):
-            page_num += 1
-            time.sleep(sleep_time) # Sleep only if there are more results
-            
-
-    #remove any duplicates
-    print('remove_duplicates', len(search_results_json))
-    search_results_json = remove_duplicates(search_results_json)
-    print('remaining values', len(search_results_json))
-    
-    return search_results_json, errors
+    return results_data, []
 
 
+def IterSearchListings(session, search_terms, timeout=(5, 5), sleep_time=3, max_pages=10, postal_codes=None, max_workers=None, rate_limiter=None, decode=True, retry_policy=None):
+    """
+    Fetches Craigslist search results one postal code region at a time, yielding each region as soon as it arrives.
 
-def GetListingDetails(session, listing_ids, timeout=(5, 5), sleep_time=3):
+    Args:
+        session (requests.Session): The session object to use for the requests.
+        search_terms (dict): Dictionary containing the 'Search Text' to query and optionally the
+                             'Postal Codes' (list) to search around.
+        timeout (tuple): Timeout settings for the HTTP requests (connect timeout, read timeout).
+        sleep_time (int): Time in seconds to sleep between requests.
+        max_pages (int): Not used, every postal code region is one page.
+        postal_codes (list, optional): Postal codes to search. Defaults to search_terms['Postal Codes'],
+                                       then SEARCH_POSTAL_CODES.
+        max_workers (int, optional): If set, search up to this many regions at once under rate_limiter
+                                     and yield the regions in the order they return.
+        rate_limiter (TokenBucket, optional): Shared rate cap for the concurrent mode. Defaults to one
+                                              request every sleep_time seconds with bursts of max_workers.
+                                              One region at a time, it replaces the sleep_time between regions.
+        decode (bool): If False, yield the raw response JSON of each region instead of the decoded listings.
+        retry_policy (RetryPolicy, optional): Retries a failed region. Defaults to RETRY_POLICY.
 
-    errors = []
-    # listing_details = pd.DataFrame()
-    listing_details_json = []
-    page_num = 1
-    for listing_info in listing_ids:
-
-        if not listing_info['SubAreaName']:
-            listing_info['SubAreaName'] = '-'
-            
-        url = f"https://rapi.craigslist.org/web/v8/postings/{listing_info['AreaName']}/{listing_info['SubAreaName']}/{listing_info['CategoryCode']}/{listing_info['id']}"
-        params = {
-            "categoryAbbr": listing_info['CategoryCode'],
-            "cc": "US",
-            "hostname": listing_info['AreaName'],
-            "lang": "en",
-            "subareaAbbr": listing_info['SubAreaName']
-        }
+    Yields:
+        tuple: For every region, the decoded listings (DataFrame) and a list of errors for that region.
+               When a region still fails after its retries the list of listings is empty and the other regions
+               are still searched, unless the session is blocked: the regions not requested yet are then cancelled.
+               One region at a time, the search stops at the first empty region.
+    """
+    print('Function: IterSearchListings')
 
+    postal_codes = postal_codes or search_terms.get('Postal Codes') or SEARCH_POSTAL_CODES
+    retry_policy = retry_policy or RETRY_POLICY
 
-        headers = {
-            "Accept": "*/*",
-            "Accept-Encoding": "gzip, deflate, br, zstd",
-            "Accept-Language": "en-US,en;q=0.9",
-            "Connection": "keep-alive",
-            "Cookie": "cl_b=4|5411c775aa66ff242fc29367d82280f3412d3b62|17197899267o-9M; cl_tocmode=",
-            "DNT": "1",
-            "Host": "sapi.craigslist.org",
-            "If-Modified-Since": "Tue, 02 Jul 2024 14:59:49 GMT",
-            "Origin": "https://wichita.craigslist.org",
-            "Referer": "https://wichita.craigslist.org/",
-            "Sec-Fetch-Dest": "empty",
-            "Sec-Fetch-Mode": "cors",
-            "Sec-Fetch-Site": "same-site",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
-            "sec-ch-ua": '"Not/A)Brand";v="8", "Chromium";v="126", "Google Chrome";v="126"',
-            "sec-ch-ua-mobile": "?0",
-            "sec-ch-ua-platform": '"Windows"'
-        }
+    if max_workers:
+        if rate_limiter is None:
+            rate_limiter = TokenBucket(rate=1 / sleep_time, capacity=max_workers)
 
-        try:
-            response = session.get(url, headers=headers, params=params, timeout=timeout)
-            response.raise_for_status()  # Raises an HTTPError for bad responses
-            print(f'Successful response for page')
-        except requests.Timeout:
-            error_info = {
-                "ErrorName": "Timeout",
-                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "ErrorDescription": f'Timeout error on page'
-            }
-            print(error_info["ErrorDescription"])
-            errors.append(error_info)
-            break
-        except requests.RequestException as e:
-            error_info = {
-                "ErrorName": "RequestException",
-                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "ErrorDescription": f'Error on page: {e}'
-            }
-            print(error_info["ErrorDescription"])
-            errors.append(error_info)
-            break
+        blocked = threading.Event()
 
-        try:
-            json_data = response.json()
-            json_items = json_data['data']['items']
-            results_returned = len(json_items)
-            print(f'Returned: {results_returned} results. {page_num} out of {len(listing_ids)} total.')
-        except (json.JSONDecodeError, KeyError) as e:
-            error_info = {
-                "ErrorName": "JSONDecodeError" if isinstance(e, json.JSONDecodeError) else "KeyError",
-                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "ErrorDescription": f'Error parsing response JSON: {e}'
-            }
-            print(error_info["ErrorDescription"])
-            errors.append(error_info)
+        def fetch(postal_code):
+            rate_limiter.acquire()
+            if blocked.is_set():
+                return None, None
+            results_data, errors = GetSearchRegion(session, search_terms, postal_code, timeout=timeout, decode=decode)
+            if RetryPolicy.fatal(errors):
+                blocked.set()
+            return results_data, errors
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(retry_policy.call, fetch, postal_code) for postal_code in postal_codes]
+            try:
+                for future in as_completed(futures):
+                    results_data, errors = future.result()
+                    if errors is None:
+                        #Skipped after another region was blocked
+                        continue
+                    yield results_data, errors
+                    if RetryPolicy.fatal(errors):
+                        return
+            finally:
+                # Stop queued regions if the consumer stops early
+                for future in futures:
+                    future.cancel()
+        return
+
+    for page_num, postal_code in enumerate(postal_codes, start=1):
+        results_data, errors = retry_policy.call(GetSearchRegion, session, search_terms, postal_code, timeout=timeout, decode=decode)
+        yield results_data, errors
+
+        if RetryPolicy.fatal(errors):
             break
+        if not errors and not len(results_data if decode else results_data['data']['items']):
+            print('No results returned')
+            break # Exit loop on no results
+        elif page_num < len(postal_codes):
+            pause(sleep_time, rate_limiter) # Sleep only if there are more results
+
 
+def GetSearchListings(session, search_terms, timeout=(5, 5), sleep_time=3, max_pages=10, postal_codes=None, max_workers=None, rate_limiter=None, pages=None):
+    """
+    Fetches Craigslist search results for every postal code region and removes duplicate listings
+    as each region returns.
 
-        #append list together
-        listing_details_json = [*listing_details_json, *json_items]
+    Args:
+        Same as IterSearchListings.
+        pages (iterator, optional): An already started IterSearchListings iterator to collect instead of
+            starting a new search (e.g. after first_page_blocked read its first region).
 
-        if page_num < len(listing_ids):
-            page_num += 1
-            time.sleep(sleep_time)
+    Returns:
+        tuple: The decoded listings (DataFrame) and a list of errors.
+    """
+    print('Function: GetSearchListings')
+    errors = []
 
-    #remove any duplicates
-    print('remove_duplicates', len(listing_details_json))
-    listing_details_json = remove_duplicates(listing_details_json, key='postingId')
-    print('remaining values', len(listing_details_json))
+    #duplicates are removed as each region is added
+    if pages is None:
+        pages = IterSearchListings(session, search_terms, timeout=timeout, sleep_time=sleep_time, max_pages=max_pages, postal_codes=postal_codes, max_workers=max_workers, rate_limiter=rate_limiter)
 
-    return listing_details_json, errors   
+    search_results_json = PageAccumulator(key='id')
+    for results_data, page_errors in pages:
+        search_results_json.add(results_data)
+        errors.extend(page_errors)
+
+    print('unique values', len(search_results_json))
     
+    return search_results_json.to_frame(), errors
 
-# %% [markdown]
-# ## Standard Formatting
 
-# %%
 
-def FormatAggregator(ids, results, details, custom, source_key):
+def DecodeCraigslistIds(json_data):
     """
-    Aggregates and formats data from multiple DataFrames based on provided IDs and source key mapping.
+    Extracts only the PostingIds of a Craigslist search response, without decoding the rest of the items.
 
-    Parameters:
-    ids (list): List of IDs to iterate over and extract data for.
-    results (pd.DataFrame): DataFrame containing results data (not directly used in the function but assumed to be part of locals()).
-    details (pd.DataFrame): DataFrame containing details data (not directly used in the function but assumed to be part of locals()).
-    custom (pd.DataFrame): Default DataFrame to use if no specific DataFrame is mentioned in source_key.
-    source_key (dict): Dictionary mapping target DataFrame columns to source DataFrame columns. The key is the target column name, and the value is a dictionary with the source DataFrame name as key and source column name as value. If value is an empty dictionary, the target column will be filled with None.
+    Args:
+        json_data (dict): The /postings/search/full response.
 
     Returns:
-    pd.DataFrame: A DataFrame with the aggregated and formatted data.
-    
-    Example:
-    source_key = {
-        'column1': {'results': 'source_column1'},
-        'column2': {'details': 'source_column2'},
-        'column3': {},  # This will be filled with None
-        'column4': 'custom',  # This will default to the custom DataFrame
+        list: The PostingId of every item.
+    """
+    minPostingId = json_data['data']['decode']['minPostingId']
+    return [item[0] + minPostingId for item in json_data['data']['items']]
+
+
+def GetNewSearchListings(session, search_terms, results_check_callback, timeout=(5, 5), sleep_time=3, max_pages=10, postal_codes=None, max_workers=None, rate_limiter=None, pages=None):
+    """
+    Two phase version of GetSearchListings that fully decodes only the listings that have not been seen.
+
+    Phase 1 extracts the PostingIds of every region and runs results_check_callback on those ids alone.
+    Phase 2 decodes, links and returns only the listings that survived the check, so a steady state poll
+    where almost every listing is already known skips almost all of the decoding work.
+
+    Args:
+        Same as GetSearchListings.
+        results_check_callback (function): Callback function to check and compare results. It is called
+                                           with a DataFrame that has only the 'id' column.
+        pages (iterator, optional): An already started IterSearchListings iterator with decode=False.
+
+    Returns:
+        tuple: The decoded new listings (DataFrame), a list of errors and the number of unique listings found.
+    """
+    print('Function: GetNewSearchListings')
+    errors = []
+
+    if pages is None:
+        pages = IterSearchListings(session, search_terms, timeout=timeout, sleep_time=sleep_time, max_pages=max_pages, postal_codes=postal_codes, max_workers=max_workers, rate_limiter=rate_limiter, decode=False)
+
+    responses = []
+    for json_data, page_errors in pages:
+        errors.extend(page_errors)
+        if not page_errors:
+            responses.append(json_data)
+
+    #Phase 1: check the ids only
+    search_ids = list(dict.fromkeys(id for json_data in responses for id in DecodeCraigslistIds(json_data)))
+    print(f"****************COMPARE DB****************** {len(search_ids)} Results")
+    compare_columns = {
+        'id': 'id',
     }
+    new_results = results_check_callback(pd.DataFrame({'id': search_ids}), 'craigslist.com', compare_columns)
+    new_ids = {id for id in new_results['id'].to_list() if id}
+    print(f"****************COMPARE DB Complete****************** {len(new_ids)} New")
 
-    Notes:
-    - The function assumes that the DataFrames (results, details) are present in the local scope.
-    - If a source column specified in source_key is not present in the corresponding DataFrame, the resulting column will be filled with None.
-    - The function concatenates the formatted data into a single DataFrame.
+    #Phase 2: decode the new listings only
+    search_results_json = PageAccumulator(key='id')
+    if new_ids:
+        for json_data in responses:
+            search_results_json.add(DecodeCraigslistFrame(json_data, keep=new_ids))
+
+    return search_results_json.to_frame(), errors, len(search_ids)
+
+
+def GetListingDetail(session, listing_info, timeout=(5, 5), detail_cache=None, version=None):
     """
-    print('Function: FormatAggregator')
+    Fetches the Craigslist details of a single listing.
 
+    Args:
+        session (requests.Session): The session object to use for the request.
+        listing_info (dict): The 'id', 'AreaName', 'SubAreaName' and 'CategoryCode' of the listing.
+        timeout (tuple): Timeout settings for the HTTP request (connect timeout, read timeout).
+        detail_cache (DetailCache, optional): A thor_common.DetailCache the successful response is stored in.
+        version (optional): The version the response is stored under in detail_cache (the posted date of the listing).
 
-    # Create an empty DataFrame with columns from the keys of source_key
-    formatted_df = pd.DataFrame(columns=source_key.keys())
-    formatted_data = []
-    
-    # Iterate over each id
-    for id_ in ids:
-        row = {}
-        # Iterate over each key in source_key
-        for key, value in source_key.items():
-            if not value:  # If value is an empty dictionary
-                row[key] = value
-                continue
-            
-            if isinstance(value, dict):
-                # Extract the DataFrame and column name
-                df_name, column_name = list(value.items())[0]
-                df = locals().get(df_name)  # Get the DataFrame by its name
-                
-                if df is None or column_name not in df.columns:
-                    row[key] = None
-                else:
-                    # Extract the value from the DataFrame using the id
-                    match = df.loc[df['id'] == id_, column_name]
-                    row[key] = match.values[0] if not match.empty else None
-            else:
-                if key == 'id': # If id, use the current id
-                    row[key] = id_
-                else:
-                    # If the value is not a dictionary, use the provided value directly
-                    row[key] = value
+    Returns:
+        tuple: The detail items (list of dicts, empty on error) and a list of errors.
+    """
+    print('Function: GetListingDetail')
+
+    if not listing_info['SubAreaName']:
+        listing_info['SubAreaName'] = '-'
         
-        # Append the row to the formatted DataFrame
-        formatted_data.append(row)
-    
-    formatted_df = pd.concat([formatted_df, pd.DataFrame(formatted_data)])
+    url = f"https://rapi.craigslist.org/web/v8/postings/{listing_info['AreaName']}/{listing_info['SubAreaName']}/{listing_info['CategoryCode']}/{listing_info['id']}"
+    params = {
+        "categoryAbbr": listing_info['CategoryCode'],
+        "cc": "US",
+        "hostname": listing_info['AreaName'],
+        "lang": "en",
+        "subareaAbbr": listing_info['SubAreaName']
+    }
+
+
+    headers = {
+        "Accept": "*/*",
+        "Accept-Encoding": "gzip, deflate, br, zstd",
+        "Accept-Language": "en-US,en;q=0.9",
+        "Connection": "keep-alive",
+        "Cookie": "cl_b=4|5411c775aa66ff242fc29367d82280f3412d3b62|17197899267o-9M; cl_tocmode=",
+        "DNT": "1",
+        "Host": "sapi.craigslist.org",
+        "Origin": "https://wichita.craigslist.org",
+        "Referer": "https://wichita.craigslist.org/",
+        "Sec-Fetch-Dest": "empty",
+        "Sec-Fetch-Mode": "cors",
+        "Sec-Fetch-Site": "same-site",
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
+        "sec-ch-ua": '"Not/A)Brand";v="8", "Chromium";v="126", "Google Chrome";v="126"',
+        "sec-ch-ua-mobile": "?0",
+        "sec-ch-ua-platform": '"Windows"'
+    }
+
+    try:
+        response = session.get(url, headers=headers, params=params, timeout=timeout)
+        response.raise_for_status()  # Raises an HTTPError for bad responses
+        print(f"Successful response for listing {listing_info['id']}")
+    except requests.Timeout:
+        error_info = {
+            "ErrorName": "Timeout",
+            "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "ErrorDescription": f"Timeout error on listing {listing_info['id']}"
+        }
+        print(error_info["ErrorDescription"])
+        return [], [error_info]
+    except requests.RequestException as e:
+        error_info = {
+            "ErrorName": request_error_name(e),
+            "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "ErrorDescription": f"Error on listing {listing_info['id']}: {e}"
+        }
+        print(error_info["ErrorDescription"])
+        return [], [error_info]
+
+    try:
+        json_data = response.json()
+        json_items = json_data['data']['items']
+        results_returned = len(json_items)
+        print(f"Returned: {results_returned} results for listing {listing_info['id']}.")
+    except (json.JSONDecodeError, KeyError) as e:
+        error_info = {
+            "ErrorName": "JSONDecodeError" if isinstance(e, json.JSONDecodeError) else "KeyError",
+            "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "ErrorDescription": f'Error parsing response JSON: {e}'
+        }
+        print(error_info["ErrorDescription"])
+        return [], [error_info]
+
+    if detail_cache is not None and results_returned:
+        detail_cache.put('craigslist.com', listing_info['id'], json_items, version)
+
+    return json_items, []
+
+
+def split_cached_details(listing_ids, detail_cache, versions):
+    """
+    Splits listing_ids into the listings already in detail_cache and the listings that still have to be fetched.
+
+    Returns:
+        tuple: A list of (listing_info, json_items) for the cache hits and the list of listing info dicts to fetch.
+    """
+    if detail_cache is None:
+        return [], listing_ids
+    hits = detail_cache.get_many('craigslist.com', [listing_info['id'] for listing_info in listing_ids], versions)
+    print(f'Detail cache hits: {len(hits)}, to fetch: {len(listing_ids) - len(hits)}')
+    cached = [(listing_info, hits[listing_info['id']]) for listing_info in listing_ids if listing_info['id'] in hits]
+    return cached, [listing_info for listing_info in listing_ids if listing_info['id'] not in hits]
+
+
+def IterListingDetails(session, listing_ids, timeout=(5, 5), sleep_time=3, detail_cache=None, versions=None, rate_limiter=None, retry_policy=None):
+    """
+    Fetches Craigslist listing details one listing at a time, yielding each listing as soon as it arrives.
+
+    Args:
+        session (requests.Session): The session object to use for the requests.
+        listing_ids (list): List of dicts with the 'id', 'AreaName', 'SubAreaName' and 'CategoryCode' of each listing.
+        timeout (tuple): Timeout settings for the HTTP requests (connect timeout, read timeout).
+        sleep_time (int): Time in seconds to sleep between requests.
+        detail_cache (DetailCache, optional): Cached listings are yielded first without a request,
+            and fetched listings are stored in it.
+        versions (dict, optional): {id: posted date} used to skip stale cache entries.
+        rate_limiter (AdaptiveRate, optional): Paces the requests instead of sleep_time.
+        retry_policy (RetryPolicy, optional): Retries a failed listing. Defaults to RETRY_POLICY.
+
+    Yields:
+        tuple: For every listing, the listing info dict, the detail items (list of dicts) and a list of errors.
+               When a listing still fails after its retries the list of items is empty and the remaining
+               listings are still fetched, unless the session is blocked.
+    """
+    print('Function: IterListingDetails')
+
+    versions = versions or {}
+    cached, listing_ids = split_cached_details(listing_ids, detail_cache, versions)
+    for listing_info, json_items in cached:
+        yield listing_info, json_items, []
+
+    retry_policy = retry_policy or RETRY_POLICY
+    for index, listing_info in enumerate(listing_ids):
+        json_items, errors = retry_policy.call(GetListingDetail, session, listing_info, timeout=timeout, detail_cache=detail_cache, version=versions.get(listing_info['id']))
+        yield listing_info, json_items, errors
+        if RetryPolicy.fatal(errors):
+            return
+
+        if index < len(listing_ids) - 1:
+            pause(sleep_time, rate_limiter)
+
+
+async def FetchListingDetailsAsync(session, listing_ids, on_result, timeout=(5, 5), max_concurrency=5, pacer=None, detail_cache=None, versions=None, retry_policy=None):
+    """
+    asyncio engine for Craigslist listing details.
+
+    Runs up to max_concurrency requests at once. Each request waits for its turn on the pacer for the
+    rapi host before it starts, and the blocking requests call runs in a worker thread so the shared
+    session and its proxy settings are reused. A failed listing is retried with the backoff of retry_policy,
+    waiting for the pacer again before each retry, and is then reported through on_result without stopping the others.
+    Once a listing comes back 'Blocked' the listings that have not been requested yet are cancelled and never reported.
+
+    Args:
+        session (requests.Session): The session object to use for the requests.
+        listing_ids (list): List of dicts with the 'id', 'AreaName', 'SubAreaName' and 'CategoryCode' of each listing.
+        on_result (function): Called as on_result(index, listing_info, json_items, errors) as each listing completes.
+        timeout (tuple): Timeout settings for the HTTP requests (connect timeout, read timeout).
+        max_concurrency (int): Maximum number of requests in flight at once.
+        pacer (HostPacer): Per-host pacing policy. Defaults to no pacing.
+        detail_cache (DetailCache, optional): Fetched listings are stored in it.
+        versions (dict, optional): {id: posted date} the fetched listings are stored under.
+        retry_policy (RetryPolicy, optional): Retries a failed listing. Defaults to RETRY_POLICY.
+    """
+    print('Function: FetchListingDetailsAsync')
+
+    loop = asyncio.get_running_loop()
+    versions = versions or {}
+    semaphore = asyncio.Semaphore(max_concurrency)
+    pacer = pacer or HostPacer(0)
+    retry_policy = retry_policy or RETRY_POLICY
+
+    async def fetch(index, listing_info):
+        async with semaphore:
+            try:
+                attempt = 0
+                while True:
+                    await pacer.wait("rapi.craigslist.org")
+                    json_items, errors = await loop.run_in_executor(
+                        executor, GetListingDetail, session, listing_info, timeout, detail_cache, versions.get(listing_info['id'])
+                    )
+                    delay = retry_policy.backoff(errors, attempt)
+                    if delay is None:
+                        break
+                    await asyncio.sleep(delay)
+                    attempt += 1
+            except Exception as e:
+                json_items = []
+                errors = [{
+                    "ErrorName": type(e).__name__,
+                    "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    "ErrorDescription": f"Error on listing {listing_info.get('id')}: {e}"
+                }]
+        on_result(index, listing_info, json_items, errors)
+        if RetryPolicy.fatal(errors):
+            #The session is blocked, stop the listings still waiting for their turn
+            for task in tasks:
+                if task is not asyncio.current_task():
+                    task.cancel()
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        tasks = [asyncio.ensure_future(fetch(index, listing_info)) for index, listing_info in enumerate(listing_ids)]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def IterListingDetailsAsync(session, listing_ids, timeout=(5, 5), sleep_time=3, max_concurrency=5, pacer=None, detail_cache=None, versions=None, retry_policy=None):
+    """
+    Sync wrapper around FetchListingDetailsAsync that yields each listing in the order of listing_ids.
+
+    The event loop runs in its own thread, so this also works from inside Jupyter where a loop is already running.
+
+    Args:
+        session (requests.Session): The session object to use for the requests.
+        listing_ids (list): List of dicts with the 'id', 'AreaName', 'SubAreaName' and 'CategoryCode' of each listing.
+        timeout (tuple): Timeout settings for the HTTP requests (connect timeout, read timeout).
+        sleep_time (int): Minimum time in seconds between request starts, used to build the default pacer.
+        max_concurrency (int): Maximum number of requests in flight at once.
+        pacer (HostPacer): Per-host pacing policy (or a thor_common.AdaptiveRate). Defaults to HostPacer(sleep_time).
+        detail_cache (DetailCache, optional): Cached listings are yielded first without a request,
+            and fetched listings are stored in it.
+        versions (dict, optional): {id: posted date} used to skip stale cache entries.
+        retry_policy (RetryPolicy, optional): Retries a failed listing. Defaults to RETRY_POLICY.
+
+    Yields:
+        tuple: For every listing, the listing info dict, the detail items (list of dicts) and a list of errors.
+               A failed listing yields an empty list of items and the remaining listings are still fetched,
+               unless the session is blocked: then only the listings that finished are yielded.
+    """
+    print('Function: IterListingDetailsAsync')
+
+    cached, listing_ids = split_cached_details(listing_ids, detail_cache, versions)
+    for listing_info, json_items in cached:
+        yield listing_info, json_items, []
+
+    if not listing_ids:
+        return
+    if pacer is None:
+        pacer = HostPacer(sleep_time)
+
+    results = queue.Queue()
+
+    def run_engine():
+        try:
+            asyncio.run(FetchListingDetailsAsync(
+                session, listing_ids, lambda *result: results.put(result),
+                timeout=timeout, max_concurrency=max_concurrency, pacer=pacer,
+                detail_cache=detail_cache, versions=versions, retry_policy=retry_policy
+            ))
+        finally:
+            # Listings cancelled after a block never report, so mark the end of the engine
+            results.put(None)
+
+    engine = threading.Thread(target=run_engine, daemon=True)
+    engine.start()
+
+    # Hold back listings that finish early until every listing before them has been yielded
+    finished = {}
+    done = False
+    for next_index in range(len(listing_ids)):
+        while next_index not in finished and not done:
+            result = results.get()
+            if result is None:
+                done = True
+                break
+            index, listing_info, json_items, errors = result
+            finished[index] = (listing_info, json_items, errors)
+        if next_index in finished:
+            yield finished.pop(next_index)
+
+    engine.join()
+
+
+def GetListingDetails(session, listing_ids, timeout=(5, 5), sleep_time=3, max_concurrency=None, pacer=None, detail_cache=None, versions=None, rate_limiter=None, retry_policy=None):
+    """
+    Fetches Craigslist listing details for every listing and removes duplicate postings.
+
+    Args:
+        Same as IterListingDetails.
+        max_concurrency (int, optional): If set, fetch with the asyncio engine (IterListingDetailsAsync)
+            with this many requests in flight. Default None fetches one listing at a time.
+        pacer (HostPacer, optional): Per-host pacing policy for the asyncio engine.
+        rate_limiter (AdaptiveRate, optional): Paces the one listing at a time mode instead of sleep_time.
+        detail_cache (DetailCache, optional): A thor_common.DetailCache consulted before the network.
+        versions (dict, optional): {id: posted date} used to skip stale cache entries.
+        retry_policy (RetryPolicy, optional): Retries a failed listing. Defaults to RETRY_POLICY.
+
+    Returns:
+        tuple: The detail items of every listing that was fetched, even if others failed (list of dicts),
+               and a list of errors with one record per failed listing.
+    """
+
+    errors = []
+    #duplicate postings are removed as each listing is added
+    listing_details_json = PageAccumulator(key='postingId')
+    if max_concurrency:
+        listing_iter = IterListingDetailsAsync(session, listing_ids, timeout=timeout, sleep_time=sleep_time, max_concurrency=max_concurrency, pacer=pacer, detail_cache=detail_cache, versions=versions, retry_policy=retry_policy)
+    else:
+        listing_iter = IterListingDetails(session, listing_ids, timeout=timeout, sleep_time=sleep_time, detail_cache=detail_cache, versions=versions, rate_limiter=rate_limiter, retry_policy=retry_policy)
+
+    for listing_info, json_items, listing_errors in listing_iter:
+        listing_details_json.add(json_items)
+        errors.extend(listing_errors)
+
+    print('unique values', len(listing_details_json))
+
+    return listing_details_json.records(), errors   
     
-    return formatted_df
 
+# %% [markdown]
+# ## Standard Formatting
+
+# %%
+
+# Mapping of the standard Listings columns to their source data, compiled once when the script is imported.
+# {'context': ...} entries are filled per call from the current task and user.
+LISTING_SOURCE_KEY = {
+    'title': {'details': 'title'},
+    'id': 'id',
+    'link': {'details': 'url'},
+    'creation_time': {'details': 'postedDate'},
+    'vehicle_condition': {'details': 'condition'},
+    'vehicle_color': {'details': 'auto_paint'},
+    'fuel_type': {'details': 'auto_fuel_type'},
+    'paid_off': {'details': 'auto_title_status'},
+    'make': {'details': 'auto_make_model'},
+    'model': {'details': 'auto_make_model'},
+    'year': {'details': 'auto_year'},
+    'number_owners': '',
+    'seller_type': {'details': 'categoryAbbr'},
+    'vehicle_trim': '',
+    'vin': {'details': 'auto_vin'},
+    'listing_photos': {'details': 'images'},
+    'seller_name': {'results': 'locationDescription'},
+    'location': {'details': 'location.description'},
+    'location_city': {'details': 'location.area'},
+    'location_state': '',
+    'location_country': '',
+    'description': {'details': 'body'},
+    'price': {'details': 'price'},
+    'strikethrough_price': '',
+    'odometer_unit': '',
+    'odometer_value': {'details': 'auto_miles'},
+    'thor_timestamp': {'results': 'thor_timestamp'},
+    'thor_website': "autotrader.com",
+    'thor_mmr': False,
+    'thor_task': {'context': 'thor_task'},
+    'thor_user': {'context': 'thor_user'},
+    'Task': {'context': 'Task'},
+    'Host': {'context': 'Host'},
+    'Account': {'context': 'Account'}
+}
+
+LISTING_PLAN = SourceKeyPlan(LISTING_SOURCE_KEY)
 
 
 def Format_Output(current_task, current_user, search_results, listing_details, ids):
@@ -543,52 +929,14 @@ def Format_Output(current_task, current_user, search_results, listing_details, i
         - user_telemetry (DataFrame): DataFrame containing user telemetry information.
 
     Notes:
-    - The function uses a source key dictionary to map specific fields to their corresponding sources (custom, results, or details).
+    - LISTING_SOURCE_KEY maps specific fields to their corresponding sources (custom, results, details, or the per-call context).
     - It ensures required columns are present in the listing details before processing.
     - Custom data is created by extracting and transforming specific fields such as images, title, and location.
-    - The final Listings DataFrame is generated using the FormatAggregator function.
+    - The final Listings DataFrame is generated by executing LISTING_PLAN, the compiled LISTING_SOURCE_KEY.
     - Task telemetry and user telemetry data are also created and returned as part of the output.
     """
     print('Function: Format_Output')
 
-    
-    source_key = {
-        'title': {'details': 'title'},
-        'id': 'id',
-        'link': {'details': 'url'},
-        'creation_time': {'details': 'postedDate'},
-        'vehicle_condition': {'details': 'condition'},
-        'vehicle_color': {'details': 'auto_paint'},
-        'fuel_type': {'details': 'auto_fuel_type'},
-        'paid_off': {'details': 'auto_title_status'},
-        'make': {'details': 'auto_make_model'},
-        'model': {'details': 'auto_make_model'},
-        'year': {'details': 'auto_year'},
-        'number_owners': '',
-        'seller_type': {'details': 'categoryAbbr'},
-        'vehicle_trim': '',
-        'vin': {'details': 'auto_vin'},
-        'listing_photos': {'details': 'images'},
-        'seller_name': {'results': 'locationDescription'},
-        'location': {'details': 'location.description'},
-        'location_city': {'details': 'location.area'},
-        'location_state': '',
-        'location_country': '',
-        'description': {'details': 'body'},
-        'price': {'details': 'price'},
-        'strikethrough_price': '',
-        'odometer_unit': '',
-        'odometer_value': {'details': 'auto_miles'},
-        'thor_timestamp': {'results': 'thor_timestamp'},
-        'thor_website': "autotrader.com",
-        'thor_mmr': False,
-        'thor_task': f"{current_task}",
-        'thor_user': f"{current_user}",
-        'Task': current_task['TaskName'],
-        'Host': current_task["Host"],
-        'Account': current_user["AccountInfo"]["AccountID"]
-    }
-
 
     if not search_results.empty:
         #Custome Data from search_results here
@@ -648,7 +996,19 @@ def Format_Output(current_task, current_user, search_results, listing_details, i
         print('no details')
 
 
-    Listings = FormatAggregator(ids, search_results, listing_details, custom_data, source_key)
+    context = {
+        'thor_task': f"{current_task}",
+        'thor_user': f"{current_user}",
+        'Task': current_task['TaskName'],
+        'Host': current_task["Host"],
+        'Account': current_user["AccountInfo"]["AccountID"]
+    }
+    sources = {
+        'results': search_results,
+        'details': listing_details,
+        'custom': custom_data
+    }
+    Listings = LISTING_PLAN.execute(ids, sources, context)
 
     # Create task_telemetry/Will Be phased out
     task_telemetry = Listings
@@ -668,46 +1028,16 @@ def Format_Output(current_task, current_user, search_results, listing_details, i
 # ## Run Task
 
 # %%
-def Task_Run(driver, current_profile, current_task, current_user, results_check_callback, user_timer):
+def build_session(current_user):
     """
-    Executes a task using the given parameters and handles session management, proxy settings, 
-    and result processing.
+    Builds a new requests session with the default headers and the user's proxy, if one is set.
 
     Args:
-        driver (object): The driver used for performing tasks.
-        current_profile (dict): The current profile details.
-        current_task (dict): The current task details including search terms.
         current_user (dict): Information about the current user including proxy details.
-        results_check_callback (function): Callback function to check and compare results.
-        user_timer (object): Timer object to track user account activity.
-
-    Yields:
-        tuple: A tuple containing the following elements:
-            - search_results (DataFrame): DataFrame containing search results.
-            - listing_details (DataFrame): DataFrame containing details of listings.
-            - Listings (list): List of processed listings.
-            - task_telemetry (dict): Dictionary containing task telemetry data.
-            - user_telemetry (dict): Dictionary containing user telemetry data.
-            - errors (dict): Dictionary containing error information if any issues are encountered.
 
-    The function performs the following steps:
-    1. Tracks how long the user account has been active using `user_timer.status()`.
-    2. Creates a session object with updated headers.
-    3. Configures the session to use a proxy if specified in `current_user`.
-    4. Checks if the session is blocked using `check_blocked` function.
-    5. If blocked, formats and yields the final results with errors.
-    6. Retrieves search listings using `GetSearchListings`.
-    7. Compares the search results with existing data using `results_check_callback`.
-    8. Retrieves details for new listings if any.
-    9. Formats and yields the final results including search results, listing details, 
-       listings, task telemetry, user telemetry, and errors.
+    Returns:
+        requests.Session: The session.
     """
-    print('Main Funtion: Task_Run')
-
-
-    #How to track how long the user account has been active
-    user_status = user_timer.status()
-    
     # Create a session object
     session = requests.Session()
     session.headers.update({
@@ -733,36 +1063,58 @@ def Task_Run(driver, current_profile, current_task, current_user, results_check_
 
         # Configure the session to use the proxy
         session.proxies.update(proxy)
-        proxy_set = check_proxy(session, p_ip) 
-        
+
+    return session
+
+
+def create_session(current_user):
+    """
+    Borrows the requests session for a task from thor_common.SESSION_POOL, keyed by website, proxy and account,
+    so its cookies and open connections are reused across Task_Run calls. The session is built with
+    build_session the first time.
+
+    The proxy is checked through thor_common.PROXY_HEALTH, which caches healthy verdicts for its ttl.
+
+    Args:
+        current_user (dict): Information about the current user including proxy details.
+
+    Returns:
+        tuple: A tuple containing the session (requests.Session) and a boolean indicating if the proxy
+               is working (always True when no proxy is configured).
+    """
+    print('Function: create_session')
+
+
+    session = SESSION_POOL.borrow(SessionPool.key("craigslist.com", current_user), lambda: build_session(current_user))
+
+    if current_user['ProxyInfo']['ProxyIp'] != '':
+        # The icanhazip round trip only runs when the cached verdict has expired or a request failed
+        proxy_set = PROXY_HEALTH.verify(ProxyHealth.key(current_user), ProxyHealth.checker(check_proxy, session.proxies, current_user['ProxyInfo']['ProxyIp']))
         print('Proxy Set: ', proxy_set)
     else:
         proxy_set = True
 
+    return session, proxy_set
 
-    #Check if Blocked
-    is_blocked, blocked_errors = check_blocked(session)
-    print(f"is blocked: {is_blocked}")
-    if is_blocked or proxy_set == False:
-        errors = {"Disable": True, "error_data": [blocked_errors]}   
-        print(errors)
-
-        final_results, final_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user, pd.DataFrame(), pd.DataFrame(), [])
-        yield final_results, final_details, Listings, task_telemetry, user_telemetry, errors
-        return
 
+def build_search_results(search_frame, current_task, current_user):
+    """
+    Builds the Gen 4 search results DataFrame and the Gen 5 search results JSON from decoded search listings.
 
-    search_results_json, errors = GetSearchListings(session, current_task['SearchTerms'], sleep_time=2)
-    print('JSON', len(search_results_json))
-    print(errors)
+    Args:
+        search_frame (DataFrame): Decoded search listings from GetSearchListings.
+        current_task (dict): The current task details including search terms.
+        current_user (dict): Information about the current user.
 
-    #format data
+    Returns:
+        tuple: The search results DataFrame and the list of Gen 5 search result dicts.
+    """
     search_results = pd.DataFrame()
     thor_search_results = []
-    if len(search_results_json):
+    if len(search_frame):
 
-        ##Create Gen 4 DataFrame
-        search_results = pd.DataFrame(search_results_json)
+        ##Create Gen 4 DataFrame, with the dtypes a DataFrame of the listing dicts would get
+        search_results = search_frame.infer_objects()
         search_results.reset_index(drop=True, inplace=True)
         search_results = search_results.drop_duplicates(subset='id')
         print(search_results.shape)
@@ -773,7 +1125,7 @@ def Task_Run(driver, current_profile, current_task, current_user, results_check_
         search_results['thor_listing_url'] = search_results['Link']
 
         #Create Gen 5 Json
-        for dictionary in search_results_json:
+        for dictionary in search_frame.to_dict(orient='records'):
             dictionary['thor_id'] = str(uuid.uuid4())
             dictionary['thor_website'] = 'craigslist.com'
             dictionary['thor_scraped'] = int(time.time())
@@ -783,30 +1135,22 @@ def Task_Run(driver, current_profile, current_task, current_user, results_check_
             dictionary['thor_content'] = json.dumps(dictionary)
             thor_search_results.append(dictionary)
 
+    return search_results, thor_search_results
 
-    # Check For New Listings
-    print(f"****************COMPARE DB****************** {len(search_results)} Results")
-    compare_columns = {
-        'id': 'id',
-    }
-    new_results = results_check_callback(search_results, 'craigslist.com', compare_columns)
-    print(f"****************COMPARE DB Complete****************** {len(new_results)} New")
 
-    #get list of new IDs and ensure no blanks or duplicates
-    new_ids = new_results['id'].to_list()
-    new_ids = [*{item for item in new_ids if item}]
-    new_data = new_results[['SubAreaName', 'AreaName', 'CategoryCode', 'id']].to_dict(orient='records')
-    print(new_data)
-
-    
-    #Get listing Details
-    if len(new_results) > 0:
-        listing_details_json, errors = GetListingDetails(session, new_data, sleep_time=.8)
-    else:
-        listing_details_json = []
+def build_listing_details(listing_details_json, current_task, current_user):
+    """
+    Builds the Gen 4 listing details DataFrame and the Gen 5 listing details JSON from listing detail items.
 
-    print(listing_details_json)
+    Args:
+        listing_details_json (list): Listing detail items from GetListingDetails.
+        current_task (dict): The current task details.
+        current_user (dict): Information about the current user.
 
+    Returns:
+        tuple: The listing details DataFrame (empty if there are no details) and the list of Gen 5 listing detail dicts.
+    """
+    listing_details = pd.DataFrame()
     thor_listing_details = []
     if len(listing_details_json):
         #Create Gen 4 DataFrame
@@ -832,19 +1176,222 @@ def Task_Run(driver, current_profile, current_task, current_user, results_check_
             dictionary['id'] = dictionary['postingId']            
             thor_listing_details.append(dictionary)
 
+    return listing_details, thor_listing_details
+
+
+def search_filter_fields(search_results):
+    """
+    Builds the thor_filters fields that a Craigslist search result already answers, for FilterPlan.could_match.
+
+    Craigslist search items only have a title, miles and price. The year is a 19xx or 20xx that starts the title
+    ("2001 Ford F250"). A year anywhere else in the title may be a price, a part or an engine ("$1950 OBO",
+    "new 2019 transmission") and is left unknown, since the final filter uses the listing's own year. So is a
+    year range such as "1999-2003 parts".
+    Make and model are left out: titles spell them too many ways ("F250 7.3 Powerstroke", "Cummins 2500") for a
+    miss to mean the listing cannot match, so could_match treats them as unknown. Unknown values are NaN,
+    which could_match lets through too.
+
+    Args:
+        search_results (DataFrame): The search results DataFrame, from build_search_results or a decoded region.
+
+    Returns:
+        DataFrame: One row per search result with id, year, odometer_value and price.
+    """
+    title = search_results['Title'].fillna('').astype(str)
+    price = pd.to_numeric(search_results['Price'], errors='coerce')
+    return pd.DataFrame({
+        'id': search_results['id'],
+        'year': pd.to_numeric(title.str.extract(r'^\s*((?:19|20)[0-9]{2})\b(?!\s*-)', expand=False), errors='coerce'),
+        'odometer_value': pd.to_numeric(search_results['Miles'], errors='coerce'),
+        'price': price.where(price > 0),
+    })
+
 
+def filter_pushdown(filter_plan, new_results):
+    """
+    Drops the new listings whose search fields (see search_filter_fields) cannot match any filter of
+    filter_plan, so their details are not requested.
+
+    Args:
+        filter_plan (FilterPlan): The compiled thor_filters plan, or None to keep every listing.
+        new_results (DataFrame): The new search results.
+
+    Returns:
+        DataFrame: The rows of new_results that could still match a filter.
+    """
+    if filter_plan is None or not len(new_results):
+        return new_results
+    new_results = new_results[filter_plan.could_match(search_filter_fields(new_results))]
+    print(f"****************FILTER PUSHDOWN****************** {len(new_results)} Could Match")
+    return new_results
+
+
+def apply_filter_plan(filter_plan, Listings):
+    """
+    Applies the filters of filter_plan to the formatted Listings.
+
+    Args:
+        filter_plan (FilterPlan): The compiled thor_filters plan, or None to leave Listings as they are.
+        Listings (DataFrame): The Listings from Format_Output.
+
+    Returns:
+        tuple: The filtered Listings and a list of errors. If the filters fail, Listings is empty and the
+               error is returned, so the listings are not committed as seen.
+    """
+    if filter_plan is None:
+        return Listings, []
+    try:
+        return filter_plan.apply(Listings), []
+    except (KeyError, TypeError, ValueError) as e:
+        print('error Filtering')
+        return pd.DataFrame(), [{
+            "ErrorName": type(e).__name__,
+            "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "ErrorDescription": f"Error applying the filters: {e}"
+        }]
+
+
+def Task_Run(driver, current_profile, current_task, current_user, results_check_callback, user_timer, stream=False, detail_workers=None, search_workers=None, pipeline=False, lazy=False, detail_cache=None, block_probe=True, adaptive_rate=False, filter_plan=None):
+    """
+    Executes a task using the given parameters and handles session management, proxy settings, 
+    and result processing.
+
+    Args:
+        driver (object): The driver used for performing tasks.
+        current_profile (dict): The current profile details.
+        current_task (dict): The current task details including search terms.
+        current_user (dict): Information about the current user including proxy details.
+        results_check_callback (function): Callback function to check and compare results. A thor_common.SeenIndex
+            can be passed as a built-in, persistent callback.
+        user_timer (object): Timer object to track user account activity.
+        stream (bool, optional): If True, yield the events of `Task_Run_Stream` instead of a single final tuple.
+        detail_workers (int, optional): Number of listing detail requests in flight at once in the asyncio
+            detail engine, e.g. 5. None (default) fetches one listing at a time with a fixed sleep.
+        search_workers (int, optional): Number of postal code regions searched at once, e.g. 3. None (default)
+            searches one region at a time with a fixed sleep.
+        pipeline (bool, optional): If True, run `Task_Run_Pipeline`, which overlaps the search, compare and
+            detail stages and yields the same tuple.
+        lazy (bool, optional): If True, check the search ids with `results_check_callback` before decoding
+            (see `GetNewSearchListings`). Only new listings are decoded, so search_results and
+            thor_search_results then hold the new listings only.
+        detail_cache (DetailCache, optional): A thor_common.DetailCache shared across tasks. Listings already in
+            the cache with the same posted date are not requested again (default is None, always fetch).
+        block_probe (bool, optional): If True (default), run the standalone `check_blocked` probe before
+            searching. If False, the block check is derived from the first search page and the probe only
+            runs when that page fails in an ambiguous way (timeout or connection error), saving one request.
+        adaptive_rate (bool, optional): If True, pace every request with the thor_common.AdaptiveRate of the
+            website and proxy from RATE_REGISTRY instead of the fixed sleeps. The learned interval is saved
+            between runs and reported as 'RequestInterval' in user_telemetry.
+        filter_plan (FilterPlan, optional): A compiled thor_filters plan, e.g.
+            thor_filters.compile_filters(thor_filters.listing_filters). If set, the new listings whose search
+            fields (see `search_filter_fields`) cannot match any filter are dropped before their details are
+            requested, and the filters are applied to the Listings (in every mode, stream and pipeline included).
+
+    Yields:
+        tuple: A tuple containing the following elements:
+            - search_results (DataFrame): DataFrame containing search results.
+            - listing_details (DataFrame): DataFrame containing details of listings.
+            - Listings (list): List of processed listings.
+            - task_telemetry (dict): Dictionary containing task telemetry data.
+            - user_telemetry (dict): Dictionary containing user telemetry data.
+            - errors (dict): Dictionary containing error information if any issues are encountered.
+            - thor_search_results (list): Gen 5 search result dicts.
+            - thor_listing_details (list): Gen 5 listing detail dicts.
+
+    The function performs the following steps:
+    1. Tracks how long the user account has been active using `user_timer.status()`.
+    2. Creates a session object with updated headers.
+    3. Configures the session to use a proxy if specified in `current_user`.
+    4. Checks if the session is blocked using `check_blocked` function.
+    5. If blocked, formats and yields the final results with errors.
+    6. Retrieves search listings using `GetSearchListings`.
+    7. Compares the search results with existing data using `results_check_callback`.
+    8. Retrieves details for new listings if any.
+    9. Formats and yields the final results including search results, listing details, 
+       listings, task telemetry, user telemetry, and errors.
+    """
+    print('Main Funtion: Task_Run')
+
+
+    if stream:
+        yield from Task_Run_Stream(driver, current_profile, current_task, current_user, results_check_callback, user_timer, detail_workers=detail_workers, search_workers=search_workers, detail_cache=detail_cache, block_probe=block_probe, adaptive_rate=adaptive_rate, filter_plan=filter_plan)
+        return
+    if pipeline:
+        yield from Task_Run_Pipeline(driver, current_profile, current_task, current_user, results_check_callback, user_timer, detail_workers=detail_workers, search_workers=search_workers, detail_cache=detail_cache, block_probe=block_probe, adaptive_rate=adaptive_rate, filter_plan=filter_plan)
+        return
+
+    #How to track how long the user account has been active
+    user_status = user_timer.status()
+    
+    session, proxy_set = create_session(current_user)
+    rate_control = RATE_REGISTRY.attach("craigslist.com", current_user, session, interval=.8) if adaptive_rate else None
+
+
+    #Check if Blocked
+    search_pages = IterSearchListings(session, current_task['SearchTerms'], sleep_time=2, max_workers=search_workers, rate_limiter=rate_control, decode=not lazy)
+    errors, search_pages = task_blocked(session, current_user, proxy_set, search_pages, lambda: check_blocked(session), block_probe)
+    if errors:
+        final_results, final_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user, pd.DataFrame(), pd.DataFrame(), [])
+        yield final_results, final_details, Listings, task_telemetry, user_telemetry, errors
+        return
+
+
+    if lazy:
+        #the ids were already checked, every decoded listing is new
+        search_results_json, errors, search_count = GetNewSearchListings(session, current_task['SearchTerms'], results_check_callback, sleep_time=2, max_workers=search_workers, pages=search_pages)
+        print(f'{search_count} search ids checked')
+    else:
+        search_results_json, errors = GetSearchListings(session, current_task['SearchTerms'], sleep_time=2, max_workers=search_workers, pages=search_pages)
+    print('JSON', len(search_results_json))
+    print(errors)
+
+    #format data
+    search_results, thor_search_results = build_search_results(search_results_json, current_task, current_user)
+
+
+    # Check For New Listings
+    if lazy:
+        new_results = search_results if len(search_results) else pd.DataFrame(columns=['SubAreaName', 'AreaName', 'CategoryCode', 'id'])
+    else:
+        print(f"****************COMPARE DB****************** {len(search_results)} Results")
+        compare_columns = {
+            'id': 'id',
+        }
+        new_results = results_check_callback(search_results, 'craigslist.com', compare_columns)
+        print(f"****************COMPARE DB Complete****************** {len(new_results)} New")
+
+    #Only request the details of the new listings that could still pass the filters
+    new_results = filter_pushdown(filter_plan, new_results)
+
+    #get list of new IDs and ensure no blanks or duplicates
+    new_ids = new_results['id'].to_list()
+    new_ids = [*{item for item in new_ids if item}]
+    new_data = new_results[['SubAreaName', 'AreaName', 'CategoryCode', 'id']].to_dict(orient='records')
+    print(new_data)
+
+    
+    #Get listing Details
+    if len(new_results) > 0:
+        versions = listing_versions(search_results, 'PostedDate')
+        listing_details_json, detail_errors = GetListingDetails(session, new_data, sleep_time=.8, max_concurrency=detail_workers, pacer=rate_control, detail_cache=detail_cache, versions=versions, rate_limiter=rate_control)
+        errors.extend(detail_errors)
+    else:
+        listing_details_json = []
+
+    print(listing_details_json)
+
+    listing_details, thor_listing_details = build_listing_details(listing_details_json, current_task, current_user)
 
         
     #Format standard Output
     search_results, listing_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user,  search_results, listing_details, new_ids)
+    RATE_REGISTRY.report(rate_control, user_telemetry)
 
     #filter to only Trucks and Vics we want
-    # try:
-    #     filters = thor_filters.listing_filters
-    #     Listings = thor_filters.apply_filters(Listings, filters)
-    # except:
-    #     print('error Filtering')
-    #     Listings = pd.DataFrame()
+    Listings, filter_errors = apply_filter_plan(filter_plan, Listings)
+    errors.extend(filter_errors)
+    if not filter_errors:
+        commit_seen(results_check_callback, 'craigslist.com', new_ids)
 
 
     print(f"{len(search_results)} search_results")
@@ -853,10 +1400,219 @@ def Task_Run(driver, current_profile, current_task, current_user, results_check_
     print(f"{len(task_telemetry)} task_telemetry")
     print(f"{len(user_telemetry)} user_telemetry")
     print(f"{errors} errors")
-    errors = {}
+    errors = task_errors(session, current_user, errors)
     
     yield search_results, listing_details, Listings, task_telemetry, user_telemetry, errors, thor_search_results, thor_listing_details
 
+
+def Task_Run_Pipeline(driver, current_profile, current_task, current_user, results_check_callback, user_timer, detail_workers=5, search_workers=3, detail_cache=None, block_probe=True, adaptive_rate=False, filter_plan=None):
+    """
+    Pipelined version of Task_Run. Each postal code region is compared with `results_check_callback` as soon as
+    it arrives and its new listings are queued for their detail requests while other regions are still downloading,
+    so the task takes about as long as the slower of the search and the details instead of both added together.
+
+    Args:
+        Same as Task_Run.
+
+    Yields:
+        tuple: The same tuple as Task_Run.
+    """
+    print('Main Funtion: Task_Run_Pipeline')
+
+
+    #How to track how long the user account has been active
+    user_status = user_timer.status()
+
+    session, proxy_set = create_session(current_user)
+    rate_control = RATE_REGISTRY.attach("craigslist.com", current_user, session, interval=.8) if adaptive_rate else None
+
+    #Check if Blocked
+    search_pages = IterSearchListings(session, current_task['SearchTerms'], sleep_time=2, max_workers=search_workers, rate_limiter=rate_control)
+    errors, search_pages = task_blocked(session, current_user, proxy_set, search_pages, lambda: check_blocked(session), block_probe)
+    if errors:
+        final_results, final_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user, pd.DataFrame(), pd.DataFrame(), [])
+        yield final_results, final_details, Listings, task_telemetry, user_telemetry, errors
+        return
+
+    compare_columns = {
+        'id': 'id',
+    }
+    seen_ids = set()
+    versions = {}
+
+    def compare_page(results_data):
+        if not len(results_data):
+            return []
+        page_results = results_data.drop_duplicates(subset='id')
+        versions.update(listing_versions(page_results, 'PostedDate') or {})
+        new_results = results_check_callback(page_results, 'craigslist.com', compare_columns)
+        print(f"****************COMPARE REGION****************** {len(page_results)} Results {len(new_results)} New")
+        new_results = filter_pushdown(filter_plan, new_results)
+
+        #ensure no blanks or listings already queued from an earlier region
+        page_new_data = []
+        for listing_info in new_results[['SubAreaName', 'AreaName', 'CategoryCode', 'id']].to_dict(orient='records'):
+            if listing_info['id'] and listing_info['id'] not in seen_ids:
+                seen_ids.add(listing_info['id'])
+                page_new_data.append(listing_info)
+        return page_new_data
+
+    rate_limiter = rate_control or TokenBucket(rate=1 / .8, capacity=detail_workers or 1)
+
+    blocked = threading.Event()
+
+    def fetch_detail(listing_info):
+        rate_limiter.acquire()
+        if blocked.is_set():
+            return None, None
+        json_items, errors = GetListingDetail(session, listing_info, detail_cache=detail_cache, version=versions.get(listing_info['id']))
+        if RetryPolicy.fatal(errors):
+            blocked.set()
+        return json_items, errors
+
+    def fetch_details(listing_info):
+        if detail_cache is not None:
+            cached = detail_cache.get_many('craigslist.com', [listing_info['id']], versions)
+            if listing_info['id'] in cached:
+                return cached[listing_info['id']], []
+        return RETRY_POLICY.call(fetch_detail, listing_info)
+
+    search_results_json = PageAccumulator(key='id')
+    listing_details_json = PageAccumulator(key='postingId')
+    errors = []
+    new_ids = []
+    for stage, *data in iter_pipeline(search_pages, compare_page, fetch_details, max_workers=detail_workers or 1, stop=blocked):
+        if stage == 'page':
+            results_data, page_errors, page_new_data = data
+            search_results_json.add(results_data)
+            errors.extend(page_errors)
+            new_ids.extend(listing_info['id'] for listing_info in page_new_data)
+        else:
+            listing_info, (json_items, listing_errors) = data
+            if listing_errors is None:
+                #Skipped after the session was blocked
+                continue
+            listing_details_json.add(json_items)
+            errors.extend(listing_errors)
+
+    #format data
+    search_results, thor_search_results = build_search_results(search_results_json.to_frame(), current_task, current_user)
+    listing_details, thor_listing_details = build_listing_details(listing_details_json.records(), current_task, current_user)
+
+    #Format standard Output
+    search_results, listing_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user,  search_results, listing_details, new_ids)
+    Listings, filter_errors = apply_filter_plan(filter_plan, Listings)
+    errors.extend(filter_errors)
+    if not filter_errors:
+        commit_seen(results_check_callback, 'craigslist.com', new_ids)
+    RATE_REGISTRY.report(rate_control, user_telemetry)
+
+    print(f"{len(search_results)} search_results")
+    print(f"{len(listing_details)} listing_details")
+    print(f"{len(Listings)} Listings")
+    print(f"{errors} errors")
+    errors = task_errors(session, current_user, errors)
+
+    yield search_results, listing_details, Listings, task_telemetry, user_telemetry, errors, thor_search_results, thor_listing_details
+
+
+def Task_Run_Stream(driver, current_profile, current_task, current_user, results_check_callback, user_timer, detail_workers=5, search_workers=3, detail_cache=None, block_probe=True, adaptive_rate=False, filter_plan=None):
+    """
+    Streaming version of Task_Run. Yields events as each search region and each listing detail arrives,
+    so downstream consumers can start DB writes and alerting before the whole task has finished.
+
+    Args:
+        Same as Task_Run.
+
+    Yields:
+        dict: An event dictionary (see thor_common.task_event) with one of the following 'Event' values:
+            - 'progress': 'Stage' ('search', 'compare' or 'details') with the counts and errors for that step.
+            - 'search_results': 'search_results' (DataFrame) and 'thor_search_results' (Gen 5 JSON) once every
+              search region has been collected.
+            - 'listings': A formatted increment with 'listing_details', 'Listings', 'task_telemetry' and
+              'thor_listing_details' for the listings whose details just arrived.
+            - 'complete': The final 'errors' dictionary in the same shape Task_Run yields, 'user_telemetry'
+              and 'error_data', the list of every error encountered during the task.
+    """
+    print('Main Funtion: Task_Run_Stream')
+
+
+    #How to track how long the user account has been active
+    user_status = user_timer.status()
+
+    session, proxy_set = create_session(current_user)
+    rate_control = RATE_REGISTRY.attach("craigslist.com", current_user, session, interval=.8) if adaptive_rate else None
+
+    #Check if Blocked
+    search_pages = IterSearchListings(session, current_task['SearchTerms'], sleep_time=2, max_workers=search_workers, rate_limiter=rate_control)
+    errors, search_pages = task_blocked(session, current_user, proxy_set, search_pages, lambda: check_blocked(session), block_probe)
+    if errors:
+        final_results, final_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user, pd.DataFrame(), pd.DataFrame(), [])
+        yield task_event('complete', errors=errors, user_telemetry=user_telemetry, error_data=errors['error_data'])
+        return
+
+    error_data = []
+
+    search_results_json = PageAccumulator(key='id')
+    for page_num, (results_data, page_errors) in enumerate(search_pages, start=1):
+        search_results_json.add(results_data)
+        error_data.extend(page_errors)
+        yield task_event('progress', Stage='search', Page=page_num, Results=len(results_data), Errors=page_errors)
+
+    search_results, thor_search_results = build_search_results(search_results_json.to_frame(), current_task, current_user)
+    yield task_event('search_results', search_results=search_results, thor_search_results=thor_search_results)
+
+    # Check For New Listings
+    print(f"****************COMPARE DB****************** {len(search_results)} Results")
+    compare_columns = {
+        'id': 'id',
+    }
+    new_results = results_check_callback(search_results, 'craigslist.com', compare_columns)
+    print(f"****************COMPARE DB Complete****************** {len(new_results)} New")
+    new_results = filter_pushdown(filter_plan, new_results)
+
+    #get list of new IDs and ensure no blanks or duplicates
+    new_ids = new_results['id'].to_list()
+    new_ids = [*{item for item in new_ids if item}]
+    new_data = new_results[['SubAreaName', 'AreaName', 'CategoryCode', 'id']].to_dict(orient='records') if len(new_results) > 0 else []
+    yield task_event('progress', Stage='compare', Results=len(search_results), New=len(new_ids))
+
+    #Get listing Details and format each listing as soon as it arrives
+    formatted_ids = set()
+    versions = listing_versions(search_results, 'PostedDate')
+    if detail_workers:
+        listing_iter = IterListingDetailsAsync(session, new_data, sleep_time=.8, max_concurrency=detail_workers, pacer=rate_control, detail_cache=detail_cache, versions=versions)
+    else:
+        listing_iter = IterListingDetails(session, new_data, sleep_time=.8, detail_cache=detail_cache, versions=versions, rate_limiter=rate_control)
+
+    for index, (listing_info, json_items, listing_errors) in enumerate(listing_iter, start=1):
+        error_data.extend(listing_errors)
+        yield task_event('progress', Stage='details', Fetched=index, Total=len(new_data), Errors=listing_errors)
+
+        listing_details, thor_listing_details = build_listing_details(json_items, current_task, current_user)
+        _, listing_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user, search_results, listing_details, [listing_info['id']])
+        Listings, filter_errors = apply_filter_plan(filter_plan, Listings)
+        error_data.extend(filter_errors)
+        if not filter_errors:
+            commit_seen(results_check_callback, 'craigslist.com', [listing_info['id']])
+        formatted_ids.add(listing_info['id'])
+        yield task_event('listings', listing_details=listing_details, Listings=Listings, task_telemetry=task_telemetry, thor_listing_details=thor_listing_details)
+
+    # Listings whose details were never fetched are still reported, without details, like Task_Run does
+    remaining_ids = [id for id in new_ids if id not in formatted_ids]
+    if remaining_ids:
+        _, listing_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user, search_results, pd.DataFrame(), remaining_ids)
+        Listings, filter_errors = apply_filter_plan(filter_plan, Listings)
+        error_data.extend(filter_errors)
+        if not filter_errors:
+            commit_seen(results_check_callback, 'craigslist.com', remaining_ids)
+        yield task_event('listings', listing_details=listing_details, Listings=Listings, task_telemetry=task_telemetry, thor_listing_details=[])
+
+    _, _, _, _, user_telemetry = Format_Output(current_task, current_user, pd.DataFrame(), pd.DataFrame(), [])
+    RATE_REGISTRY.report(rate_control, user_telemetry)
+    print(f"{error_data} errors")
+    yield task_event('complete', errors=task_errors(session, current_user, error_data), user_telemetry=user_telemetry, error_data=error_data)
+
 # %% [markdown]
 # # Test Code
 
@@ -15,6 +15,10 @@ from datetime import datetime, timedelta
 import pandas as pd
 import json
 import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from thor_common import HTTP_CACHE, PROXY_HEALTH, RATE_REGISTRY, RETRY_POLICY, SESSION_POOL, PageAccumulator, ProxyHealth, RetryPolicy, SourceKeyPlan, SessionPool, TokenBucket, commit_seen, iter_pipeline, pause, request_error_name, task_blocked, task_errors, task_event
 
 
 # Setting pandas display options for better readability during debugging
@@ -132,9 +136,9 @@ def check_blocked(session, timeout=5):
 # ### KSL Searching Functions
 
 # %%
-def GetSearchListings(session, search_terms, timeout=(5, 5), sleep_time=3, max_pages=10):
+def IterSearchListings(session, search_terms, timeout=(5, 5), sleep_time=3, max_pages=10, rate_limiter=None, retry_policy=None):
     """
-    Fetches car listings based on the given search terms from the specified API endpoint.
+    Fetches car listings based on the given search terms page by page, yielding each page as soon as it arrives.
 
     Args:
         session: The requests session to be used for making HTTP requests.
@@ -142,12 +146,16 @@ def GetSearchListings(session, search_terms, timeout=(5, 5), sleep_time=3, max_p
         timeout (tuple): Timeout settings for the HTTP requests (connect timeout, read timeout).
         sleep_time (int): Time in seconds to sleep between requests to avoid rate limiting.
         max_pages (int): Maximum number of pages to fetch.
+        rate_limiter (AdaptiveRate, optional): Paces the pages instead of sleep_time.
+        retry_policy (RetryPolicy, optional): Retries a failed page. Defaults to RETRY_POLICY.
 
-    Returns:
-        search_results (pd.DataFrame): DataFrame containing the search results.
-        errors (list): List of dictionaries containing error information.
+    Yields:
+        page_results (pd.DataFrame): DataFrame containing the results of the page, including the thor_* fields.
+        errors (list): List of dictionaries containing error information for the page. When a page still fails
+                       after its retries, page_results is empty and the search skips to the next page. It stops
+                       if the first page fails or the session is blocked.
     """
-    print('Function: GetSearchListings')
+    print('Function: IterSearchListings')
 
 
     url = "https://cars.ksl.com/nextjs-api/proxy?"
@@ -205,12 +213,55 @@ def GetSearchListings(session, search_terms, timeout=(5, 5), sleep_time=3, max_p
         }
     }
 
+    retry_policy = retry_policy or RETRY_POLICY
+
+    def fetch_page(body, page_num):
+        cache_key = HTTP_CACHE.key(url, body)
+        try:
+            # Conditional on the validators of the last identical search
+            response = session.post(url, headers={**headers, **HTTP_CACHE.validators(cache_key)}, json=body, timeout=timeout)
+            response.raise_for_status()  # Raises an HTTPError for bad responses
+            print(f'Successful response for page {page_num}')
+        except requests.Timeout:
+            error_info = {
+                "ErrorName": "Timeout",
+                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                "ErrorDescription": f'Timeout error on page {page_num}'
+            }
+            print(error_info["ErrorDescription"])
+            return None, [error_info]
+        except requests.RequestException as e:
+            error_info = {
+                "ErrorName": request_error_name(e),
+                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                "ErrorDescription": f'Error on page {page_num}: {e}'
+            }
+            print(error_info["ErrorDescription"])
+            return None, [error_info]
+
+        try:
+            not_modified = HTTP_CACHE.not_modified(cache_key, response)
+            json_data = HTTP_CACHE.get(cache_key) if not_modified else json.loads(response.text)
+            json_items = json_data['data']['items']
+            results_count = json_data['data']['count']
+            if not_modified:
+                print(f'Page {page_num} not modified')
+            else:
+                HTTP_CACHE.store(cache_key, response, json_data)
+        except (json.JSONDecodeError, KeyError) as e:
+            error_info = {
+                "ErrorName": "JSONDecodeError" if isinstance(e, json.JSONDecodeError) else "KeyError",
+                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                "ErrorDescription": f'Error parsing response JSON on page {page_num}: {e}'
+            }
+            print(error_info["ErrorDescription"])
+            return None, [error_info]
+        return (json_items, results_count), []
+
     page_num = 1
     results_returned = 0
     total_returned = 0
     results_count = 1000
-    search_results = pd.DataFrame()
-    errors = []
 
     while total_returned < results_count and page_num <= max_pages:
 
@@ -235,103 +286,114 @@ def GetSearchListings(session, search_terms, timeout=(5, 5), sleep_time=3, max_p
             # Insert 'trim' and its value right after 'model' and its value
             body['options']['body'][model_index + 2:model_index + 2] = ["trim", search_terms['Trim']]
 
-        try:
-            response = session.post(url, headers=headers, json=body, timeout=timeout)
-            response.raise_for_status()  # Raises an HTTPError for bad responses
-            print(f'Successful response for page {page_num}')
-        except requests.Timeout:
-            error_info = {
-                "ErrorName": "Timeout",
-                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "ErrorDescription": f'Timeout error on page {page_num}'
-            }
-            print(error_info["ErrorDescription"])
-            errors.append(error_info)
-            break  # Exit loop on timeout
-        except requests.RequestException as e:
-            error_info = {
-                "ErrorName": "RequestException",
-                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "ErrorDescription": f'Error on page {page_num}: {e}'
-            }
-            print(error_info["ErrorDescription"])
-            errors.append(error_info)
-            break  # Exit loop on request exception
-
-        try:
-            json_data = json.loads(response.text)
-            json_items = json_data['data']['items']
+        page, errors = retry_policy.call(fetch_page, body, page_num)
+        if errors:
+            yield pd.DataFrame(), errors
+            if page_num == 1 or RetryPolicy.fatal(errors):
+                break  # Nothing to page through without the first page, and no point going on when blocked
+            # Skip the failed page and keep going with the next one
+        else:
+            json_items, results_count = page
             results_returned = len(json_items)
             total_returned += results_returned
-            results_count = json_data['data']['count']
             print(f'Page {page_num} Returned: {results_returned} Total: {total_returned} results so far out of {results_count} total.')
-        except (json.JSONDecodeError, KeyError) as e:
-            error_info = {
-                "ErrorName": "JSONDecodeError" if isinstance(e, json.JSONDecodeError) else "KeyError",
-                "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "ErrorDescription": f'Error parsing response JSON on page {page_num}: {e}'
-            }
-            print(error_info["ErrorDescription"])
-            errors.append(error_info)
-            break  # Exit loop on JSON error
 
-        search_results = pd.concat([search_results, pd.json_normalize(json_items)])
+            if not results_returned:
+                print('No results returned')
+                break # Exit loop on no results
 
-        if not results_returned:
-            print('No results returned')
-            break # Exit loop on no results
-        elif total_returned < results_count:
+            page_results = pd.json_normalize(json_items)
+            if 'id' in page_results.columns:
+                search_url = search_terms['Search Url'] #'"' + '", "'.join(body['options']['body']) + '"'
+                page_results['thor_timestamp'] = int(time.time())
+                page_results['thor_website'] = "ksl.com"
+                page_results['thor_search_url'] = search_url
+                page_results['thor_full_listing_url'] = 'https://cars.ksl.com/listing/' + page_results['id'].astype(str)
+                page_results['thor_listing_url'] = 'https://cars.ksl.com/listing/' + page_results['id'].astype(str)
+
+            yield page_results, []
+
+        if total_returned < results_count:
             page_num += 1
             body['options']['body'][3] = str(page_num)
-            time.sleep(sleep_time) # Sleep only if there are more results
+            if page_num <= max_pages:
+                pause(sleep_time, rate_limiter) # Sleep only if there are more pages to fetch
+
+
+def GetSearchListings(session, search_terms, timeout=(5, 5), sleep_time=3, max_pages=10, pages=None, rate_limiter=None):
+    """
+    Fetches car listings based on the given search terms from the specified API endpoint.
+
+    Collects every page from IterSearchListings into a single DataFrame.
+
+    Args:
+        Same as IterSearchListings.
+        pages (iterator, optional): An already started IterSearchListings iterator to collect instead of
+            starting a new search (e.g. after first_page_blocked read its first page).
 
+    Returns:
+        search_results (pd.DataFrame): DataFrame containing the search results.
+        errors (list): List of dictionaries containing error information.
+    """
+    print('Function: GetSearchListings')
+
+
+    if pages is None:
+        pages = IterSearchListings(session, search_terms, timeout=timeout, sleep_time=sleep_time, max_pages=max_pages, rate_limiter=rate_limiter)
+
+    results = PageAccumulator(key='id')
+    errors = []
+    for page_results, page_errors in pages:
+        results.add(page_results)
+        errors.extend(page_errors)
+
+    search_results = results.to_frame()
     print(search_results.shape)
-    if not search_results.empty and 'id' in search_results.columns:
-        search_results.reset_index(drop=True, inplace=True)
-        search_results = search_results.drop_duplicates(subset='id')
-        print(search_results.shape)
-
-        search_url = search_terms['Search Url'] #'"' + '", "'.join(body['options']['body']) + '"'
-        search_results['thor_timestamp'] = int(time.time())
-        search_results['thor_website'] = "ksl.com"
-        search_results['thor_search_url'] = search_url
-        search_results['thor_full_listing_url'] = 'https://cars.ksl.com/listing/' + search_results['id'].astype(str)
-        search_results['thor_listing_url'] = 'https://cars.ksl.com/listing/' + search_results['id'].astype(str)
-        
+
     return search_results, errors
 
 
 
-def GetListingDetails(session, listing_ids, timeout=(5, 5)):
+def build_listing_details(flattened_data):
     """
-    Fetches details for a list of car listings from the KSL Cars API.
+    Builds the listing details DataFrame from the listing 'attributes' dicts, including the thor_* fields.
+    """
+    listing_details = pd.json_normalize(flattened_data)
+    listing_details.reset_index(drop=True, inplace=True)
+    listing_details = listing_details.drop_duplicates(subset='id')
+    print(listing_details.shape)
+
+    print('Adding standard fields to the DataFrame.')
+    listing_details['thor_timestamp'] = int(time.time())
+    listing_details['thor_website'] = "ksl.com"
+    return listing_details
+
+
+def GetListingDetailsChunk(session, listing_ids, timeout=(5, 15), detail_cache=None, versions=None):
+    """
+    Fetches details for one chunk of car listings from the KSL Cars API with a single POST request.
 
     Args:
         session (requests.Session): The session object used to perform HTTP requests.
-        listing_ids (list): A list of listing IDs for which details are to be fetched.
+        listing_ids (list): The listing IDs of the chunk.
         timeout (tuple): A tuple specifying the connection and read timeout for the request.
+        detail_cache (DetailCache, optional): A thor_common.DetailCache each returned listing is stored in.
+        versions (dict, optional): {id: version} the listings are stored under in detail_cache.
 
     Returns:
         tuple: A tuple containing:
-            - pd.DataFrame: A DataFrame with the details of the listings.
-            - list: A list of errors encountered during the process.
+            - pd.DataFrame: A DataFrame with the details of the listings (empty on error).
+            - list: A list of errors encountered for the chunk.
 
-    Raises:
-        requests.Timeout: If the request times out.
-        requests.RequestException: For any other request-related errors.
-        json.JSONDecodeError: If there is an error in decoding the JSON response.
-        KeyError: If the expected keys are not found in the response JSON.
-    
     Notes:
         The function sends a POST request to the KSL Cars API with the listing IDs in the request body.
         It processes the response JSON to extract the listing details and normalize them into a DataFrame.
         Any errors encountered during the request or JSON parsing are captured and returned in the errors list.
         Additional standard fields are added to the resulting DataFrame.
     """
-    print('Function: GetListingDetails')
+    print('Function: GetListingDetailsChunk')
 
     
-    errors = []
     listing_details = pd.DataFrame()
     json_items = []
 
@@ -387,27 +449,25 @@ def GetListingDetails(session, listing_ids, timeout=(5, 5)):
     }
 
     try:
-        response = session.post(url, headers=headers, json=body)
+        response = session.post(url, headers=headers, json=body, timeout=timeout)
         response.raise_for_status()  # Raises an HTTPError for bad responses
-        print(f'Successful response for page')
+        print(f'Successful response for {len(listing_ids)} listings')
     except requests.Timeout:
         error_info = {
             "ErrorName": "Timeout",
             "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            "ErrorDescription": f'Timeout error on page'
+            "ErrorDescription": f'Timeout error on {len(listing_ids)} listings'
         }
         print(error_info["ErrorDescription"])
-        errors.append(error_info)
-        return listing_details, errors
+        return listing_details, [error_info]
     except requests.RequestException as e:
         error_info = {
-            "ErrorName": "RequestException",
+            "ErrorName": request_error_name(e),
             "ErrorTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            "ErrorDescription": f'Error on page: {e}'
+            "ErrorDescription": f'Error on {len(listing_ids)} listings: {e}'
         }
         print(error_info["ErrorDescription"])
-        errors.append(error_info)
-        return listing_details, errors
+        return listing_details, [error_info]
 
     try:
         json_data = json.loads(response.text)
@@ -422,94 +482,163 @@ def GetListingDetails(session, listing_ids, timeout=(5, 5)):
             "ErrorDescription": f'Error parsing response JSON: {e}'
         }
         print(error_info["ErrorDescription"])
-        errors.append(error_info)
-        return listing_details, errors
+        return listing_details, [error_info]
 
     if len(json_items) and 'attributes' in json_items[0].keys():
         flattened_data = [{**item['attributes']} for item in json_items]
-        listing_details = pd.json_normalize(flattened_data)
-        listing_details.reset_index(drop=True, inplace=True)
-        listing_details = listing_details.drop_duplicates(subset='id')
-        print(listing_details.shape)
-        
-        print('Adding standard fields to the DataFrame.')
-        listing_details['thor_timestamp'] = int(time.time())
-        listing_details['thor_website'] = "ksl.com"
+        listing_details = build_listing_details(flattened_data)
 
-    return listing_details, errors
+        if detail_cache is not None:
+            versions = versions or {}
+            for attributes in flattened_data:
+                detail_cache.put("ksl.com", attributes.get('id'), attributes, versions.get(attributes.get('id')))
 
-# %% [markdown]
-# ## Standard Formatting
+    return listing_details, []
 
-# %%
-def FormatAggregator(ids, results, details, custom, source_key):
+
+def IterListingDetails(session, listing_ids, timeout=(5, 15), chunk_size=25, max_workers=3, rate_limiter=None, retry_policy=None, sleep_time=2, detail_cache=None, versions=None):
     """
-    Aggregates and formats data from multiple DataFrames based on provided IDs and source key mapping.
+    Fetches details for a list of car listings from the KSL Cars API in chunks, yielding each chunk as soon as it is its turn.
 
-    Parameters:
-    ids (list): List of IDs to iterate over and extract data for.
-    results (pd.DataFrame): DataFrame containing results data (not directly used in the function but assumed to be part of locals()).
-    details (pd.DataFrame): DataFrame containing details data (not directly used in the function but assumed to be part of locals()).
-    custom (pd.DataFrame): Default DataFrame to use if no specific DataFrame is mentioned in source_key.
-    source_key (dict): Dictionary mapping target DataFrame columns to source DataFrame columns. The key is the target column name, and the value is a dictionary with the source DataFrame name as key and source column name as value. If value is an empty dictionary, the target column will be filled with None.
+    The ids are split into chunks of chunk_size. Up to max_workers chunks are requested at once, each request
+    takes a token from rate_limiter first, and a failed chunk is retried on its own with the backoff of retry_policy.
+    A chunk that still fails is yielded with its errors and the other chunks are still fetched, unless the session
+    is blocked: the chunks not requested yet are then cancelled and the iteration stops.
 
-    Returns:
-    pd.DataFrame: A DataFrame with the aggregated and formatted data.
-    
-    Example:
-    source_key = {
-        'column1': {'results': 'source_column1'},
-        'column2': {'details': 'source_column2'},
-        'column3': {},  # This will be filled with None
-        'column4': 'custom',  # This will default to the custom DataFrame
-    }
+    Args:
+        session (requests.Session): The session object used to perform HTTP requests.
+        listing_ids (list): A list of listing IDs for which details are to be fetched.
+        timeout (tuple): A tuple specifying the connection and read timeout for each chunk request.
+        chunk_size (int): Maximum number of listing IDs per request.
+        max_workers (int): Maximum number of chunk requests in flight at once.
+        rate_limiter (TokenBucket): Shared rate cap for the chunk requests. Defaults to one request every
+                                    sleep_time seconds with bursts of max_workers requests.
+        retry_policy (RetryPolicy): Retries a failed chunk, taking a new token every time. Defaults to RETRY_POLICY.
+        sleep_time (int): Time in seconds used by the default rate_limiter.
+        detail_cache (DetailCache, optional): A thor_common.DetailCache. Cached listings are yielded first as
+            one chunk without a request, and only the other ids are chunked and fetched.
+        versions (dict, optional): {id: version} used to skip stale cache entries.
 
-    Notes:
-    - The function assumes that the DataFrames (results, details) are present in the local scope.
-    - If a source column specified in source_key is not present in the corresponding DataFrame, the resulting column will be filled with None.
-    - The function concatenates the formatted data into a single DataFrame.
+    Yields:
+        tuple: For every chunk, in the order of listing_ids, a tuple containing:
+            - list: The listing IDs that were requested in the chunk.
+            - pd.DataFrame: A DataFrame with the details of the listings in the chunk.
+            - list: A list of errors for the chunk (empty if a retry succeeded).
     """
-    print('Function: FormatAggregator')
+    print('Function: IterListingDetails')
 
 
-    # Create an empty DataFrame with columns from the keys of source_key
-    formatted_df = pd.DataFrame(columns=source_key.keys())
-    formatted_data = []
-    
-    # Iterate over each id
-    for id_ in ids:
-        row = {}
-        # Iterate over each key in source_key
-        for key, value in source_key.items():
-            if not value:  # If value is an empty dictionary
-                row[key] = value
-                continue
-            
-            if isinstance(value, dict):
-                # Extract the DataFrame and column name
-                df_name, column_name = list(value.items())[0]
-                df = locals().get(df_name)  # Get the DataFrame by its name
-                
-                if df is None or column_name not in df.columns:
-                    row[key] = None
-                else:
-                    # Extract the value from the DataFrame using the id
-                    match = df.loc[df['id'] == id_, column_name]
-                    row[key] = match.values[0] if not match.empty else None
-            else:
-                if key == 'id': # If id, use the current id
-                    row[key] = id_
-                else:
-                    # If the value is not a dictionary, use the provided value directly
-                    row[key] = value
-        
-        # Append the row to the formatted DataFrame
-        formatted_data.append(row)
-    
-    formatted_df = pd.concat([formatted_df, pd.DataFrame(formatted_data)])
-    
-    return formatted_df
+    if detail_cache is not None:
+        hits, listing_ids = detail_cache.split("ksl.com", listing_ids, versions)
+        print(f'Detail cache hits: {len(hits)}, to fetch: {len(listing_ids)}')
+        if hits:
+            yield list(hits), build_listing_details(list(hits.values())), []
+
+    chunks = [listing_ids[start:start + chunk_size] for start in range(0, len(listing_ids), chunk_size)]
+    if rate_limiter is None:
+        rate_limiter = TokenBucket(rate=1 / sleep_time, capacity=max_workers)
 
+    retry_policy = retry_policy or RETRY_POLICY
+    blocked = threading.Event()
+
+    def fetch(chunk_ids):
+        rate_limiter.acquire()
+        if blocked.is_set():
+            return None, None
+        listing_details, errors = GetListingDetailsChunk(session, chunk_ids, timeout=timeout, detail_cache=detail_cache, versions=versions)
+        if RetryPolicy.fatal(errors):
+            blocked.set()
+        return listing_details, errors
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(retry_policy.call, fetch, chunk_ids) for chunk_ids in chunks]
+        try:
+            for chunk_ids, future in zip(chunks, futures):
+                listing_details, errors = future.result()
+                if errors is None:
+                    #Skipped after another worker was blocked
+                    continue
+                yield chunk_ids, listing_details, errors
+                if RetryPolicy.fatal(errors):
+                    return
+        finally:
+            # Stop queued chunks if the consumer stops early
+            for future in futures:
+                future.cancel()
+
+
+def GetListingDetails(session, listing_ids, timeout=(5, 15), chunk_size=25, max_workers=3, rate_limiter=None, retry_policy=None, sleep_time=2, detail_cache=None, versions=None):
+    """
+    Fetches details for a list of car listings from the KSL Cars API.
+
+    Collects every chunk from IterListingDetails into a single DataFrame.
+
+    Args:
+        Same as IterListingDetails.
+
+    Returns:
+        tuple: A tuple containing:
+            - pd.DataFrame: A DataFrame with the details of the listings.
+            - list: A list of errors encountered during the process.
+    """
+    print('Function: GetListingDetails')
+
+
+    details = PageAccumulator(key='id')
+    errors = []
+    for batch_ids, batch_details, batch_errors in IterListingDetails(session, listing_ids, timeout=timeout, chunk_size=chunk_size, max_workers=max_workers, rate_limiter=rate_limiter, retry_policy=retry_policy, sleep_time=sleep_time, detail_cache=detail_cache, versions=versions):
+        details.add(batch_details)
+        errors.extend(batch_errors)
+
+    listing_details = details.to_frame()
+
+    return listing_details, errors
+
+
+# %% [markdown]
+# ## Standard Formatting
+
+# %%
+# Mapping of the standard Listings columns to their source data, compiled once when the script is imported.
+# {'context': ...} entries are filled per call from the current task and user.
+LISTING_SOURCE_KEY = {
+    'title': {'custom': 'title'},
+    'id': 'id',
+    'link': {'results': 'thor_listing_url'},
+    'creation_time': {'results': 'createTime'},
+    'vehicle_condition': {'details': 'exteriorCondition'},
+    'vehicle_color': {'details': 'exteriorColor'},
+    'fuel_type': {'results': 'fuel'},
+    'paid_off': {'results': 'titleType'},
+    'make': {'results': 'make'},
+    'model': {'results': 'model'},
+    'year': {'results': 'makeYear'},
+    'number_owners': '',
+    'seller_type': {'results': 'sellerType'},
+    'vehicle_trim': {'results': 'trim'},
+    'vin': {'results': 'vin'},
+    'listing_photos': {'custom': 'images'},
+    'seller_name': {'results': 'firstName'},
+    'location': {'custom': 'location'},
+    'location_city': {'results': 'city'},
+    'location_state': {'results': 'state'},
+    'location_country': '',
+    'description': {'details': 'description'},
+    'price': {'results': 'price'},
+    'strikethrough_price': {'results': 'previousLowPrice'},
+    'odometer_unit': '',
+    'odometer_value': {'results': 'mileage'},
+    'thor_timestamp': {'results': 'thor_timestamp'},
+    'thor_website': "ksl.com",
+    'thor_mmr': False,
+    'thor_task': {'context': 'thor_task'},
+    'thor_user': {'context': 'thor_user'},
+    'Task': {'context': 'Task'},
+    'Host': {'context': 'Host'},
+    'Account': {'context': 'Account'}
+}
+
+LISTING_PLAN = SourceKeyPlan(LISTING_SOURCE_KEY)
 
 
 def Format_Output(current_task, current_user, search_results, listing_details, ids):
@@ -532,51 +661,14 @@ def Format_Output(current_task, current_user, search_results, listing_details, i
         - user_telemetry (DataFrame): DataFrame containing user telemetry information.
 
     Notes:
-    - The function uses a source key dictionary to map specific fields to their corresponding sources (custom, results, or details).
+    - LISTING_SOURCE_KEY maps specific fields to their corresponding sources (custom, results, details, or the per-call context).
     - It ensures required columns are present in the listing details before processing.
     - Custom data is created by extracting and transforming specific fields such as images, title, and location.
-    - The final Listings DataFrame is generated using the FormatAggregator function.
+    - The final Listings DataFrame is generated by executing LISTING_PLAN, the compiled LISTING_SOURCE_KEY.
     - Task telemetry and user telemetry data are also created and returned as part of the output.
     """
     print('Function: Format_Output')
 
-    
-    source_key = {
-        'title': {'custom': 'title'},
-        'id': 'id',
-        'link': {'results': 'thor_listing_url'},
-        'creation_time': {'results': 'createTime'},
-        'vehicle_condition': {'details': 'exteriorCondition'},
-        'vehicle_color': {'details': 'exteriorColor'},
-        'fuel_type': {'results': 'fuel'},
-        'paid_off': {'results': 'titleType'},
-        'make': {'results': 'make'},
-        'model': {'results': 'model'},
-        'year': {'results': 'makeYear'},
-        'number_owners': '',
-        'seller_type': {'results': 'sellerType'},
-        'vehicle_trim': {'results': 'trim'},
-        'vin': {'results': 'vin'},
-        'listing_photos': {'custom': 'images'},
-        'seller_name': {'results': 'firstName'},
-        'location': {'custom': 'location'},
-        'location_city': {'results': 'city'},
-        'location_state': {'results': 'state'},
-        'location_country': '',
-        'description': {'details': 'description'},
-        'price': {'results': 'price'},
-        'strikethrough_price': {'results': 'previousLowPrice'},
-        'odometer_unit': '',
-        'odometer_value': {'results': 'mileage'},
-        'thor_timestamp': {'results': 'thor_timestamp'},
-        'thor_website': "ksl.com",
-        'thor_mmr': False,
-        'thor_task': f"{current_task}",
-        'thor_user': f"{current_user}",
-        'Task': current_task['TaskName'],
-        'Host': current_task["Host"],
-        'Account': current_user["AccountInfo"]["AccountID"]
-    }
 
     # Ensure 'id' and 'photo' are in the columns before proceeding
     required_columns = ['id', 'photo', 'makeYear', 'make', 'model', 'trim', 'city', 'state']
@@ -593,7 +685,19 @@ def Format_Output(current_task, current_user, search_results, listing_details, i
     else:
         custom_data = pd.DataFrame(columns=['id', 'photo', 'images', 'title'])
 
-    Listings = FormatAggregator(ids, search_results, listing_details, custom_data, source_key)
+    context = {
+        'thor_task': f"{current_task}",
+        'thor_user': f"{current_user}",
+        'Task': current_task['TaskName'],
+        'Host': current_task["Host"],
+        'Account': current_user["AccountInfo"]["AccountID"]
+    }
+    sources = {
+        'results': search_results,
+        'details': listing_details,
+        'custom': custom_data
+    }
+    Listings = LISTING_PLAN.execute(ids, sources, context)
 
 
     # Create task_telemetry/Will Be phased out
@@ -615,7 +719,65 @@ def Format_Output(current_task, current_user, search_results, listing_details, i
 # 
 
 # %%
-def Task_Run(driver, current_profile, current_task, current_user, results_check_callback, user_timer):
+def build_session(current_user):
+    """
+    Builds a new requests session with the default headers and the user's proxy, if one is set.
+
+    Args:
+        current_user (dict): Information about the current user including proxy details.
+
+    Returns:
+        requests.Session: The session.
+    """
+    # Create a session object
+    session = requests.Session()
+    session.headers.update({
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"
+    })
+
+    if current_user['ProxyInfo']['ProxyIp'] != '':
+        proxy = {
+            'http': current_user['ProxyInfo']['ProxyIp'] + ':' + current_user['ProxyInfo']['ProxyPort'],
+            'https':current_user['ProxyInfo']['ProxyIp'] + ':' + current_user['ProxyInfo']['ProxyPort']
+        }
+
+        # Configure the session to use the proxy
+        session.proxies.update(proxy)
+
+    return session
+
+
+def create_session(current_user):
+    """
+    Borrows the requests session for a task from thor_common.SESSION_POOL, keyed by website, proxy and account,
+    so its cookies and open connections are reused across Task_Run calls. The session is built with
+    build_session the first time.
+
+    The proxy is checked through thor_common.PROXY_HEALTH, which caches healthy verdicts for its ttl.
+
+    Args:
+        current_user (dict): Information about the current user including proxy details.
+
+    Returns:
+        tuple: A tuple containing the session (requests.Session) and a boolean indicating if the proxy
+               is working (always True when no proxy is configured).
+    """
+    print('Function: create_session')
+
+
+    session = SESSION_POOL.borrow(SessionPool.key("ksl.com", current_user), lambda: build_session(current_user))
+
+    if current_user['ProxyInfo']['ProxyIp'] != '':
+        # The icanhazip round trip only runs when the cached verdict has expired or a request failed
+        proxy_set = PROXY_HEALTH.verify(ProxyHealth.key(current_user), ProxyHealth.checker(check_proxy, session.proxies, current_user['ProxyInfo']['ProxyIp']))
+        print('Proxy Set: ', proxy_set)
+    else:
+        proxy_set = True
+
+    return session, proxy_set
+
+
+def Task_Run(driver, current_profile, current_task, current_user, results_check_callback, user_timer, stream=False, pipeline=False, detail_cache=None, block_probe=True, adaptive_rate=False):
     """
     Executes a task using the given parameters and handles session management, proxy settings, 
     and result processing.
@@ -625,8 +787,20 @@ def Task_Run(driver, current_profile, current_task, current_user, results_check_
         current_profile (dict): The current profile details.
         current_task (dict): The current task details including search terms.
         current_user (dict): Information about the current user including proxy details.
-        results_check_callback (function): Callback function to check and compare results.
+        results_check_callback (function): Callback function to check and compare results. A thor_common.SeenIndex
+            can be passed as a built-in, persistent callback.
         user_timer (object): Timer object to track user account activity.
+        stream (bool, optional): If True, yield the events of `Task_Run_Stream` instead of a single final tuple.
+        pipeline (bool, optional): If True, run `Task_Run_Pipeline`, which overlaps the search, compare and
+            detail stages and yields the same tuple.
+        detail_cache (DetailCache, optional): A thor_common.DetailCache shared across tasks. Listings already in
+            the cache are not requested again (default is None, always fetch).
+        block_probe (bool, optional): If True (default), run the standalone `check_blocked` probe before
+            searching. If False, the block check is derived from the first search page and the probe only
+            runs when that page fails in an ambiguous way (timeout or connection error), saving one request.
+        adaptive_rate (bool, optional): If True, pace every request with the thor_common.AdaptiveRate of the
+            website and proxy from RATE_REGISTRY instead of the fixed sleeps. The learned interval is saved
+            between runs and reported as 'RequestInterval' in user_telemetry.
 
     Yields:
         tuple: A tuple containing the following elements:
@@ -652,43 +826,30 @@ def Task_Run(driver, current_profile, current_task, current_user, results_check_
     print('Main Funtion: Task_Run')
 
 
+    if stream:
+        yield from Task_Run_Stream(driver, current_profile, current_task, current_user, results_check_callback, user_timer, detail_cache=detail_cache, block_probe=block_probe, adaptive_rate=adaptive_rate)
+        return
+    if pipeline:
+        yield from Task_Run_Pipeline(driver, current_profile, current_task, current_user, results_check_callback, user_timer, detail_cache=detail_cache, block_probe=block_probe, adaptive_rate=adaptive_rate)
+        return
+
     #How to track how long the user account has been active
     user_status = user_timer.status()
     
-    # Create a session object
-    session = requests.Session()
-    session.headers.update({
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"
-    })
-
-    if current_user['ProxyInfo']['ProxyIp'] != '':
-        proxy = {
-            'http': current_user['ProxyInfo']['ProxyIp'] + ':' + current_user['ProxyInfo']['ProxyPort'],
-            'https':current_user['ProxyInfo']['ProxyIp'] + ':' + current_user['ProxyInfo']['ProxyPort']
-        }
-
-        # Configure the session to use the proxy
-        session.proxies.update(proxy)
-        proxy_set = check_proxy(session, current_user['ProxyInfo']['ProxyIp']) 
-        
-        print('Proxy Set: ', proxy_set)
-    else:
-        proxy_set = True
+    session, proxy_set = create_session(current_user)
+    rate_control = RATE_REGISTRY.attach("ksl.com", current_user, session, interval=2) if adaptive_rate else None
 
 
     #Check if Blocked
-    is_blocked, blocked_errors = check_blocked(session)
-    print(f"is blocked: {is_blocked}")
-    if is_blocked or proxy_set == False:
-        errors = {"Disable": True, "error_data": [blocked_errors]}   
-        print(errors)
-
+    search_pages = IterSearchListings(session, current_task['SearchTerms'], sleep_time=3, rate_limiter=rate_control)
+    errors, search_pages = task_blocked(session, current_user, proxy_set, search_pages, lambda: check_blocked(session), block_probe)
+    if errors:
         final_results, final_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user, pd.DataFrame(), pd.DataFrame(), [])
         yield final_results, final_details, Listings, task_telemetry, user_telemetry, errors
         return
 
 
-    search_results, errors = GetSearchListings(session, current_task['SearchTerms'], sleep_time=3)
+    search_results, errors = GetSearchListings(session, current_task['SearchTerms'], sleep_time=3, pages=search_pages)
     print(errors)
 
     # Check For New Listings
@@ -705,12 +866,15 @@ def Task_Run(driver, current_profile, current_task, current_user, results_check_
 
     #Get listing Details
     if len(new_results) > 0:
-        listing_details, errors = GetListingDetails(session, new_ids)
+        listing_details, detail_errors = GetListingDetails(session, new_ids, rate_limiter=rate_control, detail_cache=detail_cache)
+        errors.extend(detail_errors)
     else:
         listing_details = pd.DataFrame()
         
     #Format standard Output
     search_results, listing_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user,  search_results, listing_details, new_ids)
+    commit_seen(results_check_callback, 'ksl.com', new_ids)
+    RATE_REGISTRY.report(rate_control, user_telemetry)
 
     print(f"{len(search_results)} search_results")
     print(f"{len(listing_details)} listing_details")
@@ -718,10 +882,206 @@ def Task_Run(driver, current_profile, current_task, current_user, results_check_
     print(f"{len(task_telemetry)} task_telemetry")
     print(f"{len(user_telemetry)} user_telemetry")
     print(f"{errors} errors")
-    errors = {}
+    errors = task_errors(session, current_user, errors)
     
     yield search_results, listing_details, Listings, task_telemetry, user_telemetry, errors
 
+
+def Task_Run_Pipeline(driver, current_profile, current_task, current_user, results_check_callback, user_timer, chunk_size=25, max_workers=3, detail_cache=None, block_probe=True, adaptive_rate=False):
+    """
+    Pipelined version of Task_Run. Each search page is compared with `results_check_callback` as soon as it
+    arrives and its new listings are queued in chunks for their detail requests while later pages are still
+    downloading, so the task takes about as long as the slower of the search and the details instead of both added together.
+
+    Args:
+        Same as Task_Run.
+        chunk_size (int): Maximum number of listing IDs per detail request.
+        max_workers (int): Maximum number of detail requests in flight at once.
+
+    Yields:
+        tuple: The same tuple as Task_Run.
+    """
+    print('Main Funtion: Task_Run_Pipeline')
+
+
+    #How to track how long the user account has been active
+    user_status = user_timer.status()
+
+    session, proxy_set = create_session(current_user)
+    rate_control = RATE_REGISTRY.attach("ksl.com", current_user, session, interval=2) if adaptive_rate else None
+
+    #Check if Blocked
+    search_pages = IterSearchListings(session, current_task['SearchTerms'], sleep_time=3, rate_limiter=rate_control)
+    errors, search_pages = task_blocked(session, current_user, proxy_set, search_pages, lambda: check_blocked(session), block_probe)
+    if errors:
+        final_results, final_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user, pd.DataFrame(), pd.DataFrame(), [])
+        yield final_results, final_details, Listings, task_telemetry, user_telemetry, errors
+        return
+
+    compare_columns = {
+        'id': 'id',
+    }
+    seen_ids = set()
+
+    def compare_page(page_results):
+        if page_results.empty:
+            return []
+        new_results = results_check_callback(page_results, 'ksl.com', compare_columns)
+        print(f"****************COMPARE PAGE****************** {len(page_results)} Results {len(new_results)} New")
+
+        #ensure no blanks or ids already queued from an earlier page
+        page_new_ids = []
+        for id in new_results['id'].to_list():
+            if id and id not in seen_ids:
+                seen_ids.add(id)
+                page_new_ids.append(id)
+        return [page_new_ids[start:start + chunk_size] for start in range(0, len(page_new_ids), chunk_size)]
+
+    rate_limiter = rate_control or TokenBucket(rate=1 / 2, capacity=max_workers)
+
+    blocked = threading.Event()
+
+    def fetch_chunk(chunk_ids):
+        rate_limiter.acquire()
+        if blocked.is_set():
+            return None, None
+        listing_details, errors = GetListingDetailsChunk(session, chunk_ids, detail_cache=detail_cache)
+        if RetryPolicy.fatal(errors):
+            blocked.set()
+        return listing_details, errors
+
+    def fetch_details(chunk_ids):
+        cached = pd.DataFrame()
+        if detail_cache is not None:
+            hits, chunk_ids = detail_cache.split("ksl.com", chunk_ids)
+            if hits:
+                cached = build_listing_details(list(hits.values()))
+            if not chunk_ids:
+                return cached, []
+        listing_details, errors = RETRY_POLICY.call(fetch_chunk, chunk_ids)
+        if errors is None:
+            #Skipped after the session was blocked, only the cached listings are kept
+            return cached, []
+        return pd.concat([cached, listing_details], ignore_index=True), errors
+
+    pages = PageAccumulator(key='id')
+    details = PageAccumulator(key='id')
+    errors = []
+    new_ids = []
+    for stage, *data in iter_pipeline(search_pages, compare_page, fetch_details, max_workers=max_workers, stop=blocked):
+        if stage == 'page':
+            page_results, page_errors, page_new_chunks = data
+            pages.add(page_results)
+            errors.extend(page_errors)
+            for chunk_ids in page_new_chunks:
+                new_ids.extend(chunk_ids)
+        else:
+            chunk_ids, (chunk_details, chunk_errors) = data
+            details.add(chunk_details)
+            errors.extend(chunk_errors)
+
+    search_results = pages.to_frame()
+    listing_details = details.to_frame()
+
+    #Format standard Output
+    search_results, listing_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user,  search_results, listing_details, new_ids)
+    commit_seen(results_check_callback, 'ksl.com', new_ids)
+    RATE_REGISTRY.report(rate_control, user_telemetry)
+
+    print(f"{len(search_results)} search_results")
+    print(f"{len(listing_details)} listing_details")
+    print(f"{len(Listings)} Listings")
+    print(f"{errors} errors")
+    errors = task_errors(session, current_user, errors)
+
+    yield search_results, listing_details, Listings, task_telemetry, user_telemetry, errors
+
+
+def Task_Run_Stream(driver, current_profile, current_task, current_user, results_check_callback, user_timer, detail_cache=None, block_probe=True, adaptive_rate=False):
+    """
+    Streaming version of Task_Run. Yields events as each search page and each chunk of listing details arrives,
+    so downstream consumers can start DB writes and alerting before the whole task has finished.
+
+    Args:
+        Same as Task_Run.
+
+    Yields:
+        dict: An event dictionary (see thor_common.task_event) with one of the following 'Event' values:
+            - 'progress': 'Stage' ('search', 'compare' or 'details') with the counts and errors for that step.
+            - 'search_results': 'search_results' (DataFrame) once every search page has been collected.
+            - 'listings': A formatted increment with 'listing_details', 'Listings' and 'task_telemetry'
+              for the listings whose details just arrived.
+            - 'complete': The final 'errors' dictionary in the same shape Task_Run yields, 'user_telemetry'
+              and 'error_data', the list of every error encountered during the task.
+    """
+    print('Main Funtion: Task_Run_Stream')
+
+
+    #How to track how long the user account has been active
+    user_status = user_timer.status()
+
+    session, proxy_set = create_session(current_user)
+    rate_control = RATE_REGISTRY.attach("ksl.com", current_user, session, interval=2) if adaptive_rate else None
+
+    #Check if Blocked
+    search_pages = IterSearchListings(session, current_task['SearchTerms'], sleep_time=3, rate_limiter=rate_control)
+    errors, search_pages = task_blocked(session, current_user, proxy_set, search_pages, lambda: check_blocked(session), block_probe)
+    if errors:
+        final_results, final_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user, pd.DataFrame(), pd.DataFrame(), [])
+        yield task_event('complete', errors=errors, user_telemetry=user_telemetry, error_data=errors['error_data'])
+        return
+
+    error_data = []
+
+    pages = PageAccumulator(key='id')
+    for page_num, (page_results, page_errors) in enumerate(search_pages, start=1):
+        pages.add(page_results)
+        error_data.extend(page_errors)
+        yield task_event('progress', Stage='search', Page=page_num, Results=len(page_results), Errors=page_errors)
+
+    search_results = pages.to_frame()
+    yield task_event('search_results', search_results=search_results)
+
+    # Check For New Listings
+    print(f"****************COMPARE DB****************** {len(search_results)} Results")
+    compare_columns = {
+        'id': 'id',
+    }
+    new_results = results_check_callback(search_results, 'ksl.com', compare_columns)
+    print(f"****************COMPARE DB Complete****************** {len(new_results)} New")
+
+    #get list of new IDs and ensure no blanks or duplicates
+    new_ids = new_results['id'].to_list()
+    new_ids = [*{item for item in new_ids if item}]
+    yield task_event('progress', Stage='compare', Results=len(search_results), New=len(new_ids))
+
+    #Get listing Details and format each chunk as soon as it arrives
+    formatted_ids = set()
+    requested = 0
+    for batch_ids, batch_details, batch_errors in IterListingDetails(session, new_ids, rate_limiter=rate_control, detail_cache=detail_cache):
+        error_data.extend(batch_errors)
+        requested += len(batch_ids)
+        yield task_event('progress', Stage='details', Fetched=requested, Total=len(new_ids), Errors=batch_errors)
+
+        if batch_details.empty:
+            continue
+        _, listing_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user, search_results, batch_details, batch_ids)
+        commit_seen(results_check_callback, 'ksl.com', batch_ids)
+        formatted_ids.update(batch_ids)
+        yield task_event('listings', listing_details=listing_details, Listings=Listings, task_telemetry=task_telemetry)
+
+    # Listings whose details were never fetched are still reported, without details, like Task_Run does
+    remaining_ids = [id for id in new_ids if id not in formatted_ids]
+    if remaining_ids:
+        _, listing_details, Listings, task_telemetry, user_telemetry = Format_Output(current_task, current_user, search_results, pd.DataFrame(), remaining_ids)
+        commit_seen(results_check_callback, 'ksl.com', remaining_ids)
+        yield task_event('listings', listing_details=listing_details, Listings=Listings, task_telemetry=task_telemetry)
+
+    _, _, _, _, user_telemetry = Format_Output(current_task, current_user, pd.DataFrame(), pd.DataFrame(), [])
+    RATE_REGISTRY.report(rate_control, user_telemetry)
+    print(f"{error_data} errors")
+    yield task_event('complete', errors=task_errors(session, current_user, error_data), user_telemetry=user_telemetry, error_data=error_data)
+
 # %% [markdown]
 # ## Test Code
 
@@ -0,0 +1,1580 @@
+# ## Imports
+#
+# Shared helpers used by the site scraping scripts (autotrader_pie, craigslist_pie, ksl_pie).
+# Anything that is identical across the websites lives here so every site runs the same engine.
+
+# %%
+from datetime import datetime
+import asyncio
+import itertools
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+# Setting pandas display options for better readability during debugging
+pd.set_option('display.max_columns', None)  # Display all columns in DataFrames
+pd.set_option('display.max_rows', None)     # Display all rows in DataFrames
+pd.options.mode.chained_assignment = None   # Disable warning for chained assignments
+
+# %% [markdown]
+# ## Standard Formatting
+
+# %%
+def index_source(df, columns):
+    """
+    Index a source DataFrame on 'id' once so columns can be pulled for many ids with a single join.
+
+    Args:
+        df (pd.DataFrame): The source DataFrame (results, details or custom).
+        columns (list): The source columns that are needed from this DataFrame.
+
+    Returns:
+        pd.DataFrame or None: The requested columns indexed by id (first row kept for duplicate ids),
+        or None if the DataFrame is missing or has no 'id' column.
+    """
+    if df is None or 'id' not in df.columns:
+        return None
+
+    columns = [column for column in dict.fromkeys(columns) if column in df.columns]
+    first_rows = ~df['id'].duplicated(keep='first')
+    indexed = df.loc[first_rows, columns]
+    indexed.index = pd.Index(df.loc[first_rows, 'id'])
+    return indexed
+
+
+class SourceKeyPlan:
+    """
+    A source_key mapping compiled once into a reusable projection plan.
+
+    Compiling resolves, for every output column, whether it is filled from a source DataFrame
+    column, from the per-call context, from the id itself, or with a constant. Executing the plan
+    then only joins each needed source DataFrame once against the ids.
+
+    Sources:
+        - 'results', 'details', 'custom' (or any other name passed to execute): DataFrames indexed on 'id'.
+        - 'context': A dict of per-call values such as the current task and user.
+
+    Example:
+        source_key = {
+            'title': {'results': 'title'},   # Column 'title' from the results DataFrame
+            'id': 'id',                      # The current id
+            'number_owners': '',             # Filled with ''
+            'thor_website': "ksl.com",       # Filled with "ksl.com"
+            'Task': {'context': 'Task'},     # context['Task'] passed to execute
+        }
+        plan = SourceKeyPlan(source_key)
+        Listings = plan.execute(ids, {'results': search_results}, context={'Task': current_task['TaskName']})
+    """
+
+    def __init__(self, source_key):
+        self.columns = list(source_key.keys())
+        self.steps = []
+        self.projections = {}
+
+        for key, value in source_key.items():
+            if not value:  # Empty values are used as the fill value
+                self.steps.append((key, 'fill', value))
+            elif isinstance(value, dict):
+                df_name, column_name = list(value.items())[0]
+                if df_name == 'context':
+                    self.steps.append((key, 'context', column_name))
+                else:
+                    self.steps.append((key, 'column', (df_name, column_name)))
+                    projection = self.projections.setdefault(df_name, [])
+                    if column_name not in projection:
+                        projection.append(column_name)
+            elif key == 'id':
+                self.steps.append((key, 'id', None))
+            else:
+                self.steps.append((key, 'fill', value))
+
+    def required_columns(self, df_name=None):
+        """
+        Report the raw columns the plan reads, so upstream stages can skip everything else.
+
+        Args:
+            df_name (str, optional): Limit the report to one source DataFrame.
+
+        Returns:
+            dict or list: {df_name: [columns]} for every source, or the column list for df_name
+            (always including 'id', which is the join key).
+        """
+        if df_name is not None:
+            return ['id', *[column for column in self.projections.get(df_name, []) if column != 'id']]
+        return {name: self.required_columns(name) for name in self.projections}
+
+    def execute(self, ids, sources, context=None):
+        """
+        Build the formatted DataFrame for the given ids.
+
+        Args:
+            ids (list): List of IDs to extract data for. The output has one row per id, in the same order.
+            sources (dict): Registry of source DataFrames by name, e.g. {'results': ..., 'details': ..., 'custom': ...}.
+            context (dict, optional): Per-call values referenced with {'context': name} in the source_key.
+
+        Returns:
+            pd.DataFrame: A DataFrame with one column per source_key entry.
+
+        Notes:
+        - If a source DataFrame is missing, or a source column is not present in it, the resulting column will be filled with None.
+        - If an id is not present in a source DataFrame, the value for that id will be None.
+        - If an id appears more than once in a source DataFrame, the first row is used.
+        """
+        context = context or {}
+        ids = list(ids)
+        if not ids:
+            return pd.DataFrame(columns=self.columns)
+
+        joined = {}
+        found = {}
+        for df_name, columns in self.projections.items():
+            indexed = index_source(sources.get(df_name), columns)
+            if indexed is None:
+                continue
+            joined[df_name] = indexed.reindex(ids).reset_index(drop=True)
+            found[df_name] = pd.Series(pd.Index(ids).isin(indexed.index))
+
+        formatted_data = {}
+        for key, kind, payload in self.steps:
+            if kind == 'column':
+                df_name, column_name = payload
+                if df_name not in joined or column_name not in joined[df_name].columns:
+                    formatted_data[key] = [None] * len(ids)
+                else:
+                    # Ids missing from the source get None, matching a failed lookup
+                    formatted_data[key] = joined[df_name][column_name].where(found[df_name], None)
+            elif kind == 'context':
+                formatted_data[key] = [context.get(payload)] * len(ids)
+            elif kind == 'id':
+                formatted_data[key] = ids
+            else:
+                formatted_data[key] = [payload] * len(ids)
+
+        return pd.DataFrame(formatted_data, columns=self.columns)
+
+
+def FormatAggregator(ids, results, details, custom, source_key):
+    """
+    Aggregates and formats data from multiple DataFrames based on provided IDs and source key mapping.
+
+    Compiles source_key into a SourceKeyPlan and executes it. Callers that format repeatedly with
+    the same source_key should compile the plan once and call SourceKeyPlan.execute directly.
+
+    Parameters:
+    ids (list): List of IDs to extract data for. The output has one row per id, in the same order.
+    results (pd.DataFrame): DataFrame containing results data.
+    details (pd.DataFrame): DataFrame containing details data.
+    custom (pd.DataFrame): DataFrame containing custom data built by Format_Output.
+    source_key (dict): Dictionary mapping target DataFrame columns to source DataFrame columns. The key is the target column name, and the value is a dictionary with the source DataFrame name as key and source column name as value. If value is empty, the target column will be filled with that value.
+
+    Returns:
+    pd.DataFrame: A DataFrame with the aggregated and formatted data.
+
+    Example:
+    source_key = {
+        'column1': {'results': 'source_column1'},
+        'column2': {'details': 'source_column2'},
+        'column3': {},  # This will be filled with {}
+        'column4': 'custom',  # This will be filled with the string 'custom'
+        'id': 'id',  # The 'id' column is always filled with the current id
+    }
+    """
+    print('Function: FormatAggregator')
+
+
+    sources = {
+        'results': results,
+        'details': details,
+        'custom': custom,
+    }
+
+    return SourceKeyPlan(source_key).execute(ids, sources)
+
+
+class PageAccumulator:
+    """
+    Append-only collector for search pages and detail responses.
+
+    Records are deduplicated by `key` as they are appended (the first record of a key is kept, like
+    drop_duplicates), and the DataFrame is only built once at the end, so collecting N pages is linear
+    in the total number of rows instead of re-concatenating on every page.
+
+    Pages can be DataFrames or lists of dicts. DataFrame pages without the key column are kept as they are.
+
+    Example:
+        search_results = PageAccumulator(key='id')
+        for page_results, page_errors in IterSearchListings(session, search_terms):
+            search_results.add(page_results)
+        search_results = search_results.to_frame()
+    """
+
+    def __init__(self, key='id'):
+        self.key = key
+        self.seen = set()
+        self.parts = []
+        self.count = 0
+
+    def add(self, page):
+        """
+        Append the records of a page whose key has not been seen yet.
+
+        Args:
+            page (pd.DataFrame or list): The page records.
+
+        Returns:
+            int: The number of new records appended.
+        """
+        if page is None or not len(page):
+            return 0
+
+        if isinstance(page, pd.DataFrame):
+            if self.key in page.columns:
+                # Membership is checked per key of this page so the cost does not grow with the rows already seen
+                keys = page[self.key]
+                unseen = [key not in self.seen for key in keys]
+                page = page[pd.Series(unseen, index=page.index) & ~keys.duplicated()]
+                self.seen.update(page[self.key])
+        else:
+            new_records = []
+            for record in page:
+                record_key = record.get(self.key)
+                if record_key not in self.seen:
+                    self.seen.add(record_key)
+                    new_records.append(record)
+            page = new_records
+
+        if len(page):
+            self.parts.append(page)
+            self.count += len(page)
+        return len(page)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, record_key):
+        return record_key in self.seen
+
+    def records(self):
+        """
+        Returns:
+            list: Every appended record as a dict, in the order they were appended.
+        """
+        records = []
+        for part in self.parts:
+            records.extend(part.to_dict(orient='records') if isinstance(part, pd.DataFrame) else part)
+        return records
+
+    def to_frame(self):
+        """
+        Returns:
+            pd.DataFrame: Every appended record in one DataFrame with a fresh index (empty if nothing was appended).
+        """
+        if not self.parts:
+            return pd.DataFrame()
+        if not any(isinstance(part, pd.DataFrame) for part in self.parts):
+            return pd.DataFrame(self.records())
+        frames = [part if isinstance(part, pd.DataFrame) else pd.DataFrame(part) for part in self.parts]
+        return pd.concat(frames, ignore_index=True)
+
+
+# %% [markdown]
+# ## Task Events
+
+# %%
+def task_event(event, **data):
+    """
+    Build an event dictionary for the streaming Task_Run mode.
+
+    Args:
+        event (str): The event type, e.g. 'progress', 'search_results', 'listings' or 'complete'.
+        **data: The event payload.
+
+    Returns:
+        dict: {'Event': event, 'EventTime': 'YYYY-mm-dd HH:MM:SS', **data}
+    """
+    return {
+        "Event": event,
+        "EventTime": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        **data
+    }
+
+
+# %% [markdown]
+# ## Rate Limiting
+
+# %%
+class TokenBucket:
+    """
+    Thread-safe token bucket used to pace requests to a website.
+
+    Tokens are added at `rate` per second up to `capacity`. Every request takes one token with acquire(),
+    which blocks until a token is available. The long-run request rate is capped at `rate` while up to
+    `capacity` requests can start back to back after an idle period. The bucket starts with a single token,
+    so a run does not open with a burst.
+
+    Example:
+        bucket = TokenBucket(rate=0.5, capacity=5)  # One request every 2 seconds on average, bursts of 5
+        bucket.acquire()
+        response = session.get(url)
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = min(1, capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Take one token, sleeping until one is available.
+
+        Returns:
+            float: The number of seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class HostPacer:
+    """
+    asyncio pacing policy that spaces out the requests made to each host.
+
+    Every call to wait(host) reserves the next start slot for that host, at least `min_interval` seconds
+    after the previous one, and sleeps until the slot is reached. Different hosts do not wait on each other.
+
+    Example:
+        pacer = HostPacer(min_interval=0.8)
+        await pacer.wait("rapi.craigslist.org")
+        response = await loop.run_in_executor(None, session.get, url)
+    """
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self.next_start = {}
+        self.lock = threading.Lock()
+
+    async def wait(self, host):
+        """
+        Wait for the next request slot of a host.
+
+        Args:
+            host (str): The host the request is going to.
+
+        Returns:
+            float: The number of seconds spent waiting.
+        """
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start.get(host, now))
+            self.next_start[host] = start + self.min_interval
+        delay = start - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+
+class AdaptiveRate:
+    """
+    AIMD request pacing for one (website, proxy), learned from the responses instead of a hand picked sleep_time.
+
+    Every fast 2xx response adds `increase` requests per second to the rate (additive increase, so the
+    interval between requests slowly shrinks down to min_interval). A 403 or 429, a timeout, or a latency above
+    spike_factor times the running average divides the rate by `backoff` (multiplicative decrease).
+
+    The controller works wherever a TokenBucket (acquire()) or a HostPacer (await wait(host)) is accepted.
+    attach(session) mounts a RateAdapter that reports every response of the session to record().
+
+    Example:
+        rate_control = AdaptiveRate(interval=2)
+        rate_control.attach(session)
+        rate_control.acquire()
+        response = session.get(url)
+    """
+
+    def __init__(self, interval, min_interval=0.25, max_interval=60, increase=0.02, backoff=2.0, spike_factor=3.0):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.increase = increase
+        self.backoff = backoff
+        self.spike_factor = spike_factor
+        self.latency = None
+        self.next_start = 0.0
+        self.last_sent = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, status=None, latency=None, timeout=False):
+        """
+        Adjust the interval from the outcome of one request.
+
+        Args:
+            status (int, optional): The HTTP status code of the response.
+            latency (float, optional): The response time in seconds.
+            timeout (bool): True if the request timed out.
+
+        Returns:
+            float: The new interval in seconds.
+        """
+        with self.lock:
+            spike = latency is not None and self.latency is not None and latency > self.spike_factor * self.latency
+            if timeout or status in (403, 429) or spike:
+                self.interval = min(self.max_interval, self.interval * self.backoff)
+            elif status is not None and 200 <= status < 300:
+                self.interval = max(self.min_interval, 1 / (1 / self.interval + self.increase))
+            if latency is not None and not spike:
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            return self.interval
+
+    def reserve(self):
+        """
+        Reserve the next request slot, at least one interval after the previous slot and after the last request
+        sent through an attached session.
+
+        Returns:
+            float: The number of seconds until the slot.
+        """
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start, self.last_sent + self.interval)
+            self.next_start = start + self.interval
+        return start - now
+
+    def acquire(self):
+        """
+        Sleep until the next request slot (TokenBucket interface).
+
+        Returns:
+            float: The number of seconds spent waiting.
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    async def wait(self, host=None):
+        """
+        Wait for the next request slot (HostPacer interface). Every host of the website shares the slots.
+
+        Returns:
+            float: The number of seconds spent waiting.
+        """
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def attach(self, session):
+        """
+        Mount a RateAdapter on the session so its responses feed record(). Adapters that are already
+        reporting to this controller are kept.
+        """
+        for prefix in ('https://', 'http://'):
+            adapter = session.adapters.get(prefix)
+            if isinstance(adapter, RateAdapter) and adapter.rate_control is self:
+                continue
+            session.mount(prefix, RateAdapter(
+                self,
+                pool_connections=getattr(adapter, '_pool_connections', 10),
+                pool_maxsize=getattr(adapter, '_pool_maxsize', 20)
+            ))
+        return session
+
+    def to_dict(self):
+        with self.lock:
+            return {'interval': self.interval, 'latency': self.latency}
+
+
+class RateAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that reports the status, latency and timeouts of every request to an AdaptiveRate.
+    """
+
+    def __init__(self, rate_control, **kwargs):
+        self.rate_control = rate_control
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        started = self.rate_control.last_sent = time.monotonic()
+        try:
+            response = super().send(request, **kwargs)
+        except requests.Timeout:
+            self.rate_control.record(timeout=True)
+            raise
+        self.rate_control.record(status=response.status_code, latency=time.monotonic() - started)
+        return response
+
+
+class RateRegistry:
+    """
+    Keeps one AdaptiveRate per (website, proxy) and, if it has a path, persists the learned intervals between
+    runs in a JSON file. Without a path the intervals are only kept for the life of the process.
+
+    Example:
+        RATE_REGISTRY.configure(RATES_PATH)  # optional, persist the intervals next to this module
+        rate_control = RATE_REGISTRY.attach('ksl.com', current_user, session, interval=3)
+        ...
+        RATE_REGISTRY.report(rate_control, user_telemetry)
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str, optional): The JSON file of the learned intervals (default is None, nothing is read or written).
+        """
+        self.path = path
+        self.controllers = {}
+        self.saved = None
+        self.lock = threading.Lock()
+
+    def configure(self, path):
+        """
+        Sets the JSON file the intervals are persisted in. Its saved intervals are used by the controllers
+        created from now on.
+        """
+        with self.lock:
+            self.path = path
+            self.saved = None
+
+    def load(self):
+        if self.saved is None:
+            if self.path is None:
+                self.saved = {}
+                return self.saved
+            try:
+                with open(self.path) as file:
+                    self.saved = json.load(file)
+            except (OSError, json.JSONDecodeError):
+                self.saved = {}
+        return self.saved
+
+    def get(self, website, proxy, interval):
+        """
+        Returns the controller of a (website, proxy), starting from the saved interval or `interval`.
+        """
+        key = f"{website}|{proxy}"
+        with self.lock:
+            if key not in self.controllers:
+                saved = self.load().get(key, {})
+                rate_control = AdaptiveRate(saved.get('interval', interval))
+                rate_control.latency = saved.get('latency')
+                self.controllers[key] = rate_control
+            return self.controllers[key]
+
+    def attach(self, website, current_user, session, interval):
+        """
+        Returns the controller of the task's website and proxy, attached to the session.
+        """
+        rate_control = self.get(website, ProxyHealth.key(current_user), interval)
+        rate_control.attach(session)
+        return rate_control
+
+    def save(self):
+        with self.lock:
+            if self.path is None:
+                return
+            state = {**self.load(), **{key: rate_control.to_dict() for key, rate_control in self.controllers.items()}}
+            self.saved = state
+            with open(self.path, 'w') as file:
+                json.dump(state, file, indent=2)
+
+    def report(self, rate_control, user_telemetry):
+        """
+        Add the learned interval to user_telemetry and persist every controller if the registry has a path.
+        """
+        if rate_control is None:
+            return user_telemetry
+        user_telemetry['RequestInterval'] = round(rate_control.interval, 3)
+        self.save()
+        return user_telemetry
+
+
+def pause(sleep_time, rate_limiter=None):
+    """
+    Wait between two sequential requests: the fixed sleep_time, or the next slot of rate_limiter
+    (a TokenBucket or an AdaptiveRate) when one is given.
+    """
+    if rate_limiter is None:
+        time.sleep(sleep_time)
+    else:
+        rate_limiter.acquire()
+
+
+# %% [markdown]
+# ## Pipeline
+
+# %%
+def iter_pipeline(pages, compare_page, fetch_item, max_workers=5, stop=None):
+    """
+    Overlap the search, compare and detail stages of a task.
+
+    Every search page is compared as soon as it arrives, and the new items it returns are queued on a
+    thread pool for their detail requests right away, while the next search page is still downloading.
+
+    Args:
+        pages (iterator): Yields (page, page_errors) for every search page, e.g. a site's IterSearchListings.
+        compare_page (function): compare_page(page) returns the list of new items of the page to fetch details for.
+        fetch_item (function): fetch_item(item) fetches the details of one item. It runs on the thread pool and
+                               should take care of its own rate limiting and error capture.
+        max_workers (int): Maximum number of detail requests in flight at once.
+        stop (threading.Event): Optional event fetch_item sets when the remaining requests should not be sent,
+                                e.g. once the session is blocked. No more search pages are read after it is set
+                                and the queued items that have not started are cancelled.
+
+    Yields:
+        tuple: ('page', page, page_errors, new_items) for every search page once it has been compared, and
+               ('detail', item, result) for every item, in the order the items were queued. Details that finish
+               while the search is still running are yielded between pages. Cancelled items are not yielded.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        queued = deque()
+        try:
+            for page, page_errors in pages:
+                new_items = compare_page(page)
+                for item in new_items:
+                    queued.append((item, executor.submit(fetch_item, item)))
+                yield 'page', page, page_errors, new_items
+
+                while queued and queued[0][1].done():
+                    item, future = queued.popleft()
+                    yield 'detail', item, future.result()
+                if stop is not None and stop.is_set():
+                    break
+
+            while queued:
+                if stop is not None and stop.is_set():
+                    for item, future in queued:
+                        future.cancel()
+                item, future = queued.popleft()
+                if not future.cancelled():
+                    yield 'detail', item, future.result()
+        finally:
+            # Stop queued requests if the consumer stops early
+            for item, future in queued:
+                future.cancel()
+
+
+# %% [markdown]
+# ## HTTP Cache
+
+# %%
+class HttpCache:
+    """
+    Conditional-request cache for search endpoints.
+
+    For every endpoint and query the cache keeps the ETag / Last-Modified validators of the last response
+    together with the page parsed from it. The next identical request sends If-None-Match / If-Modified-Since,
+    and on a 304 Not Modified the caller reuses the stored page instead of downloading and parsing it again.
+
+    Example:
+        cache_key = HTTP_CACHE.key(url, params)
+        response = session.get(url, params=params, headers={**headers, **HTTP_CACHE.validators(cache_key)})
+        if HTTP_CACHE.not_modified(cache_key, response):
+            page = HTTP_CACHE.get(cache_key)
+        else:
+            response.raise_for_status()
+            page = response.json()
+            HTTP_CACHE.store(cache_key, response, page)
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, *parts):
+        """
+        Build the cache key of a request from its endpoint and query (url, params, json body, ...).
+
+        Returns:
+            str: The key.
+        """
+        return json.dumps(parts, sort_keys=True, default=str)
+
+    def validators(self, cache_key):
+        """
+        Returns:
+            dict: The conditional request headers for the key (empty if nothing is stored).
+        """
+        with self.lock:
+            entry = self.entries.get(cache_key)
+        if entry is None:
+            return {}
+
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def not_modified(self, cache_key, response):
+        """
+        Returns:
+            bool: True if the response is a 304 and a page is stored for the key.
+        """
+        with self.lock:
+            return response.status_code == 304 and cache_key in self.entries
+
+    def get(self, cache_key):
+        """
+        Returns:
+            The page stored for the key, or None.
+        """
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(cache_key)
+            entry['hits'] += 1
+            return entry['data']
+
+    def store(self, cache_key, response, data):
+        """
+        Store the parsed page of a response if the response has an ETag or Last-Modified validator.
+
+        Args:
+            cache_key (str): The key of the request.
+            response (requests.Response): The 200 response.
+            data: The page parsed from the response.
+        """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        with self.lock:
+            if not etag and not last_modified:
+                self.entries.pop(cache_key, None)
+                return
+            self.entries[cache_key] = {'etag': etag, 'last_modified': last_modified, 'data': data, 'hits': 0}
+            self.entries.move_to_end(cache_key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+# Process wide cache shared by every task, so polls from new sessions still send conditional requests
+HTTP_CACHE = HttpCache()
+
+
+# %% [markdown]
+# ## Detail Cache
+
+# %%
+class DetailCache:
+    """
+    Persistent SQLite cache of listing detail payloads keyed by (website, id).
+
+    GetListingDetails consults the cache before going to the network, so a listing whose details were already
+    fetched (after a DB reset, overlapping tasks or a crash before the results were saved) is not requested again.
+
+    Entries can carry a version (e.g. the Autotrader lastModified or the Craigslist posted date from the search
+    results). When a version is given on lookup, an entry stored with a different version is a miss. Entries
+    older than `ttl` seconds are misses, and evict() drops them and trims the cache to `max_entries`.
+
+    Example:
+        detail_cache = DetailCache('thor_detail_cache.db', ttl=7 * 24 * 3600)
+        listing_details, errors = GetListingDetails(session, new_ids, detail_cache=detail_cache)
+    """
+
+    def __init__(self, path='thor_detail_cache.db', ttl=7 * 24 * 3600, max_entries=50000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS details ("
+                "website TEXT NOT NULL, id TEXT NOT NULL, version TEXT, payload TEXT NOT NULL, stored_at REAL NOT NULL, "
+                "PRIMARY KEY (website, id))"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS details_stored_at ON details (stored_at)")
+
+    def get_many(self, website, ids, versions=None):
+        """
+        Look up the cached payloads of many listings.
+
+        Args:
+            website (str): The website, e.g. 'autotrader.com'.
+            ids (list): The listing ids.
+            versions (dict, optional): {id: version} of the listings. Ids that are not in versions match any stored version.
+
+        Returns:
+            dict: {id: payload} for every hit, using the ids as they were passed in.
+        """
+        ids = list(ids)
+        if not ids:
+            return {}
+        keys = {str(id): id for id in ids}
+        oldest = time.time() - self.ttl
+
+        rows = []
+        key_list = list(keys)
+        with self.lock:
+            for start in range(0, len(key_list), 500):
+                chunk = key_list[start:start + 500]
+                rows.extend(self.connection.execute(
+                    f"SELECT id, version, payload FROM details WHERE website = ? AND stored_at >= ? AND id IN ({','.join('?' * len(chunk))})",
+                    [website, oldest, *chunk]
+                ).fetchall())
+
+        hits = {}
+        for key, version, payload in rows:
+            id = keys[key]
+            if versions is not None and id in versions and versions[id] is not None and str(versions[id]) != version:
+                continue
+            hits[id] = json.loads(payload)
+        return hits
+
+    def split(self, website, ids, versions=None):
+        """
+        Split ids into cache hits and the ids that still have to be fetched.
+
+        Returns:
+            tuple: ({id: payload} for the hits, [ids] of the misses in their original order).
+        """
+        hits = self.get_many(website, ids, versions)
+        return hits, [id for id in ids if id not in hits]
+
+    def put(self, website, id, payload, version=None):
+        """
+        Store the detail payload of a listing.
+
+        Args:
+            website (str): The website, e.g. 'autotrader.com'.
+            id: The listing id.
+            payload: The JSON serializable detail payload.
+            version (optional): The version of the listing.
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO details (website, id, version, payload, stored_at) VALUES (?, ?, ?, ?, ?)",
+                [website, str(id), None if version is None else str(version), json.dumps(payload, default=str), time.time()]
+            )
+
+    def evict(self):
+        """
+        Drop expired entries and trim the cache to max_entries, oldest first.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        with self.lock, self.connection:
+            removed = self.connection.execute("DELETE FROM details WHERE stored_at < ?", [time.time() - self.ttl]).rowcount
+            removed += self.connection.execute(
+                "DELETE FROM details WHERE rowid IN (SELECT rowid FROM details ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                [self.max_entries]
+            ).rowcount
+        return removed
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def listing_versions(search_results, version_column, key='id'):
+    """
+    Builds the {id: version} map used by DetailCache lookups from a search results DataFrame.
+
+    Returns:
+        dict: {id: version}, or None if search_results has no version_column.
+    """
+    if search_results is None or search_results.empty or version_column not in search_results.columns or key not in search_results.columns:
+        return None
+    return dict(zip(search_results[key], search_results[version_column]))
+
+
+# %% [markdown]
+# ## Seen Index
+
+# %%
+class SeenIndex:
+    """
+    Persistent per-site index of the listing ids that have already been seen, usable as a drop-in
+    results_check_callback for every Task_Run.
+
+    Every id is stored in SQLite with the time it was first seen. In memory each site keeps its numeric ids in a
+    sorted int64 array (8 bytes per id, checked with a vectorized binary search) plus a small set of ids added
+    since the last compaction, so a 10k id membership check takes a few milliseconds. compact() merges the set
+    into the array and expire() drops ids older than max_age.
+
+    The compare only reads the index. Every Task_Run commits the new ids through commit_seen() once Format_Output
+    has built their Listings, so a run that fails before its output reports the same listings again next time.
+
+    Example:
+        seen_index = SeenIndex('thor_seen_index.db')
+        for results in Task_Run(driver, profile, task, user, seen_index, user_timer):
+            ...
+    """
+
+    def __init__(self, path='thor_seen_index.db', max_age=30 * 24 * 3600, compact_threshold=10000, mark_seen=False):
+        """
+        Args:
+            path (str): The SQLite database file.
+            max_age (int): Seconds after which expire() forgets an id.
+            compact_threshold (int): Number of recently added ids that triggers compact().
+            mark_seen (bool): If True, calling the index as a results_check_callback already records the new ids,
+                before the Task_Run has formatted them (default is False, they are recorded by commit()).
+        """
+        self.path = path
+        self.max_age = max_age
+        self.compact_threshold = compact_threshold
+        self.mark_seen = mark_seen
+        self.lock = threading.RLock()
+        self.sites = {}
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS seen ("
+                "website TEXT NOT NULL, id TEXT NOT NULL, first_seen REAL NOT NULL, PRIMARY KEY (website, id))"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS seen_first_seen ON seen (first_seen)")
+
+    def __call__(self, search_results, website, compare_columns):
+        """
+        results_check_callback interface: returns the rows of search_results whose id has not been seen yet.
+
+        Args:
+            search_results (DataFrame): The search results of the task.
+            website (str): The website, e.g. 'craigslist.com'.
+            compare_columns (dict): {search_results column: stored column}. The first column holds the listing id.
+
+        Returns:
+            DataFrame: The new rows of search_results.
+        """
+        print('Function: SeenIndex')
+
+        id_column = next(iter(compare_columns))
+        if search_results.empty or id_column not in search_results.columns:
+            return search_results
+
+        ids = search_results[id_column].to_list()
+        new_rows = search_results[~self.contains(website, ids)]
+        if self.mark_seen:
+            self.add(website, new_rows[id_column].to_list())
+        return new_rows
+
+    @staticmethod
+    def split_ids(ids):
+        """
+        Splits ids into an int64 array of the numeric ids and a set of the other ids as strings.
+        """
+        ids = list(ids)
+        try:
+            return np.asarray(ids, dtype=np.int64), set()
+        except (TypeError, ValueError, OverflowError):
+            pass
+
+        numeric = []
+        other = set()
+        for id in ids:
+            try:
+                numeric.append(int(id))
+            except (TypeError, ValueError):
+                if id is not None:
+                    other.add(str(id))
+        return np.array(numeric, dtype=np.int64), other
+
+    def site(self, website):
+        """
+        Returns the in-memory index of a site, loading it from SQLite the first time.
+        """
+        with self.lock:
+            if website not in self.sites:
+                rows = self.connection.execute("SELECT id FROM seen WHERE website = ?", [website]).fetchall()
+                numeric, other = self.split_ids(row[0] for row in rows)
+                self.sites[website] = {'ids': np.unique(numeric), 'recent': set(), 'other': other}
+            return self.sites[website]
+
+    def contains(self, website, ids):
+        """
+        Vectorized membership check.
+
+        Args:
+            website (str): The website, e.g. 'craigslist.com'.
+            ids (list): The listing ids.
+
+        Returns:
+            np.ndarray: A boolean array, True where the id has been seen.
+        """
+        with self.lock:
+            site = self.site(website)
+            try:
+                keys = np.asarray(ids, dtype=np.int64)
+            except (TypeError, ValueError, OverflowError):
+                # Mixed ids, check them one at a time
+                seen = np.zeros(len(ids), dtype=bool)
+                for index, id in enumerate(ids):
+                    numeric, other = self.split_ids([id])
+                    seen[index] = bool(other & site['other']) if other else bool(self.contains(website, numeric).any())
+                return seen
+
+            seen = np.zeros(len(keys), dtype=bool)
+            if len(site['ids']):
+                positions = np.searchsorted(site['ids'], keys)
+                positions[positions == len(site['ids'])] = 0
+                seen = site['ids'][positions] == keys
+            if site['recent']:
+                recent = np.fromiter(site['recent'], dtype=np.int64, count=len(site['recent']))
+                seen |= np.isin(keys, recent)
+            return seen
+
+    def add(self, website, ids):
+        """
+        Records ids as seen. Ids that were already seen keep their first seen time.
+        """
+        ids = [id for id in ids if id is not None and id != '']
+        if not ids:
+            return
+        now = time.time()
+        with self.lock:
+            site = self.site(website)
+            numeric, other = self.split_ids(ids)
+            site['recent'].update(numeric.tolist())
+            site['other'].update(other)
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO seen (website, id, first_seen) VALUES (?, ?, ?)",
+                    [(website, str(id), now) for id in ids]
+                )
+            if len(site['recent']) >= self.compact_threshold:
+                self.compact(website)
+
+    def commit(self, website, ids):
+        """
+        Records the ids of the listings a Task_Run has formatted, see commit_seen().
+        """
+        self.add(website, ids)
+
+    def compact(self, website=None):
+        """
+        Merges the recently added ids into the sorted array of each site (or only of website).
+        """
+        with self.lock:
+            for name in ([website] if website else list(self.sites)):
+                site = self.site(name)
+                if site['recent']:
+                    recent = np.fromiter(site['recent'], dtype=np.int64, count=len(site['recent']))
+                    site['ids'] = np.union1d(site['ids'], recent)
+                    site['recent'] = set()
+
+    def expire(self, max_age=None):
+        """
+        Forgets ids first seen more than max_age seconds ago and rebuilds the in-memory index.
+
+        Returns:
+            int: The number of ids removed.
+        """
+        max_age = self.max_age if max_age is None else max_age
+        with self.lock:
+            with self.connection:
+                removed = self.connection.execute("DELETE FROM seen WHERE first_seen < ?", [time.time() - max_age]).rowcount
+            self.sites = {}
+        return removed
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def commit_seen(results_check_callback, website, ids):
+    """
+    Commits ids to the results_check_callback once their Listings have been formatted, if the callback keeps
+    its own record of the seen ids (e.g. a SeenIndex). Other callbacks are left alone.
+
+    Args:
+        results_check_callback (function): The results_check_callback of the Task_Run.
+        website (str): The website, e.g. 'craigslist.com'.
+        ids (list): The listing ids that were formatted.
+    """
+    commit = getattr(results_check_callback, 'commit', None)
+    if commit is not None and ids:
+        commit(website, ids)
+
+
+# %% [markdown]
+# ## Session Pool
+
+# %%
+class SessionPool:
+    """
+    Pool of requests sessions shared by every Task_Run, keyed by (website, proxy, account).
+
+    Reusing the session keeps its cookies and its open keep-alive connections, so a scheduled task does not pay
+    new TCP, TLS and proxy handshakes on every poll. Each session gets HTTPAdapters sized for the concurrent
+    search and detail workers. A session that has been idle longer than idle_timeout has its connections closed
+    (the cookies are kept) before it is lent again, and evict() drops a session for good, e.g. once it is blocked.
+
+    Example:
+        session = SESSION_POOL.borrow(SessionPool.key('ksl.com', current_user), lambda: build_session(current_user))
+        ...
+        if is_blocked:
+            SESSION_POOL.evict(session)
+    """
+
+    def __init__(self, idle_timeout=300, max_sessions=32, pool_connections=10, pool_maxsize=20):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(website, current_user):
+        """
+        Build the pool key of a task from its website and the user's proxy and account.
+
+        Returns:
+            tuple: (website, proxy, account).
+        """
+        account = (current_user.get('AccountInfo') or {}).get('AccountID', '')
+        return website, ProxyHealth.key(current_user), account
+
+    def mount(self, session):
+        """
+        Mount HTTPAdapters with the pool sizes of the pool on a session.
+        """
+        for prefix in ('https://', 'http://'):
+            session.mount(prefix, HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize))
+
+    def borrow(self, pool_key, factory):
+        """
+        Returns the pooled session for pool_key, building it with factory() the first time.
+
+        Args:
+            pool_key (tuple): The key from SessionPool.key.
+            factory (function): Builds a new, configured requests.Session.
+
+        Returns:
+            requests.Session: The session. It may be used by several tasks at once, like the sessions shared
+                              by the worker threads of a single task.
+        """
+        now = time.time()
+        expired = []
+        with self.lock:
+            entry = self.sessions.get(pool_key)
+            if entry is None:
+                session = factory()
+                self.mount(session)
+                entry = self.sessions[pool_key] = {'session': session, 'last_used': now}
+                while len(self.sessions) > self.max_sessions:
+                    expired.append(self.sessions.popitem(last=False)[1]['session'])
+            elif now - entry['last_used'] > self.idle_timeout:
+                # Idle connections were most likely dropped by the server or the proxy, open new ones
+                entry['session'].close()
+            entry['last_used'] = now
+            self.sessions.move_to_end(pool_key)
+
+        for session in expired:
+            session.close()
+        return entry['session']
+
+    def evict(self, session):
+        """
+        Remove a session (or a pool key) from the pool and close its connections.
+
+        Returns:
+            bool: True if it was pooled.
+        """
+        with self.lock:
+            pool_key = session if session in self.sessions else next(
+                (key for key, entry in self.sessions.items() if entry['session'] is session), None
+            )
+            entry = self.sessions.pop(pool_key, None)
+        if entry is None:
+            return False
+        entry['session'].close()
+        return True
+
+    def clear(self):
+        with self.lock:
+            entries = list(self.sessions.values())
+            self.sessions.clear()
+        for entry in entries:
+            entry['session'].close()
+
+
+# Process wide pool shared by every task
+SESSION_POOL = SessionPool()
+
+
+# %% [markdown]
+# ## Proxy Health
+
+# %%
+class ProxyHealth:
+    """
+    TTL cache of proxy health verdicts, so check_proxy does not add an icanhazip round trip to every Task_Run.
+
+    verify() runs the check only when the proxy has no healthy verdict younger than ttl. Healthy proxies are
+    re-validated by a background thread before their verdict expires, so a task normally only pays for a
+    dictionary lookup. invalidate() drops the verdict after a failed request, and the next task checks again.
+    Failed checks are never cached.
+
+    Example:
+        proxy_set = PROXY_HEALTH.verify(ProxyHealth.key(current_user), ProxyHealth.checker(check_proxy, session.proxies, ip))
+    """
+
+    def __init__(self, ttl=600, background=True):
+        self.ttl = ttl
+        self.background = background
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def key(current_user):
+        """
+        Returns:
+            str: 'ip:port' of the user's proxy, or '' when no proxy is configured.
+        """
+        proxy_info = current_user.get('ProxyInfo') or {}
+        if not proxy_info.get('ProxyIp'):
+            return ''
+        return f"{proxy_info['ProxyIp']}:{proxy_info.get('ProxyPort', '')}"
+
+    @staticmethod
+    def checker(check_proxy, proxies, ip):
+        """
+        Builds the check of a proxy for verify(). Every run uses its own plain requests.Session with a copy of
+        proxies, never the pooled task session: the background re-validation would otherwise share it with a
+        running task, and a RateAdapter mounted on it would count the icanhazip requests as site requests.
+
+        Args:
+            check_proxy (function): The site's check_proxy(session, ip).
+            proxies (dict): The proxies of the task session.
+            ip (str): The expected IP address of the proxy.
+
+        Returns:
+            function: The check, returns True if the proxy works.
+        """
+        proxies = dict(proxies)
+
+        def check():
+            with requests.Session() as session:
+                session.proxies.update(proxies)
+                return check_proxy(session, ip)
+        return check
+
+    def is_healthy(self, proxy):
+        """
+        Fast lookup of the cached verdict.
+
+        Returns:
+            bool: True if the proxy passed a check less than ttl seconds ago.
+        """
+        with self.lock:
+            entry = self.entries.get(proxy)
+            return entry is not None and entry['healthy'] and time.time() - entry['checked_at'] < self.ttl
+
+    def record(self, proxy, healthy, check=None):
+        with self.lock:
+            entry = self.entries.setdefault(proxy, {'check': check})
+            entry['healthy'] = healthy
+            entry['checked_at'] = time.time()
+            if check is not None:
+                entry['check'] = check
+
+    def verify(self, proxy, check):
+        """
+        Returns the cached verdict of the proxy, or runs check() when there is no fresh healthy verdict.
+
+        Args:
+            proxy (str): The proxy key from ProxyHealth.key.
+            check (function): Runs the check, see checker. Returns True if the proxy works. It is kept for the
+                              background re-validation, so it must not use the pooled task session.
+
+        Returns:
+            bool: True if the proxy works.
+        """
+        if self.is_healthy(proxy):
+            print(f'Proxy {proxy} healthy (cached)')
+            return True
+
+        healthy = check()
+        self.record(proxy, healthy, check)
+        if healthy and self.background:
+            self.start()
+        return healthy
+
+    def invalidate(self, proxy):
+        """
+        Drop the verdict of a proxy after a failed request.
+        """
+        with self.lock:
+            self.entries.pop(proxy, None)
+
+    def revalidate(self):
+        """
+        Re-run the check of every healthy proxy whose verdict is older than half the ttl.
+        """
+        now = time.time()
+        with self.lock:
+            due = [(proxy, entry['check']) for proxy, entry in self.entries.items()
+                   if entry['healthy'] and entry['check'] is not None and now - entry['checked_at'] > self.ttl / 2]
+        for proxy, check in due:
+            try:
+                healthy = check()
+            except Exception as e:
+                print(f'Error revalidating proxy {proxy}: {e}')
+                healthy = False
+            with self.lock:
+                if proxy in self.entries:
+                    self.entries[proxy]['healthy'] = healthy
+                    self.entries[proxy]['checked_at'] = time.time()
+
+    def start(self):
+        """
+        Start the background re-validation thread if it is not running.
+        """
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.ttl / 4):
+            self.revalidate()
+
+    def stop(self):
+        self.stopped.set()
+
+
+# Process wide registry shared by every task
+PROXY_HEALTH = ProxyHealth()
+
+
+# %% [markdown]
+# ## Block Detection
+
+# %%
+# Status codes that mean the session or proxy is blocked rather than the request failing
+BLOCKED_STATUS_CODES = (401, 403, 407, 429)
+
+# Page errors that check_blocked also treats as blocked: a refused request or an unexpected JSON shape
+BLOCKED_ERROR_NAMES = ('Blocked', 'JSONDecodeError', 'KeyError')
+
+
+def request_error_name(e):
+    """
+    ErrorName of a requests exception: 'Blocked' for a response with one of the BLOCKED_STATUS_CODES,
+    'ClientError' for any other 4xx response but 408 Request Timeout (e.g. a 404 or 410 for a listing that was
+    taken down, retrying will not change it), 'RequestException' otherwise.
+    """
+    response = getattr(e, 'response', None)
+    if response is not None and response.status_code in BLOCKED_STATUS_CODES:
+        return 'Blocked'
+    if response is not None and 400 <= response.status_code < 500 and response.status_code != 408:
+        return 'ClientError'
+    return 'RequestException'
+
+
+def first_page_blocked(pages, probe):
+    """
+    Derives the check_blocked verdict from the first page of a search instead of a separate probe request.
+
+    A first page without errors means the session is not blocked. A 'Blocked' status or a JSON shape error is
+    classified as blocked, the same way check_blocked classifies its own probe. Only an ambiguous failure
+    (a timeout or a connection error) runs the standalone probe.
+
+    Args:
+        pages (iterator): The (page, errors) tuples of IterSearchListings. Nothing is requested until it is read.
+        probe (function): Runs the site's check_blocked and returns (is_blocked, blocked_errors).
+
+    Returns:
+        tuple: (is_blocked, blocked_errors, pages), where pages still yields the first page.
+    """
+    print('Function: first_page_blocked')
+
+    pages = iter(pages)
+    first = next(pages, None)
+    if first is None:
+        return False, {}, pages
+
+    page_errors = first[1]
+    pages = itertools.chain([first], pages)
+    if not page_errors:
+        return False, {}, pages
+
+    error_info = page_errors[0]
+    if error_info.get('ErrorName') in BLOCKED_ERROR_NAMES:
+        print(f"First search page blocked: {error_info.get('ErrorDescription')}")
+        return True, {
+            "ErrorName": "Blocked",
+            "ErrorTime": error_info.get('ErrorTime', datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+            "ErrorDescription": error_info.get('ErrorDescription', "Error loading search page"),
+        }, pages
+
+    print('First search page failed, running the block probe')
+    is_blocked, blocked_errors = probe()
+    return is_blocked, blocked_errors, pages
+
+
+def task_blocked(session, current_user, proxy_set, search_pages, probe, block_probe=True):
+    """
+    Block check shared by every Task_Run.
+
+    Runs probe, or with block_probe=False derives the verdict from the first search page (see first_page_blocked).
+    A blocked session, or one without a proxy, is evicted from SESSION_POOL and the health of its proxy is
+    invalidated, so the next task starts over with a new session.
+
+    Args:
+        session (requests.Session): The session of the task.
+        current_user (dict): The user of the task.
+        proxy_set (bool): False if create_session could not set the proxy, the probe always runs then.
+        search_pages (iterator): The (page, errors) tuples of IterSearchListings, not started yet.
+        probe (function): Runs the site's check_blocked and returns (is_blocked, blocked_errors).
+        block_probe (bool): Run probe even when the first search page could answer (default is True).
+
+    Returns:
+        tuple: (errors, search_pages). errors is None if the task can go on, else the
+               {"Disable": True, "error_data": [blocked_errors]} dictionary the Task_Run yields.
+               search_pages still yields the first page.
+    """
+    print('Function: task_blocked')
+
+    if block_probe or proxy_set == False:
+        is_blocked, blocked_errors = probe()
+    else:
+        #The first search page doubles as the block check, the probe only runs if that page fails ambiguously
+        is_blocked, blocked_errors, search_pages = first_page_blocked(search_pages, probe)
+    print(f"is blocked: {is_blocked}")
+    if not is_blocked and proxy_set != False:
+        return None, search_pages
+
+    return disable_session(session, current_user, [blocked_errors]), search_pages
+
+
+def disable_session(session, current_user, error_data):
+    """
+    Evicts a blocked session from SESSION_POOL and invalidates the health of its proxy, so the next task
+    starts over with a new session.
+
+    Returns:
+        dict: The {"Disable": True, "error_data": error_data} dictionary the Task_Run yields.
+    """
+    print('Function: disable_session')
+
+    errors = {"Disable": True, "error_data": error_data}
+    print(errors)
+    SESSION_POOL.evict(session)
+    PROXY_HEALTH.invalidate(ProxyHealth.key(current_user))
+    return errors
+
+
+def task_errors(session, current_user, error_data):
+    """
+    Final errors dictionary of a Task_Run from the error records collected during the task.
+
+    Returns:
+        dict: {} if the task can go on, or the disable_session dictionary with the 'Blocked' records if a
+              request of the task was blocked.
+    """
+    print('Function: task_errors')
+
+    if not RetryPolicy.fatal(error_data):
+        return {}
+    blocked_errors = [error_info for error_info in error_data if error_info.get('ErrorName') == 'Blocked']
+    return disable_session(session, current_user, blocked_errors)
+
+# %% [markdown]
+# ## Retry Policy
+
+# %%
+class RetryPolicy:
+    """
+    Retries a failed request with exponential backoff and jitter, classified by the ErrorName of the
+    error records the fetch functions return.
+
+    Timeouts and connection errors are usually transient and are retried the most. A JSON or shape error
+    is retried once in case the response was cut off. A 'ClientError' (a 4xx such as 404) is never retried,
+    and neither is a 'Blocked' response: the fetch loops stop and the Task_Run disables the session (see
+    task_errors). The n-th retry waits base * 2**n seconds (capped at max_delay), minus a random share of up
+    to `jitter` so workers that failed together do not retry together.
+
+    Example:
+        json_items, errors = RETRY_POLICY.call(GetListingDetail, session, id)
+    """
+
+    def __init__(self, retries=None, base=1.0, max_delay=30.0, jitter=0.5):
+        self.retries = {'Timeout': 2, 'RequestException': 2, 'JSONDecodeError': 1, 'KeyError': 1, 'ClientError': 0, 'Blocked': 0, **(retries or {})}
+        self.base = base
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def backoff(self, errors, attempt):
+        """
+        Seconds to wait before retrying a fetch that returned `errors` on its attempt-th retry (0 for the
+        first request), or None when it should not be retried.
+        """
+        if not errors:
+            return None
+        error_name = errors[-1].get('ErrorName')
+        if attempt >= self.retries.get(error_name, 0):
+            return None
+        delay = min(self.max_delay, self.base * 2 ** attempt)
+        delay *= 1 - self.jitter * random.random()
+        print(f"{error_name}, retry {attempt + 1} of {self.retries[error_name]} in {delay:.1f}s")
+        return delay
+
+    def call(self, fetch, *args, **kwargs):
+        """
+        Call fetch(*args, **kwargs), which returns (result, errors), until it succeeds or its errors
+        are out of retries.
+
+        Returns:
+            tuple: The (result, errors) of the last attempt.
+        """
+        attempt = 0
+        while True:
+            result, errors = fetch(*args, **kwargs)
+            delay = self.backoff(errors, attempt)
+            if delay is None:
+                return result, errors
+            time.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def fatal(errors):
+        """
+        True if the errors mean the remaining requests of a loop should not be sent (the session is blocked).
+        """
+        return any(error_info.get('ErrorName') == 'Blocked' for error_info in errors)
+
+
+# File next to this module for persisting the learned request rates, see RateRegistry.configure
+RATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thor_rates.json')
+
+# Process wide registry of the learned request rates, kept in memory until a path is configured
+RATE_REGISTRY = RateRegistry()
+
+# Default retry policy of the fetch loops
+RETRY_POLICY = RetryPolicy()